@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+'''Benchmark deciding a batch of checks serially against the process pool
+
+Builds rule sets for a number of principals, decides the same random
+checks in this process and through the pool, checking both agree, to
+show whether a batch of that shape is worth sending to the pool with
+AUTHZ_BATCH_PARALLEL_THRESHOLD.
+
+Usage: batch_decisions.py [PRINCIPALS] [RULES] [CHECKS] [PROCESSES]
+'''
+from random import Random
+from sys import argv
+from time import perf_counter
+
+from demo_app_iam_service.authz.batch import decide
+from demo_app_iam_service.rules.dao import Rule
+from demo_app_iam_service.rules.engine import RuleSet
+
+
+CHUNK_SIZE = 500
+
+
+def rule_set(principal, count):
+    return RuleSet([
+        Rule('policy%d' % principal, effect='allow',
+             action='service:%d' % (index % 50),
+             resource='projects/%d/*' % index)
+        for index in range(count)
+    ])
+
+
+def timed(rule_sets, checks, processes, threshold):
+    start = perf_counter()
+    decisions = list(decide(rule_sets, checks, processes=processes,
+                            threshold=threshold, chunk_size=CHUNK_SIZE))
+    return perf_counter() - start, decisions
+
+
+def main(principals, rule_count, check_count, processes):
+    random = Random(0)
+    rule_sets = {
+        ('user', 'user%d' % principal): rule_set(principal, rule_count)
+        for principal in range(principals)
+    }
+    checks = [
+        (('user', 'user%d' % random.randrange(principals)),
+         'service:%d' % random.randrange(50),
+         'projects/%d/objects' % random.randrange(rule_count))
+        for _ in range(check_count)
+    ]
+
+    # Start the pool's processes before timing it
+    timed(rule_sets, checks[:CHUNK_SIZE * 2], processes, 1)
+
+    serial_time, serial = timed(rule_sets, checks, processes, 0)
+    pool_time, pooled = timed(rule_sets, checks, processes, 1)
+    assert serial == pooled
+
+    print('%d principals of %d rules, %d checks' % (
+        principals, rule_count, check_count))
+    print('serial %8.1fms' % (serial_time * 1e3))
+    print('pool   %8.1fms' % (pool_time * 1e3))
+
+
+if __name__ == '__main__':
+    main(int(argv[1]) if len(argv) > 1 else 16,
+         int(argv[2]) if len(argv) > 2 else 10000,
+         int(argv[3]) if len(argv) > 3 else 5000,
+         int(argv[4]) if len(argv) > 4 else 0)
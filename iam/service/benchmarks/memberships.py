@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+'''Benchmark UsersDAO.list and GroupsDAO.list with heavy memberships
+
+Seeds users that each belong to many groups and have many policies attached
+inside a transaction that is rolled back afterwards, then times both list
+calls at increasing membership counts.  Time per membership should stay
+roughly flat; with a cartesian join it grows with groups x policies.
+
+Seeded names have a prefix of their own for each run, so the database
+doesn't need to be empty.
+
+Usage: memberships.py [USERS] [MAX_MEMBERSHIPS]
+'''
+from sqlalchemy.sql import func, select
+from sys import argv
+from time import perf_counter
+from uuid import uuid4
+
+from demo_app_iam_service.app import app
+from demo_app_iam_service.db import db, user_table, group_table, \
+    policy_table, user_group_table, user_policy_table, group_policy_table
+from demo_app_iam_service.groups.dao import GroupsDAO
+from demo_app_iam_service.users.dao import UsersDAO
+
+
+def seed(session, prefix, users, memberships):
+    emails = ['{}-user{}@example.com'.format(prefix, i) for i in range(users)]
+    groups = ['{}-group{}'.format(prefix, i) for i in range(memberships)]
+    policies = ['{}-policy{}'.format(prefix, i) for i in range(memberships)]
+
+    session.execute(user_table.insert(), [{'email': e} for e in emails])
+    session.execute(group_table.insert(), [{'name': g} for g in groups])
+    session.execute(policy_table.insert(), [{'name': p} for p in policies])
+    session.execute(user_group_table.insert(), [
+        {'user': e, 'group': g} for e in emails for g in groups
+    ])
+    session.execute(user_policy_table.insert(), [
+        {'user': e, 'policy': p} for e in emails for p in policies
+    ])
+    session.execute(group_policy_table.insert(), [
+        {'group': g, 'policy': p} for g in groups for p in policies
+    ])
+    return emails, groups
+
+
+def count(session, table):
+    return session.execute(select([func.count()]).select_from(table)) \
+        .scalar()
+
+
+def measure(session, users, memberships):
+    existing = {'users': count(session, user_table),
+                'groups': count(session, group_table)}
+    emails, groups = seed(session, uuid4().hex[:8], users, memberships)
+    seeded = {'users': set(emails), 'groups': set(groups)}
+
+    results = {}
+    for name, dao, key in (('users', UsersDAO, 'email'),
+                           ('groups', GroupsDAO, 'name')):
+        start = perf_counter()
+        entities = dao(session).list()
+        results[name] = perf_counter() - start
+        assert len(entities) == existing[name] + len(seeded[name])
+
+        # Each seeded entity carries all of its memberships, once
+        ours = [entity for entity in entities
+                if getattr(entity, key) in seeded[name]]
+        assert len(ours) == len(seeded[name])
+        assert all(len(entity.policies) == memberships for entity in ours)
+
+    session.rollback()
+    return results
+
+
+def main(users=100, max_memberships=80):
+    with app.app_context():
+        session = db.session
+        print('{:>12} {:>12} {:>12} {:>18}'.format(
+            'memberships', 'users (s)', 'groups (s)', 'us/membership'))
+
+        memberships = 10
+        while memberships <= max_memberships:
+            results = measure(session, users, memberships)
+            total = users * memberships * 2
+            print('{:12d} {:12.4f} {:12.4f} {:18.2f}'.format(
+                memberships, results['users'], results['groups'],
+                1e6 * results['users'] / total))
+            memberships *= 2
+
+
+if __name__ == '__main__':
+    main(*map(int, argv[1:]))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+'''Benchmark the hot path overhead of the Prometheus metrics
+
+Times the request hooks recording counts and latency, and connection
+checkouts from the timed pool against a plain queue pool. With
+--multiprocess, samples are written to files in a temporary directory the
+way they are by uwsgi workers.
+
+Usage: metrics.py [--multiprocess] [ITERATIONS]
+'''
+from os import environ
+from sqlite3 import connect
+from sys import argv
+from tempfile import mkdtemp
+from time import perf_counter
+
+if '--multiprocess' in argv:
+    # Must be set before prometheus_client is imported
+    environ['PROMETHEUS_MULTIPROC_DIR'] = mkdtemp()
+    argv.remove('--multiprocess')
+
+from flask import Response  # noqa: E402
+from sqlalchemy.pool import QueuePool  # noqa: E402
+
+from demo_app_iam_service import app  # noqa: E402
+from demo_app_iam_service.metrics import TimedQueuePool, \
+    record_request, start_timer  # noqa: E402
+
+
+def timed(f, iterations):
+    start = perf_counter()
+    for _ in range(iterations):
+        f()
+    return (perf_counter() - start) / iterations
+
+
+def request_hooks():
+    start_timer()
+    record_request(response)
+
+
+def checkout(pool):
+    def f():
+        pool.connect().close()
+    return f
+
+
+response = Response(status=200)
+
+
+def main(iterations):
+    print('multiprocess: %s' % ('PROMETHEUS_MULTIPROC_DIR' in environ))
+
+    with app.test_request_context('/users/v1/'):
+        hooks = timed(request_hooks, iterations)
+    print('request hooks   %6.2fus per request' % (hooks * 1e6))
+
+    plain = timed(checkout(QueuePool(lambda: connect(':memory:'))),
+                  iterations)
+    timed_pool = timed(checkout(TimedQueuePool(lambda: connect(':memory:'))),
+                       iterations)
+    print('pool checkout   %6.2fus plain  %6.2fus timed  (+%.2fus)' % (
+        plain * 1e6, timed_pool * 1e6, (timed_pool - plain) * 1e6))
+
+
+if __name__ == '__main__':
+    main(int(argv[1]) if len(argv) > 1 else 100000)
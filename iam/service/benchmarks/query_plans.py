@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+'''Compare DAO query plans before and after the keys and indexes migration
+
+Builds the schema at the initial revision in a scratch schema inside a
+transaction, seeds it, captures the statements the DAOs issue, and prints
+their plans and timings.  It then upgrades to head and repeats.  The whole
+transaction is rolled back, so no data or schema is left behind.
+
+Usage: query_plans.py [USERS] [GROUPS] [POLICIES]
+'''
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sys import argv
+
+from demo_app_iam_service.app import app
+from demo_app_iam_service.db import db, user_table, group_table, \
+    policy_table, rule_table, user_group_table, user_policy_table, \
+    group_policy_table
+from demo_app_iam_service.groups.dao import GroupsDAO
+from demo_app_iam_service.migrations import INITIAL_REVISION, upgrade
+from demo_app_iam_service.policies.dao import PoliciesDAO
+from demo_app_iam_service.rules.dao import RulesDAO
+from demo_app_iam_service.users.dao import UsersDAO
+
+
+SCHEMA = 'query_plans_benchmark'
+
+EXPLAINABLE = {'SELECT', 'INSERT', 'UPDATE', 'DELETE'}
+
+
+def seed(connection, users, groups, policies):
+    connection.execute(user_table.insert(), [
+        {'email': 'user%d' % i} for i in range(users)
+    ])
+    connection.execute(group_table.insert(), [
+        {'name': 'group%d' % i} for i in range(groups)
+    ])
+    connection.execute(policy_table.insert(), [
+        {'name': 'policy%d' % i} for i in range(policies)
+    ])
+    connection.execute(rule_table.insert(), [
+        {'effect': 'allow', 'action': 'action%d' % j,
+         'resource': 'resource%d/*' % i, 'precedence': 0,
+         'policy': 'policy%d' % i}
+        for i in range(policies) for j in range(5)
+    ])
+    connection.execute(user_group_table.insert(), [
+        {'user': 'user%d' % i, 'group': 'group%d' % ((i + j) % groups)}
+        for i in range(users) for j in range(3)
+    ])
+    connection.execute(user_policy_table.insert(), [
+        {'user': 'user%d' % i, 'policy': 'policy%d' % (i % policies)}
+        for i in range(users)
+    ])
+    connection.execute(group_policy_table.insert(), [
+        {'group': 'group%d' % i, 'policy': 'policy%d' % ((i + j) % policies)}
+        for i in range(groups) for j in range(2)
+    ])
+    connection.execute('ANALYZE')
+
+
+def workload(session, initial):
+    UsersDAO(session).get('user1')
+    PoliciesDAO(session).get('policy1')
+    # Groups read their nested groups and rules are read from the
+    # effective rules, which the initial schema lacks
+    if not initial:
+        GroupsDAO(session).get('group1')
+        RulesDAO(session).list(user='user1')
+        RulesDAO(session).list(group='group1')
+
+
+def capture(connection, session, initial=False):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters,
+                              context, executemany):
+        if statement.split(None, 1)[0].upper() in EXPLAINABLE:
+            statements.append((statement, parameters))
+
+    event.listen(connection, 'before_cursor_execute', before_cursor_execute)
+    try:
+        # Run writes too, but undo them so both phases see the same data
+        nested = connection.begin_nested()
+        workload(session, initial)
+        # Writes also maintain the effective rules
+        if not initial:
+            UsersDAO(session).delete('user2')
+            GroupsDAO(session).delete('group2')
+        nested.rollback()
+    finally:
+        event.remove(connection, 'before_cursor_execute',
+                     before_cursor_execute)
+
+    return statements
+
+
+def explain(connection, statements):
+    for statement, parameters in statements:
+        analyze = statement.lstrip().upper().startswith('SELECT')
+        plan = [row[0] for row in connection.execute(
+            ('EXPLAIN (ANALYZE) ' if analyze else 'EXPLAIN ') + statement,
+            parameters
+        )]
+        print(' '.join(statement.split())[:100])
+        print('    ' + plan[0])
+        for line in plan[1:]:
+            if 'Scan' in line or 'Execution Time' in line:
+                print('    ' + line.strip())
+        print()
+
+
+def main(users=20000, groups=500, policies=500):
+    with app.app_context():
+        connection = db.engine.connect()
+        transaction = connection.begin()
+        try:
+            connection.execute('CREATE SCHEMA ' + SCHEMA)
+            connection.execute('SET LOCAL search_path TO ' + SCHEMA)
+            session = Session(bind=connection)
+
+            upgrade(INITIAL_REVISION, connection=connection)
+            seed(connection, users, groups, policies)
+            print('=== Revision %s\n' % INITIAL_REVISION)
+            explain(connection, capture(connection, session, initial=True))
+
+            upgrade(connection=connection)
+            connection.execute('ANALYZE')
+            print('=== Revision head\n')
+            explain(connection, capture(connection, session))
+        finally:
+            transaction.rollback()
+            connection.close()
+
+
+if __name__ == '__main__':
+    main(*map(int, argv[1:]))
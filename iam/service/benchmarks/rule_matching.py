@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+'''Benchmark rule matching with the prefix index against a linear scan
+
+Builds a rule set of hierarchical resource patterns, like an admin
+attached to many project policies, and decides the same random checks by
+scanning every rule and through the index, checking both agree.
+
+Usage: rule_matching.py [RULES] [CHECKS]
+'''
+from random import Random
+from sys import argv
+from time import perf_counter
+
+from demo_app_iam_service.rules.dao import Rule
+from demo_app_iam_service.rules.engine import RuleSet
+
+
+SERVICES = ['storage', 'compute', 'iam', 'billing', 'logging']
+
+VERBS = ['read', 'write', 'list', 'delete']
+
+
+def rules(count, random):
+    projects = max(1, count // 10)
+    generated = [
+        Rule('admin', effect='allow', action='iam:read', resource='*'),
+        Rule('guard', effect='deny', action='*:delete',
+             resource='projects/0/*', precedence=10),
+    ]
+    while len(generated) < count:
+        project = random.randrange(projects)
+        service = random.choice(SERVICES)
+        kind = random.random()
+        if kind < 0.4:
+            action, resource = service + ':*', 'projects/%d/*' % project
+        elif kind < 0.7:
+            action = '%s:%s' % (service, random.choice(VERBS))
+            resource = 'projects/%d/%s/%d/*' % (
+                project, service, random.randrange(100))
+        elif kind < 0.9:
+            action = '%s:%s' % (service, random.choice(VERBS))
+            resource = 'projects/%d/%s/%d' % (
+                project, service, random.randrange(100))
+        else:
+            action = '%s:*' % service
+            resource = 'projects/%d/%s-*' % (project, service)
+        generated.append(Rule(
+            'policy%d' % project,
+            effect='deny' if random.random() < 0.1 else 'allow',
+            action=action, resource=resource,
+            precedence=random.choice([0, 0, 0, 1])))
+    return generated
+
+
+def checks(count, rule_count, random):
+    projects = max(1, rule_count // 10)
+    return [
+        ('%s:%s' % (random.choice(SERVICES), random.choice(VERBS)),
+         'projects/%d/%s/%d/objects/%d' % (
+             random.randrange(projects), random.choice(SERVICES),
+             random.randrange(100), random.randrange(1000)))
+        for _ in range(count)
+    ]
+
+
+def timed(decide, checks):
+    start = perf_counter()
+    decisions = [decide(action, resource) for action, resource in checks]
+    return (perf_counter() - start) / len(checks), decisions
+
+
+def main(rule_count, check_count):
+    random = Random(0)
+    rule_set = RuleSet(rules(rule_count, random))
+    sample = checks(check_count, rule_count, random)
+
+    scan_time, scanned = timed(rule_set.scan, sample)
+    index_time, indexed = timed(rule_set.decide, sample)
+    assert [(d.allowed, d.rule) for d in scanned] == \
+        [(d.allowed, d.rule) for d in indexed]
+
+    allowed = sum(decision.allowed for decision in indexed)
+    print('%d rules, %d checks (%d allowed)' % (
+        rule_count, check_count, allowed))
+    print('scan  %8.1fus per check' % (scan_time * 1e6))
+    print('index %8.1fus per check  (%.0fx)' % (
+        index_time * 1e6, scan_time / index_time))
+
+
+if __name__ == '__main__':
+    main(int(argv[1]) if len(argv) > 1 else 10000,
+         int(argv[2]) if len(argv) > 2 else 2000)
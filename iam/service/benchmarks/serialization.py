@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+'''Benchmark response serialization of large user and rule lists
+
+Serializes in-memory users and rules with flask_restplus' marshal and the
+stdlib JSON encoder, and with the precompiled serializer and the fast
+encoder (orjson, when installed) or MessagePack, checking both produce the
+same data.
+
+Usage: serialization.py [RECORDS]
+'''
+from flask import json
+from flask_restplus import marshal
+from sys import argv
+from time import perf_counter
+
+from demo_app_iam_service.app import app
+from demo_app_iam_service.rules.api import rule
+from demo_app_iam_service.rules.dao import Rule
+from demo_app_iam_service.serialization import dumps, msgpack, serialize
+from demo_app_iam_service.users.api import user
+from demo_app_iam_service.users.dao import User
+
+
+def timed(f):
+    start = perf_counter()
+    result = f()
+    return perf_counter() - start, result
+
+
+def compare(name, records, model):
+    marshal_time, marshalled = timed(lambda: marshal(records, model))
+    compiled_time, compiled = timed(lambda: serialize(records, model))
+    assert marshalled == compiled
+
+    json_time, _ = timed(lambda: json.dumps(marshalled))
+    dumps_time, _ = timed(lambda: dumps(compiled))
+
+    print('%-6s marshal %7.1fms  compiled %7.1fms  '
+          'json %7.1fms  fast json %7.1fms' % (
+              name, marshal_time * 1000, compiled_time * 1000,
+              json_time * 1000, dumps_time * 1000), end='')
+    if msgpack is not None:
+        packb_time, _ = timed(lambda: msgpack.packb(compiled))
+        print('  msgpack %7.1fms' % (packb_time * 1000), end='')
+    print()
+
+
+def main(records):
+    users = [
+        User('user%d@example.com' % i,
+             groups=['group%d' % j for j in range(10)],
+             policies=['policy%d' % j for j in range(5)])
+        for i in range(records)
+    ]
+    rules = [
+        Rule('policy%d' % (i % 100), effect='allow', action='read',
+             resource='resource/%d/*' % i, precedence=i % 3)
+        for i in range(records)
+    ]
+
+    with app.app_context():
+        compare('users', users, user)
+        compare('rules', rules, rule)
+
+
+if __name__ == '__main__':
+    main(int(argv[1]) if len(argv) > 1 else 50000)
@@ -11,6 +11,14 @@ def requirements():
 
 setup(name='demo_app_iam_service',
       install_requires=requirements(),
+      extras_require={
+          'fast': ['orjson'],
+          'msgpack': ['msgpack'],
+      },
       package_dir={'': 'src'},
       packages=find_packages('src'),
+      package_data={'demo_app_iam_service': [
+          'migrations/script.py.mako',
+          'migrations/versions/*.py',
+      ]},
       version=environ.get('BUILD_VERSION', DEFAULT_BUILD_VERSION))
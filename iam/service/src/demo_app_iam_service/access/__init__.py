@@ -0,0 +1,7 @@
+from .api import api
+
+
+access_api = api
+
+
+__all__ = ['access_api']
@@ -0,0 +1,72 @@
+from flask_restplus import Resource, fields, inputs, reqparse
+
+from ..changes.api import REVISION_HEADER
+from ..db import db
+from ..namespace import Namespace
+from ..pagination import NEXT_CURSOR_HEADER, decode_cursor, page
+from .index import KINDS, access_index
+
+
+api = Namespace('access', description='Access Reviews')
+
+
+principal = api.model('AllowedPrincipal', {
+    'kind': fields.String(required=True, enum=KINDS),
+    'name': fields.String(required=True),
+    'policy': fields.String(required=True,
+                            description='Policy deciding the access'),
+})
+
+
+principals_parser = reqparse.RequestParser()
+principals_parser.add_argument('action', type=str, required=True,
+                               location='args')
+principals_parser.add_argument('resource', type=str, required=True,
+                               location='args')
+principals_parser.add_argument('kind', type=str, choices=KINDS,
+                               location='args',
+                               help='Only list users or groups')
+principals_parser.add_argument('limit', type=inputs.positive,
+                               location='args',
+                               help='Maximum number of results to return')
+principals_parser.add_argument('cursor', type=str, location='args',
+                               help='Resume listing after the given cursor')
+
+
+class AllowedPrincipal(object):
+    __slots__ = ['kind', 'name', 'policy']
+
+    def __init__(self, kind, name, policy):
+        self.kind = kind
+        self.name = name
+        self.policy = policy
+
+
+@api.route('/principals')
+class Principals(Resource):
+    '''List the users and groups allowed an action on a resource'''
+    @api.doc('list_allowed_principals')
+    @api.expect(principals_parser)
+    @api.header(NEXT_CURSOR_HEADER, 'Cursor of the next page, if any')
+    @api.header(REVISION_HEADER, 'Revision the answer is current as of')
+    @api.marshal_list_with(principal)
+    def get(self):
+        args = principals_parser.parse_args()
+        after = decode_cursor(args['cursor'], 2)
+        session = db.session
+        index = access_index()
+        results = [
+            AllowedPrincipal(*result)
+            for result in index.lookup(
+                session, args['action'], args['resource'],
+                kind=args['kind'], after=after, limit=args['limit'])
+        ]
+        session.commit()
+
+        headers = page(results, args['limit'],
+                       lambda result: [result.kind, result.name])
+        headers[REVISION_HEADER] = str(index.revision)
+        return results, 200, headers
+
+
+__all__ = ['api', 'principal']
@@ -0,0 +1,41 @@
+from sqlalchemy.sql import select
+
+from ..changes.dao import ChangesDAO
+from ..db import rule_table, user_group_table, user_policy_table, \
+    group_policy_table, group_group_table
+from ..export.dao import ExportDAO
+
+
+# Everything that decides who is allowed what
+TABLES = [
+    rule_table,
+    user_group_table,
+    user_policy_table,
+    group_policy_table,
+    group_group_table,
+]
+
+
+class AccessDAO(object):
+    def __init__(self, session):
+        self.session = session
+
+    def snapshot(self):
+        '''Return the revision of a consistent snapshot, and an iterator of
+        the (entity, row) pairs of every rule and membership in it'''
+        revision = ExportDAO(self.session).begin()
+        return revision, self.rows()
+
+    def rows(self):
+        for table in TABLES:
+            rows = self.session.execute(
+                select([table]).execution_options(stream_results=True))
+            for row in rows:
+                yield table.name, dict(row)
+
+    def changes(self, after):
+        '''The changes committed after a revision, in order'''
+        return ChangesDAO(self.session).iterate(after=after)
+
+
+__all__ = ['AccessDAO']
@@ -0,0 +1,267 @@
+from bisect import bisect_left, bisect_right
+from flask import current_app
+from heapq import merge
+from itertools import islice
+from sys import intern
+from threading import Lock
+
+from ..rules.engine import ALLOW, PrefixIndex, compile_pattern
+from .dao import AccessDAO
+
+
+KINDS = ['group', 'user']
+
+
+def add_sorted(mapping, key, value):
+    members = mapping.get(key)
+    if members is None:
+        mapping[key] = [value]
+        return
+    index = bisect_left(members, value)
+    if index == len(members) or members[index] != value:
+        members.insert(index, value)
+
+
+def remove_sorted(mapping, key, value):
+    members = mapping.get(key)
+    if members is None:
+        return
+    index = bisect_left(members, value)
+    if index < len(members) and members[index] == value:
+        del members[index]
+    if not members:
+        del mapping[key]
+
+
+def add_set(mapping, key, value):
+    mapping.setdefault(key, set()).add(value)
+
+
+def remove_set(mapping, key, value):
+    members = mapping.get(key)
+    if members is not None:
+        members.discard(value)
+        if not members:
+            del mapping[key]
+
+
+def better(key, best):
+    # Keys order like RuleSet decides: higher precedence, then denies first
+    return best is None or key < best
+
+
+class AccessIndex(object):
+    '''In-memory inverted index from action and resource patterns, through
+    policies, groups and memberships, to the principals they apply to
+
+    It is loaded from a snapshot once, then follows the change log, so it
+    is kept up to date with every write, whichever worker made it.
+    '''
+    def __init__(self):
+        self.lock = Lock()
+        self.revision = None
+
+        # Rules by action prefix, then by resource prefix
+        self.rules = PrefixIndex()
+        self.patterns = {}
+
+        # Members sorted by name, for listing principals in order
+        self.policy_users = {}
+        self.policy_groups = {}
+        self.group_users = {}
+
+        # What each principal is a member of
+        self.user_policies = {}
+        self.user_groups = {}
+        self.group_policies = {}
+
+        # Groups nested directly in each group
+        self.group_groups = {}
+
+    def compile(self, pattern):
+        match = self.patterns.get(pattern)
+        if match is None:
+            match = self.patterns[pattern] = compile_pattern(pattern).match
+        return match
+
+    def apply(self, entity, operation, row):
+        row = {name: intern(value) if isinstance(value, str) else value
+               for name, value in row.items()}
+        insert = operation == 'insert'
+
+        if entity == 'rule':
+            self.apply_rule(row, insert)
+        elif entity == 'user_group':
+            (add_sorted if insert else remove_sorted)(
+                self.group_users, row['group'], row['user'])
+            (add_set if insert else remove_set)(
+                self.user_groups, row['user'], row['group'])
+        elif entity == 'user_policy':
+            (add_sorted if insert else remove_sorted)(
+                self.policy_users, row['policy'], row['user'])
+            (add_set if insert else remove_set)(
+                self.user_policies, row['user'], row['policy'])
+        elif entity == 'group_policy':
+            (add_sorted if insert else remove_sorted)(
+                self.policy_groups, row['policy'], row['group'])
+            (add_set if insert else remove_set)(
+                self.group_policies, row['group'], row['policy'])
+        elif entity == 'group_group':
+            (add_set if insert else remove_set)(
+                self.group_groups, row['group'], row['member'])
+
+    def apply_rule(self, row, insert):
+        action = row['action']
+        resource = row['resource']
+        key = (row['policy'], row['effect'], action, resource,
+               row['precedence'] or 0)
+
+        if insert:
+            resources = self.rules.bucket(action, PrefixIndex)
+            resources.bucket(resource, dict)[key] = (
+                (row['effect'] or '').lower() == ALLOW,
+                row['precedence'] or 0,
+                row['policy'],
+                self.compile(action),
+                self.compile(resource),
+            )
+            return
+
+        resources = self.rules.get(action)
+        rules = resources and resources.get(resource)
+        if rules is not None:
+            rules.pop(key, None)
+            if not rules:
+                resources.discard(resource)
+            if not resources.buckets:
+                self.rules.discard(action)
+
+    def refresh(self, session):
+        '''Load the index, or apply the changes committed since'''
+        dao = AccessDAO(session)
+        if self.revision is None:
+            session.commit()
+            revision, rows = dao.snapshot()
+            for entity, row in rows:
+                self.apply(entity, 'insert', row)
+            self.revision = revision
+            return
+
+        for change in dao.changes(self.revision):
+            self.apply(change.entity, change.operation, change.data)
+            self.revision = change.revision
+
+    def policies(self, action, resource):
+        '''The deciding key of each policy with rules matching the check'''
+        best = {}
+        for resources in self.rules.find(action):
+            for rules in resources.find(resource):
+                for allowed, precedence, policy, match_action, \
+                        match_resource in rules.values():
+                    if match_action(action) and match_resource(resource):
+                        key = (-precedence, allowed, policy)
+                        if better(key, best.get(policy)):
+                            best[policy] = key
+        return best
+
+    def lookup(self, session, action, resource, kind=None, after=None,
+               limit=None):
+        '''The (kind, name, policy) of principals allowed the action on the
+        resource, ordered by kind and name, with the policy deciding it'''
+        with self.lock:
+            self.refresh(session)
+            return self.allowed(action, resource, kind, after, limit)
+
+    def allowed(self, action, resource, kind, after, limit):
+        policy_best = self.policies(action, resource)
+
+        group_best = {}
+        for policy, key in policy_best.items():
+            for group in self.policy_groups.get(policy, ()):
+                self.inherit(group_best, group, key)
+
+        results = []
+        for principal_kind in KINDS:
+            if kind not in (None, principal_kind):
+                continue
+            if after is not None and after[0] > principal_kind:
+                continue
+            start = after[1] if after and after[0] == principal_kind \
+                else None
+
+            if principal_kind == 'group':
+                found = self.allowed_groups(group_best, start)
+            else:
+                found = self.allowed_users(policy_best, group_best, start)
+
+            for name, policy in found:
+                results.append((principal_kind, name, policy))
+                if limit is not None and len(results) >= limit:
+                    return results
+
+        return results
+
+    def inherit(self, group_best, group, key):
+        # Groups nested in the group get its policies too. Nesting is
+        # acyclic, and a group already holding a better key passes that
+        # on already, so the walk stops there.
+        pending = [group]
+        while pending:
+            group = pending.pop()
+            if better(key, group_best.get(group)):
+                group_best[group] = key
+                pending.extend(self.group_groups.get(group, ()))
+
+    def allowed_groups(self, group_best, start):
+        for group in sorted(group_best):
+            if start is not None and group <= start:
+                continue
+            _, allowed, policy = group_best[group]
+            if allowed:
+                yield group, policy
+
+    def allowed_users(self, policy_best, group_best, start):
+        # Whoever is allowed gets it from a policy or group that allows,
+        # so only their members are candidates, merged in name order
+        sources = [
+            self.policy_users.get(policy, ())
+            for policy, (_, allowed, _) in policy_best.items() if allowed
+        ] + [
+            self.group_users.get(group, ())
+            for group, (_, allowed, _) in group_best.items() if allowed
+        ]
+        candidates = merge(*[
+            islice(users, bisect_right(users, start), None)
+            if start is not None else users
+            for users in sources
+        ])
+
+        previous = None
+        for user in candidates:
+            if user == previous:
+                continue
+            previous = user
+
+            best = None
+            for policy in self.user_policies.get(user, ()):
+                key = policy_best.get(policy)
+                if key is not None and better(key, best):
+                    best = key
+            for group in self.user_groups.get(user, ()):
+                key = group_best.get(group)
+                if key is not None and better(key, best):
+                    best = key
+
+            if best[1]:
+                yield user, best[2]
+
+
+def access_index(app=None):
+    app = app or current_app
+    index = app.extensions.get('access_index')
+    if index is None:
+        index = app.extensions['access_index'] = AccessIndex()
+    return index
+
+
+__all__ = ['AccessIndex', 'access_index']
@@ -6,6 +6,17 @@ from .users import users_api
 from .groups import groups_api
 from .policies import policies_api
 from .rules import rules_api
+from .authz import authz_api
+from .changes import changes_api
+from .export import export_api
+from .bulk import bulk_api
+from .batch import batch_api
+from .access import access_api
+from .instrumentation import instrument
+from .metrics import add_metrics
+from .profiling import profile_requests
+from .routing import route_requests
+from .serialization import JSON, output_json
 
 
 TITLE = 'Demo App IAM'
@@ -16,11 +27,23 @@ VERSION = get_distribution('demo_app_iam_service').version
 
 
 api = Api(app, title=TITLE, description=DESCRIPTION, version=VERSION)
+api.representations[JSON] = output_json
+
+instrument(app)
+add_metrics(app)
+profile_requests(app)
+route_requests(app)
 
 api.add_namespace(users_api, path='/users/v1')
 api.add_namespace(groups_api, path='/groups/v1')
 api.add_namespace(policies_api, path='/policies/v1')
 api.add_namespace(rules_api, path='/rules/v1')
+api.add_namespace(authz_api, path='/authz/v1')
+api.add_namespace(changes_api, path='/changes/v1')
+api.add_namespace(export_api, path='/export/v1')
+api.add_namespace(bulk_api, path='/bulk/v1')
+api.add_namespace(batch_api, path='/batch/v1')
+api.add_namespace(access_api, path='/access/v1')
 
 
 __all__ = ['api']
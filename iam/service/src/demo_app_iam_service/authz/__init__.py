@@ -0,0 +1,7 @@
+from .api import api
+
+
+authz_api = api
+
+
+__all__ = ['authz_api']
@@ -0,0 +1,143 @@
+from flask_restplus import Resource, fields
+from flask import Response, abort, current_app, stream_with_context
+
+from ..db import db
+from ..namespace import Namespace
+from ..routing import use_replica
+from ..rules.api import rule
+from ..rules.cache import rules_cache
+from ..rules.engine import ALLOW, DENY
+from ..serialization import dumps
+from ..snapshot import rules_snapshot
+from . import batch
+
+
+api = Namespace('authz', description='Authorization Decisions')
+
+
+decision_request = api.model('DecisionRequest', {
+    'user': fields.String(),
+    'group': fields.String(),
+    'action': fields.String(required=True),
+    'resource': fields.String(required=True),
+})
+
+
+decision = api.model('Decision', {
+    'allowed': fields.Boolean(required=True),
+    'effect': fields.String(required=True),
+    'rule': fields.Nested(rule, allow_null=True),
+})
+
+
+batch_request = api.model('BatchDecisionRequest', {
+    'checks': fields.List(fields.Nested(decision_request), required=True),
+})
+
+
+batch_decision = api.model('BatchDecision', {
+    'allowed': fields.Boolean(required=True),
+    'effect': fields.String(required=True),
+    'policy': fields.String(),
+})
+
+
+def principal(data):
+    user = data.get('user')
+    group = data.get('group')
+
+    if (user is None) == (group is None):
+        abort(400, 'Exactly one of user or group is required')
+
+    kind, name = ('user', user) if user is not None else ('group', group)
+    if not isinstance(name, str):
+        abort(400, 'Expected a string for ' + kind)
+    return kind, name
+
+
+def check(data):
+    '''The principal, action and resource of a check, aborting with 400 if
+    any is missing'''
+    if not isinstance(data, dict):
+        abort(400, 'Expected an object for each check')
+
+    action = data.get('action')
+    resource = data.get('resource')
+    if not isinstance(action, str) or not isinstance(resource, str):
+        abort(400, 'Action and resource strings are required')
+
+    return principal(data), action, resource
+
+
+def rule_set(session, kind, name):
+    # Prefer the snapshot shared by all workers on the node when one has
+    # been published and is up to date, and otherwise the database through
+    # this worker's own cache.
+    snapshot = rules_snapshot()
+    mapped = snapshot and snapshot.current(session)
+    if mapped is not None:
+        return mapped.rule_set(kind, name)
+    return rules_cache().get(session, kind, name)
+
+
+@api.route('/decide')
+class Decide(Resource):
+    '''Decide whether a principal may perform an action on a resource'''
+    @api.doc('decide')
+    @api.expect(decision_request, validate=True)
+    @api.marshal_with(decision)
+    @use_replica
+    def post(self):
+        data = api.payload
+        kind, name = principal(data)
+        session = db.session
+        rules = rule_set(session, kind, name)
+        session.commit()
+        return rules.decide(data['action'], data['resource'])
+
+
+@api.route('/batch')
+class Batch(Resource):
+    '''Decide a batch of checks, streamed back as NDJSON in input order'''
+    @api.doc('decide_batch')
+    @api.expect(batch_request)
+    @api.response(200, 'Success', batch_decision)
+    @use_replica
+    def post(self):
+        # Checked by hand, as validating against the model takes longer
+        # than deciding a large batch
+        payload = api.payload
+        checks = payload.get('checks') if isinstance(payload, dict) else None
+        if not isinstance(checks, list):
+            abort(400, 'A list of checks is required')
+        checks = [check(data) for data in checks]
+
+        # Load each distinct principal's effective rules exactly once
+        session = db.session
+        rule_sets = {
+            (kind, name): rule_set(session, kind, name)
+            for kind, name in set(check[0] for check in checks)
+        }
+        session.commit()
+
+        config = current_app.config
+        decisions = batch.decide(
+            rule_sets, checks,
+            processes=config['AUTHZ_BATCH_PROCESSES'],
+            threshold=config['AUTHZ_BATCH_PARALLEL_THRESHOLD'],
+            chunk_size=config['AUTHZ_BATCH_CHUNK_SIZE'])
+
+        def generate():
+            for allowed, policy in decisions:
+                yield dumps({
+                    'allowed': allowed,
+                    'effect': ALLOW if allowed else DENY,
+                    'policy': policy,
+                }) + '\n'
+
+        return Response(stream_with_context(generate()),
+                        mimetype='application/x-ndjson')
+
+
+__all__ = ['api', 'Decide', 'Batch', 'decision', 'decision_request',
+           'batch_request', 'batch_decision']
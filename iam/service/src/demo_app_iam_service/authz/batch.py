@@ -0,0 +1,84 @@
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from os import cpu_count
+
+
+_executor = None
+
+
+def executor(processes):
+    global _executor
+    # Created lazily so each (forked) worker process owns its own pool
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=processes or cpu_count())
+    return _executor
+
+
+def evaluate(rule_sets, checks):
+    return [
+        rule_sets[principal].decide(action, resource)
+        for principal, action, resource in checks
+    ]
+
+
+def evaluate_chunk(rule_sets, checks):
+    # Decisions are reduced to plain tuples so that results coming back
+    # from pool processes don't drag the matched Rule objects along.
+    return [
+        (decision.allowed, decision.rule and decision.rule.policy)
+        for decision in evaluate(rule_sets, checks)
+    ]
+
+
+def chunks(rule_sets, checks, chunk_size):
+    '''Group the positions of the checks by principal, into chunks of at
+    least `chunk_size` checks unless they are the last, with the rule sets
+    they reference
+
+    A principal's checks are never split across chunks, so each rule set
+    is shipped to and indexed by one pool process only.
+    '''
+    positions = defaultdict(list)
+    for position, (principal, _, _) in enumerate(checks):
+        positions[principal].append(position)
+
+    chunk_rule_sets, chunk_positions = {}, []
+    for principal, principal_positions in positions.items():
+        chunk_rule_sets[principal] = rule_sets[principal]
+        chunk_positions.extend(principal_positions)
+        if len(chunk_positions) >= chunk_size:
+            yield chunk_rule_sets, chunk_positions
+            chunk_rule_sets, chunk_positions = {}, []
+
+    if chunk_positions:
+        yield chunk_rule_sets, chunk_positions
+
+
+def decide(rule_sets, checks, processes=0, threshold=0, chunk_size=1):
+    '''Yield (allowed, policy) for each check, in input order'''
+    if threshold <= 0 or len(checks) < threshold:
+        yield from evaluate_chunk(rule_sets, checks)
+        return
+
+    grouped = list(chunks(rule_sets, checks, chunk_size))
+    if len(grouped) < 2:
+        yield from evaluate_chunk(rule_sets, checks)
+        return
+
+    results = executor(processes).map(evaluate_chunk, [
+        chunk_rule_sets for chunk_rule_sets, _ in grouped
+    ], [
+        [checks[position] for position in positions]
+        for _, positions in grouped
+    ])
+
+    # Chunks hold checks out of order, so they are put back in order
+    decisions = [None] * len(checks)
+    for (_, positions), chunk_results in zip(grouped, results):
+        for position, result in zip(positions, chunk_results):
+            decisions[position] = result
+
+    yield from decisions
+
+
+__all__ = ['decide', 'evaluate']
@@ -0,0 +1,7 @@
+from .api import api
+
+
+batch_api = api
+
+
+__all__ = ['batch_api']
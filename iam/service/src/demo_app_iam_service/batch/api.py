@@ -0,0 +1,217 @@
+from flask_restplus import Resource, fields, marshal
+from sqlalchemy.exc import IntegrityError
+
+from ..bulk.dao import RULE_FIELDS, strings
+from ..db import db
+from ..groups.api import group
+from ..groups.dao import CycleError, GroupsDAO
+from ..namespace import Namespace
+from ..policies.api import policy
+from ..policies.dao import PoliciesDAO
+from ..rules.api import rule
+from ..rules.dao import RulesDAO
+from ..users.api import user
+from ..users.dao import UsersDAO
+
+
+api = Namespace('batch', description='Atomic Batches of Operations')
+
+
+operation = api.model('Operation', {
+    'op': fields.String(required=True, enum=['create', 'update', 'delete']),
+    'target': fields.String(required=True,
+                            enum=['users', 'groups', 'policies', 'rules']),
+    'key': fields.String(description='Email or name of the user, group or '
+                                     'policy to update or delete'),
+    'data': fields.Raw(description='Body the single operation endpoint '
+                                   'would take'),
+})
+
+
+batch_request = api.model('BatchRequest', {
+    'operations': fields.List(fields.Nested(operation), required=True),
+})
+
+
+operation_result = api.model('OperationResult', {
+    'status': fields.Integer(required=True),
+    'result': fields.Raw(),
+})
+
+
+batch_result = api.model('BatchResult', {
+    'results': fields.List(fields.Nested(operation_result)),
+})
+
+
+# The DAO, key field and model of each entity
+ENTITIES = {
+    'users': (UsersDAO, 'email', user),
+    'groups': (GroupsDAO, 'name', group),
+    'policies': (PoliciesDAO, 'name', policy),
+}
+
+
+class OperationError(Exception):
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+        self.message = message
+
+
+def perform_entity(session, op, target, key, data):
+    dao_class, key_field, model = ENTITIES[target]
+    dao = dao_class(session)
+
+    if op == 'create':
+        entity = dao.update(data.pop(key_field), **data)
+        return 201, marshal(entity, model)
+
+    if op == 'update':
+        current = dao.get(key)
+        data.pop(key_field, None)
+        entity = current and dao.update(key, current=current, **data)
+    else:
+        entity = dao.delete(key)
+
+    if entity is None:
+        raise OperationError(404, 'Not found: {}'.format(key))
+
+    return 200, marshal(entity, model)
+
+
+def perform_rule(session, op, data):
+    if op == 'create':
+        RulesDAO(session).create(**data)
+        return 201, marshal(data, rule, skip_none=True)
+
+    if op == 'delete':
+        PoliciesDAO(session).remove_rule(data.pop('policy'), **data)
+        return 204, None
+
+    raise OperationError(400, 'Rules can only be created or deleted')
+
+
+def invalid_rule(data, required=RULE_FIELDS[:3]):
+    if not isinstance(data, dict) or not all(
+            isinstance(data.get(field), str) for field in required):
+        return 'Rules require {} strings'.format(', '.join(required))
+    if not isinstance(data.get('precedence', 0), int):
+        return 'Rule precedence must be an integer'
+    return None
+
+
+def invalid(operation):
+    '''Check the shape of an operation, returning an error message if it's
+    invalid'''
+    if not isinstance(operation, dict):
+        return 'Expected an object'
+
+    op = operation.get('op')
+    target = operation.get('target')
+    data = operation.get('data')
+
+    if op not in ('create', 'update', 'delete'):
+        return 'Unknown op: {}'.format(op)
+    if target != 'rules' and target not in ENTITIES:
+        return 'Unknown target: {}'.format(target)
+    if data is not None and not isinstance(data, dict):
+        return 'Expected an object for data'
+    data = data or {}
+
+    if target == 'rules':
+        if op == 'update':
+            return 'Rules can only be created or deleted'
+        unknown = set(data) - {'policy'} - set(RULE_FIELDS)
+        if unknown:
+            return 'Unknown fields: {}'.format(', '.join(sorted(unknown)))
+        return invalid_rule(data, ['policy'] + RULE_FIELDS[:3])
+
+    _, key_field, model = ENTITIES[target]
+
+    if op == 'create':
+        if not isinstance(data.get(key_field), str):
+            return 'Missing or invalid ' + key_field
+    elif not isinstance(operation.get('key'), str):
+        return 'A key is required to ' + op
+
+    if op == 'delete':
+        return None
+
+    unknown = set(data) - set(model)
+    if unknown:
+        return 'Unknown fields: {}'.format(', '.join(sorted(unknown)))
+
+    for field, value in data.items():
+        if field == key_field or value is None:
+            continue
+        if field == 'rules':
+            if not isinstance(value, list):
+                return 'Expected a list of rules'
+            for item in value:
+                error = invalid_rule(item)
+                if error:
+                    return error
+        elif not strings(value):
+            return 'Expected a list of strings for ' + field
+
+    return None
+
+
+def perform(session, operation):
+    op = operation['op']
+    target = operation['target']
+    data = dict(operation.get('data') or {})
+
+    if target == 'rules':
+        return perform_rule(session, op, data)
+
+    return perform_entity(session, op, target, operation.get('key'), data)
+
+
+@api.route('/')
+class Batch(Resource):
+    '''Apply operations in order, all in one transaction
+
+    Either every operation is applied and its result returned, or none is,
+    and the index of the operation that failed is returned with the error.
+    '''
+    @api.doc('apply_batch')
+    @api.expect(batch_request, validate=True)
+    @api.marshal_with(batch_result)
+    @api.response(400, 'Invalid operation')
+    @api.response(404, 'Operation refers to a missing entity')
+    @api.response(409, 'Operation would nest a group in itself')
+    def post(self):
+        session = db.session
+        results = []
+
+        operations = api.payload.get('operations') or []
+
+        # Checked before any is applied, so the DAOs only see data they take
+        for index, operation in enumerate(operations):
+            error = invalid(operation)
+            if error:
+                api.abort(400, error, index=index)
+
+        for index, operation in enumerate(operations):
+            try:
+                status, result = perform(session, operation)
+            except OperationError as error:
+                session.rollback()
+                api.abort(error.code, error.message, index=index)
+            except IntegrityError:
+                session.rollback()
+                api.abort(404, 'Refers to a missing entity', index=index)
+            except CycleError as error:
+                session.rollback()
+                api.abort(409, str(error), index=index)
+
+            results.append({'status': status, 'result': result})
+
+        session.commit()
+        return {'results': results}
+
+
+__all__ = ['api', 'Batch', 'batch_request', 'batch_result', 'operation',
+           'operation_result']
@@ -0,0 +1,7 @@
+from .api import api
+
+
+bulk_api = api
+
+
+__all__ = ['bulk_api']
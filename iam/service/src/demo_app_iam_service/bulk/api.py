@@ -0,0 +1,165 @@
+from flask import Response, current_app, json, request, stream_with_context
+from flask_restplus import Resource, fields
+
+from ..db import db
+from ..groups.api import group
+from ..groups.dao import GroupsDAO
+from ..namespace import Namespace
+from ..pagination import stream
+from ..policies.api import policy
+from ..policies.dao import PoliciesDAO
+from ..routing import TOKEN_HEADER, consistency_token
+from ..users.api import user
+from ..users.dao import UsersDAO
+from .dao import BulkDAO, ENTITIES, validate
+
+
+api = Namespace('bulk', description='Bulk Import and Export')
+
+
+progress = api.model('BulkProgress', {
+    'line': fields.Integer(description='Line of a rejected record'),
+    'error': fields.String(description='Why the record was rejected'),
+    'processed': fields.Integer(description='Records read so far'),
+    'imported': fields.Integer(description='Records imported so far'),
+    'failed': fields.Integer(description='Records rejected so far'),
+    'done': fields.Boolean(description='Set once the import is committed'),
+    'token': fields.String(description='Consistency token of the import, '
+                           'to send as ' + TOKEN_HEADER),
+})
+
+
+def batches(lines, size):
+    '''Decode NDJSON lines into batches of numbered records'''
+    batch = []
+    for number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            batch.append((number, json.loads(line)))
+        except ValueError as error:
+            batch.append((number, error))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def bulk_import(name):
+    '''Stream the import of an NDJSON request body, reporting rejected
+    records and progress after each batch as NDJSON'''
+    entity = ENTITIES[name]
+    session = db.session
+    size = current_app.config['BULK_BATCH_SIZE']
+
+    def generate():
+        bulk = BulkDAO(session, entity)
+        bulk.begin()
+        processed = imported = failed = 0
+
+        try:
+            for batch in batches(request.stream, size):
+                valid = []
+                errors = []
+                for line, record in batch:
+                    if isinstance(record, ValueError):
+                        error = 'Invalid JSON: {}'.format(record)
+                    else:
+                        error = validate(entity, record)
+                    if error:
+                        errors.append((line, error))
+                    else:
+                        valid.append((line, record))
+
+                if valid:
+                    errors.extend(bulk.load(valid))
+
+                processed += len(batch)
+                failed += len(errors)
+                imported = processed - failed
+
+                for line, error in sorted(errors):
+                    yield json.dumps({'line': line, 'error': error}) + '\n'
+                yield json.dumps({'processed': processed,
+                                  'imported': imported,
+                                  'failed': failed}) + '\n'
+
+            errors = bulk.finish()
+            if errors:
+                failed += len(errors)
+                imported = processed - failed
+                for line, error in errors:
+                    yield json.dumps({'line': line, 'error': error}) + '\n'
+
+            session.commit()
+        except Exception:
+            session.rollback()
+            raise
+
+        # Sent in the body, as the writes follow the response headers
+        done = {'processed': processed, 'imported': imported,
+                'failed': failed, 'done': True}
+        token = consistency_token(session)
+        if token is not None:
+            done['token'] = token
+        yield json.dumps(done) + '\n'
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
+
+
+@api.route('/users')
+class Users(Resource):
+    '''Export all users as NDJSON'''
+    @api.doc('export_users')
+    @api.response(200, 'Success', user)
+    def get(self):
+        session = db.session
+        users = UsersDAO(session)
+        return stream(session, users.iterate(stream=True), user)
+
+    '''Import users from an NDJSON body, in one transaction'''
+    @api.doc('import_users')
+    @api.response(200, 'Progress', progress)
+    def post(self):
+        return bulk_import('users')
+
+
+@api.route('/groups')
+class Groups(Resource):
+    '''Export all groups as NDJSON'''
+    @api.doc('export_groups')
+    @api.response(200, 'Success', group)
+    def get(self):
+        session = db.session
+        groups = GroupsDAO(session)
+        return stream(session, groups.iterate(stream=True), group)
+
+    '''Import groups from an NDJSON body, in one transaction'''
+    @api.doc('import_groups')
+    @api.response(200, 'Progress', progress)
+    def post(self):
+        return bulk_import('groups')
+
+
+@api.route('/policies')
+class Policies(Resource):
+    '''Export all policies as NDJSON'''
+    @api.doc('export_policies')
+    @api.response(200, 'Success', policy)
+    def get(self):
+        session = db.session
+        policies = PoliciesDAO(session)
+        return stream(session, policies.iterate(stream=True, fields=None),
+                      policy)
+
+    '''Import policies from an NDJSON body, in one transaction'''
+    @api.doc('import_policies')
+    @api.response(200, 'Progress', progress)
+    def post(self):
+        return bulk_import('policies')
+
+
+__all__ = ['api', 'Users', 'Groups', 'Policies', 'progress']
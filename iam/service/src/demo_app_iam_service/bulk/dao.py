@@ -0,0 +1,409 @@
+from io import StringIO
+from sqlalchemy import Boolean, Column, Integer, MetaData, String, Table
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import and_, exists, not_, select
+
+from .. import generations
+from ..db import user_table, group_table, policy_table, rule_table, \
+    user_group_table, user_policy_table, group_policy_table, \
+    group_group_table
+from ..groups.dao import CycleError, GroupsDAO
+
+
+class Relation(object):
+    '''A membership list of a record, e.g. the groups of a user
+
+    `detaches` is the kind of principal whose effective rules change when
+    it is removed from the list, if they aren't bumped anyway.
+    '''
+    def __init__(self, name, table, owner, member, target, detaches=None):
+        self.name = name
+        self.table = table
+        self.owner = table.c[owner]
+        self.member = table.c[member]
+        self.target = target
+        self.detaches = detaches
+
+
+class Entity(object):
+    '''A kind of record, with its membership lists, and whether it lists
+    rules or the groups nested in it'''
+    def __init__(self, name, table, key, relations, rules=False,
+                 nesting=False):
+        self.name = name
+        self.table = table
+        self.key = key
+        self.relations = relations
+        self.rules = rules
+        self.nesting = nesting
+
+
+ENTITIES = {entity.name: entity for entity in [
+    Entity('users', user_table, 'email', [
+        Relation('groups', user_group_table, 'user', 'group',
+                 group_table.c.name),
+        Relation('policies', user_policy_table, 'user', 'policy',
+                 policy_table.c.name),
+    ]),
+    Entity('groups', group_table, 'name', [
+        Relation('users', user_group_table, 'group', 'user',
+                 user_table.c.email, detaches='user'),
+        Relation('policies', group_policy_table, 'group', 'policy',
+                 policy_table.c.name),
+    ], nesting=True),
+    Entity('policies', policy_table, 'name', [
+        Relation('users', user_policy_table, 'policy', 'user',
+                 user_table.c.email, detaches='user'),
+        Relation('groups', group_policy_table, 'policy', 'group',
+                 group_table.c.name, detaches='group'),
+    ], rules=True),
+]}
+
+
+RULE_FIELDS = ['effect', 'action', 'resource', 'precedence']
+
+
+def strings(value):
+    return isinstance(value, list) and \
+        all(isinstance(item, str) for item in value)
+
+
+def validate(entity, record):
+    '''Check a decoded record, returning an error message if it's invalid'''
+    if not isinstance(record, dict):
+        return 'Expected an object'
+
+    if not isinstance(record.get(entity.key), str):
+        return 'Missing or invalid ' + entity.key
+
+    for relation in entity.relations:
+        value = record.get(relation.name)
+        if value is not None and not strings(value):
+            return 'Expected a list of strings for ' + relation.name
+
+    if entity.rules and record.get('rules') is not None:
+        if not isinstance(record['rules'], list):
+            return 'Expected a list of rules'
+        for rule in record['rules']:
+            if not isinstance(rule, dict) or not all(
+                    isinstance(rule.get(field), str)
+                    for field in RULE_FIELDS[:3]):
+                return 'Rules require effect, action and resource strings'
+            if not isinstance(rule.get('precedence', 0), int):
+                return 'Rule precedence must be an integer'
+
+    if entity.nesting and record.get('groups') is not None and \
+            not strings(record['groups']):
+        return 'Expected a list of strings for groups'
+
+    return None
+
+
+def escape(value):
+    # Text format of COPY, where \N is null
+    if value is None:
+        return '\\N'
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t') \
+        .replace('\n', '\\n').replace('\r', '\\r')
+
+
+class BulkDAO(object):
+    '''Loads batches of records through temporary staging tables
+
+    Each batch is copied into staging tables with COPY, and then applied
+    with one set-based statement per table, following the same rules as
+    creating each record through the API: the entity is created if it's
+    new, and each membership list (or the rules) present in the record
+    replaces the existing one. Records naming unknown members are
+    rejected before anything of theirs is written.
+
+    Nested groups may be listed before they are imported themselves, so
+    they are only nested once every batch is loaded, by finish().
+    '''
+    def __init__(self, session, entity):
+        self.session = session
+        self.entity = entity
+
+        # The line and nested groups of each record listing them
+        self.nested = {}
+
+        # Staging tables only live for the import's transaction
+        metadata = MetaData()
+        options = {'prefixes': ['TEMPORARY'],
+                   'postgresql_on_commit': 'DROP'}
+
+        self.keys = Table(
+            'bulk_key', metadata,
+            Column('line', Integer, nullable=False),
+            Column('key', String, nullable=False),
+            *[Column(relation.name, Boolean, nullable=False)
+              for relation in entity.relations],
+            *([Column('rules', Boolean, nullable=False)]
+              if entity.rules else []),
+            **options)
+
+        self.members = {
+            relation.name: Table(
+                'bulk_' + relation.name, metadata,
+                Column('key', String, nullable=False),
+                Column('member', String, nullable=False),
+                **options)
+            for relation in entity.relations
+        }
+
+        self.rules = Table(
+            'bulk_rules', metadata,
+            Column('key', String, nullable=False),
+            *[Column(field, rule_table.c[field].type, nullable=False)
+              for field in RULE_FIELDS],
+            **options) if entity.rules else None
+
+        self.tables = [self.keys] + list(self.members.values()) + \
+            ([self.rules] if entity.rules else [])
+
+    def begin(self):
+        # Imports may change the rules of any number of principals, so
+        # rather than lock each group and policy, they keep out every other
+        # write changing effective rules until they commit
+        generations.lock_nesting(self.session)
+
+        connection = self.session.connection()
+        for table in self.tables:
+            table.create(connection)
+
+    def copy(self, table, rows):
+        buffer = StringIO()
+        for row in rows:
+            buffer.write('\t'.join(escape(value) for value in row))
+            buffer.write('\n')
+        buffer.seek(0)
+
+        cursor = self.session.connection().connection.cursor()
+        cursor.copy_expert(
+            'COPY {} ({}) FROM STDIN'.format(
+                table.name,
+                ', '.join('"{}"'.format(column.name)
+                          for column in table.columns)),
+            buffer)
+
+    def load(self, records):
+        '''Apply a batch of (line, record) pairs of valid records,
+        returning the (line, error) pairs of any that were rejected'''
+        entity = self.entity
+        session = self.session
+
+        # A later record for the same key replaces an earlier one
+        latest = {}
+        for line, record in records:
+            latest[record[entity.key]] = (line, record)
+            if entity.nesting:
+                self.nested.pop(record[entity.key], None)
+
+        session.execute('TRUNCATE ' + ', '.join(
+            table.name for table in self.tables))
+
+        self.copy(self.keys, [
+            [line, key] +
+            [record.get(relation.name) is not None
+             for relation in entity.relations] +
+            ([record.get('rules') is not None] if entity.rules else [])
+            for key, (line, record) in latest.items()
+        ])
+
+        for relation in entity.relations:
+            self.copy(self.members[relation.name], [
+                (key, member)
+                for key, (_, record) in latest.items()
+                for member in set(record.get(relation.name) or ())
+            ])
+
+        if entity.rules:
+            self.copy(self.rules, set(
+                (key, rule['effect'], rule['action'], rule['resource'],
+                 rule.get('precedence', 0))
+                for key, (_, record) in latest.items()
+                for rule in record.get('rules') or ()
+            ))
+
+        # Temporary tables have no statistics until they are analyzed
+        for table in self.tables:
+            session.execute('ANALYZE ' + table.name)
+
+        errors = self.reject_unknown_members(latest)
+        self.apply()
+
+        if entity.nesting:
+            rejected = set(line for line, _ in errors)
+            for key, (line, record) in latest.items():
+                if line not in rejected and record.get('groups') is not None:
+                    self.nested[key] = (line, set(record['groups']))
+
+        return errors
+
+    def reject_unknown_members(self, latest):
+        session = self.session
+        rejected = {}
+
+        for relation in self.entity.relations:
+            staged = self.members[relation.name]
+            known = exists().where(relation.target == staged.c.member)
+            unknown = session.execute(
+                select([staged.c.key, staged.c.member])
+                .where(not_(known))
+                .order_by(staged.c.key, staged.c.member)
+            )
+            for key, member in unknown:
+                rejected.setdefault(key, 'Unknown {} member: {}'.format(
+                    relation.name, member))
+
+        if rejected:
+            for table in self.tables:
+                session.execute(
+                    table.delete().where(table.c.key.in_(list(rejected))))
+
+        return sorted((latest[key][0], error)
+                      for key, error in rejected.items())
+
+    def apply(self):
+        entity = self.entity
+        session = self.session
+        keys = self.keys
+        key_column = entity.table.c[entity.key]
+
+        loaded = [row[0] for row in session.execute(select([keys.c.key]))]
+        if not loaded:
+            return
+
+        session.execute(
+            insert(entity.table)
+            .from_select([key_column.name], select([keys.c.key]))
+            .on_conflict_do_nothing()
+        )
+
+        removed = {'user': set(), 'group': set()}
+
+        for relation in entity.relations:
+            table = relation.table
+            staged = self.members[relation.name]
+
+            # Memberships of records that list them, but not staged
+            stale = session.execute(
+                table.delete()
+                .where(and_(
+                    exists().where(and_(keys.c.key == relation.owner,
+                                        keys.c[relation.name])),
+                    not_(exists().where(and_(
+                        staged.c.key == relation.owner,
+                        staged.c.member == relation.member)))))
+                .returning(relation.member)
+            )
+            if relation.detaches:
+                removed[relation.detaches].update(row[0] for row in stale)
+
+            session.execute(
+                insert(table)
+                .from_select([relation.owner.name, relation.member.name],
+                             select([staged.c.key, staged.c.member]))
+                .on_conflict_do_nothing()
+            )
+
+        if entity.rules:
+            staged = self.rules
+            session.execute(
+                rule_table.delete()
+                .where(and_(
+                    exists().where(and_(keys.c.key == rule_table.c.policy,
+                                        keys.c.rules)),
+                    not_(exists().where(and_(
+                        staged.c.key == rule_table.c.policy,
+                        *[staged.c[field] == rule_table.c[field]
+                          for field in RULE_FIELDS]))))))
+
+            session.execute(
+                insert(rule_table)
+                .from_select(['policy'] + RULE_FIELDS,
+                             select([staged.c.key] +
+                                    [staged.c[field]
+                                     for field in RULE_FIELDS]))
+                .on_conflict_do_nothing()
+            )
+
+        # Everyone whose effective rules may have changed, including
+        # principals that were just detached
+        users = set(loaded) if entity.table is user_table else set()
+        groups = set(loaded) if entity.table is group_table else set()
+        users |= removed['user']
+        groups |= removed['group']
+
+        more_users, more_groups = generations.principals(
+            session, groups=groups,
+            policies=loaded if entity.table is policy_table else ())
+        generations.bump(session, users=users | more_users,
+                         groups=groups | more_groups)
+
+    def finish(self):
+        '''Nest the groups listed by the records loaded, returning the
+        (line, error) pairs of records whose nesting was rejected
+
+        Groups no longer listed are removed first, so a record may nest a
+        group that contained it before. Nesting that would make a cycle is
+        rejected as GroupsDAO.nest rejects it, leaving the record's groups
+        as they were but for those removed.
+        '''
+        session = self.session
+        if not self.nested:
+            return []
+
+        groups = GroupsDAO(session)
+        groups.lock_nesting()
+
+        listed = set(self.nested).union(*[
+            members for _, members in self.nested.values()])
+        known = set(row['name'] for row in session.execute(
+            select([group_table.c.name])
+            .where(group_table.c.name.in_(sorted(listed)))
+        ))
+        current = {}
+        for group, member in session.execute(
+                select([group_group_table.c.group, group_group_table.c.member])
+                .where(group_group_table.c.group.in_(sorted(self.nested)))):
+            current.setdefault(group, set()).add(member)
+
+        errors = []
+        nesting = []
+        for key, (line, members) in sorted(self.nested.items()):
+            unknown = sorted(members - known)
+            if unknown:
+                errors.append((line, 'Unknown groups member: {}'.format(
+                    unknown[0])))
+            else:
+                nesting.append((key, line, members))
+
+        changed = set()
+        for key, line, members in nesting:
+            for member in sorted(current.get(key, set()) - members):
+                groups.unnest(key, member)
+                changed.add(member)
+
+        for key, line, members in nesting:
+            added = sorted(members - current.get(key, set()))
+            savepoint = session.begin_nested()
+            try:
+                for member in added:
+                    groups.nest(key, member)
+            except CycleError as error:
+                savepoint.rollback()
+                errors.append((line, str(error)))
+            else:
+                savepoint.commit()
+                changed.update(added)
+
+        self.nested = {}
+
+        users, nested = generations.principals(session, groups=changed)
+        generations.bump(session, users=users, groups=nested)
+
+        return sorted(errors)
+
+
+__all__ = ['BulkDAO', 'ENTITIES', 'validate']
@@ -0,0 +1,7 @@
+from .api import api
+
+
+changes_api = api
+
+
+__all__ = ['changes_api']
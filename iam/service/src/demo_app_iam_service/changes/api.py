@@ -0,0 +1,114 @@
+from flask import Response, current_app, json, request, stream_with_context
+from flask_restplus import Resource, fields, inputs, marshal, reqparse
+
+from ..db import db
+from ..namespace import Namespace
+from ..routing import use_primary
+from .dao import ChangesDAO
+
+
+REVISION_HEADER = 'X-Revision'
+
+
+api = Namespace('changes', description='Change Feed')
+
+
+change = api.model('Change', {
+    'revision': fields.Integer(required=True),
+    'entity': fields.String(required=True,
+                            description='Table of the changed row'),
+    'operation': fields.String(required=True, enum=['insert', 'delete']),
+    'data': fields.Raw(required=True, description='The changed row'),
+})
+
+
+changes_parser = reqparse.RequestParser()
+changes_parser.add_argument('after', type=inputs.natural, location='args',
+                            default=0,
+                            help='Return changes after this revision')
+changes_parser.add_argument('limit', type=inputs.positive, location='args',
+                            help='Maximum number of changes to return')
+changes_parser.add_argument('wait', type=float, location='args', default=0,
+                            help='Seconds to wait for a change if there '
+                                 'are none yet')
+
+
+events_parser = reqparse.RequestParser()
+events_parser.add_argument('after', type=inputs.natural, location='args',
+                           help='Send changes after this revision, '
+                                'defaults to Last-Event-ID or the latest')
+
+
+def event(record):
+    return 'id: {}\nevent: change\ndata: {}\n\n'.format(
+        record.revision, json.dumps(marshal(record, change), sort_keys=False)
+    )
+
+
+@api.route('/')
+class Changes(Resource):
+    '''List changes after a revision, optionally waiting for one'''
+    @api.doc('list_changes')
+    @api.expect(changes_parser)
+    @api.header(REVISION_HEADER, 'Revision to resume after')
+    @api.marshal_list_with(change)
+    @use_primary
+    def get(self):
+        args = changes_parser.parse_args()
+        after = args['after']
+        timeout = min(max(args['wait'], 0),
+                      current_app.config['CHANGES_MAX_WAIT'])
+        session = db.session
+        changes = ChangesDAO(session)
+        results = changes.list(after=after, limit=args['limit'])
+        session.commit()
+        if not results and timeout and changes.wait(after, timeout):
+            results = changes.list(after=after, limit=args['limit'])
+            session.commit()
+        revision = results[-1].revision if results else after
+        return results, 200, {REVISION_HEADER: str(revision)}
+
+
+@api.route('/events')
+class Events(Resource):
+    '''Stream changes as Server-Sent Events'''
+    @api.doc('stream_changes')
+    @api.expect(events_parser)
+    @api.produces(['text/event-stream'])
+    @use_primary
+    def get(self):
+        args = events_parser.parse_args()
+        session = db.session
+        changes = ChangesDAO(session)
+
+        # Reconnecting clients resume after the last event they received
+        after = args['after']
+        if after is None:
+            after = request.headers.get('Last-Event-ID', type=int)
+        if after is None:
+            after = changes.revision()
+        session.commit()
+
+        batch_size = current_app.config['CHANGES_BATCH_SIZE']
+        heartbeat = current_app.config['CHANGES_HEARTBEAT']
+
+        def generate(after):
+            while True:
+                results = changes.list(after=after, limit=batch_size)
+                session.commit()
+
+                for record in results:
+                    yield event(record)
+                    after = record.revision
+
+                # Comments keep idle connections from timing out
+                if len(results) < batch_size and \
+                        not changes.wait(after, heartbeat):
+                    yield ': keepalive\n\n'
+
+        return Response(stream_with_context(generate(after)),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+
+
+__all__ = ['api', 'Changes', 'Events', 'REVISION_HEADER', 'change']
@@ -0,0 +1,86 @@
+from select import select as wait_readable
+from sqlalchemy.sql import func, select
+from time import monotonic
+
+from ..db import change_table
+
+
+CHANNEL = 'change'
+
+
+class Change(object):
+    def __init__(self, revision, entity, operation, data):
+        self.revision = revision
+        self.entity = entity
+        self.operation = operation
+        self.data = data
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            revision=row['revision'],
+            entity=row['entity'],
+            operation=row['operation'],
+            data=row['data']
+        )
+
+
+class ChangesDAO(object):
+    def __init__(self, session):
+        self.session = session
+
+    def revision(self):
+        '''The latest committed revision, or 0 before any change'''
+        return self.session.execute(
+            select([func.coalesce(func.max(change_table.c.revision), 0)])
+        ).scalar()
+
+    def list(self, after=0, limit=None):
+        return list(self.iterate(after=after, limit=limit))
+
+    def iterate(self, after=0, limit=None, stream=False):
+        query = select([change_table]) \
+            .where(change_table.c.revision > after) \
+            .order_by(change_table.c.revision) \
+            .limit(limit) \
+            .execution_options(stream_results=stream)
+
+        for row in self.session.execute(query):
+            yield Change.from_row(row)
+
+    def wait(self, after, timeout):
+        '''Block until a revision later than `after` is committed or the
+        timeout expires, returning whether there are changes to read'''
+        deadline = monotonic() + timeout
+
+        # Notifications are received on a connection of our own, so the
+        # session isn't held open in a transaction while waiting.
+        connection = self.session.get_bind().raw_connection()
+        cursor = connection.cursor()
+        try:
+            cursor.execute('LISTEN "{}"'.format(CHANNEL))
+            connection.commit()
+
+            while True:
+                # Check after listening, so a commit in between isn't missed
+                cursor.execute(
+                    'SELECT EXISTS (SELECT 1 FROM change WHERE revision > %s)',
+                    (after,))
+                found = cursor.fetchone()[0]
+                connection.commit()
+
+                remaining = deadline - monotonic()
+                if found or remaining <= 0:
+                    return found
+
+                dbapi_connection = connection.connection
+                wait_readable([dbapi_connection], [], [], remaining)
+                dbapi_connection.poll()
+                del dbapi_connection.notifies[:]
+        finally:
+            cursor.execute('UNLISTEN *')
+            connection.commit()
+            connection.close()
+
+
+__all__ = ['ChangesDAO']
@@ -5,6 +5,33 @@ CONFIG = {
     'SQLALCHEMY_DATABASE_URI': str,
     'SQLALCHEMY_ECHO': bool,
     'ERROR_404_HELP': bool,
+    'DB_POOL_SIZE': int,
+    'DB_MAX_OVERFLOW': int,
+    'DB_POOL_TIMEOUT': float,
+    'DB_POOL_RECYCLE': int,
+    'DB_POOL_PRE_PING': bool,
+    'DB_STATEMENT_TIMEOUT': float,
+    'DB_PGBOUNCER': bool,
+    'DB_REPLICA_URIS': str,
+    'DB_REPLICA_MAX_WAIT': float,
+    'AUTHZ_BATCH_PROCESSES': int,
+    'AUTHZ_BATCH_PARALLEL_THRESHOLD': int,
+    'AUTHZ_BATCH_CHUNK_SIZE': int,
+    'RULES_CACHE_SIZE': int,
+    'RULES_CACHE_TTL': float,
+    'CHANGES_MAX_WAIT': float,
+    'CHANGES_HEARTBEAT': float,
+    'CHANGES_BATCH_SIZE': int,
+    'RULES_SNAPSHOT_PATH': str,
+    'RULES_SNAPSHOT_CHECK_INTERVAL': float,
+    'RULES_SNAPSHOT_MAX_LAG': float,
+    'RULES_SNAPSHOT_CACHE_SIZE': int,
+    'BULK_BATCH_SIZE': int,
+    'SQL_STATS_HEADERS': bool,
+    'SQL_SLOW_QUERY_THRESHOLD': float,
+    'PROFILING_TOKEN': str,
+    'PROFILING_SAMPLE_RATE': float,
+    'PROFILING_BUFFER_SIZE': int,
 }
 
 
@@ -13,6 +40,33 @@ DEFAULTS = {
     'SQLALCHEMY_DATABASE_URI': 'postgres://postgres@localhost:5432',
     'SQLALCHEMY_ECHO': False,
     'ERROR_404_HELP': False,
+    'DB_POOL_SIZE': 5,
+    'DB_MAX_OVERFLOW': 10,
+    'DB_POOL_TIMEOUT': 30.0,
+    'DB_POOL_RECYCLE': -1,
+    'DB_POOL_PRE_PING': False,
+    'DB_STATEMENT_TIMEOUT': 0.0,
+    'DB_PGBOUNCER': False,
+    'DB_REPLICA_URIS': '',
+    'DB_REPLICA_MAX_WAIT': 0.5,
+    'AUTHZ_BATCH_PROCESSES': 0,
+    'AUTHZ_BATCH_PARALLEL_THRESHOLD': 0,
+    'AUTHZ_BATCH_CHUNK_SIZE': 500,
+    'RULES_CACHE_SIZE': 10000,
+    'RULES_CACHE_TTL': 300.0,
+    'CHANGES_MAX_WAIT': 30.0,
+    'CHANGES_HEARTBEAT': 15.0,
+    'CHANGES_BATCH_SIZE': 1000,
+    'RULES_SNAPSHOT_PATH': '',
+    'RULES_SNAPSHOT_CHECK_INTERVAL': 1.0,
+    'RULES_SNAPSHOT_MAX_LAG': 10.0,
+    'RULES_SNAPSHOT_CACHE_SIZE': 256,
+    'BULK_BATCH_SIZE': 5000,
+    'SQL_STATS_HEADERS': False,
+    'SQL_SLOW_QUERY_THRESHOLD': 0.5,
+    'PROFILING_TOKEN': '',
+    'PROFILING_SAMPLE_RATE': 0.0,
+    'PROFILING_BUFFER_SIZE': 50,
 }
 
 
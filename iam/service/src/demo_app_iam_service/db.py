@@ -1,8 +1,132 @@
-from flask_sqlalchemy import SQLAlchemy
+from flask import g, has_app_context
+from flask_sqlalchemy import SQLAlchemy, SignallingSession
+from os import getpid, register_at_fork
+from sqlalchemy import event, orm
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.dialects.postgresql import ARRAY, JSONB, \
+    aggregate_order_by, array_agg, insert
+from sqlalchemy.pool import NullPool
+from sqlalchemy.sql import all_, bindparam, func, literal, select, tuple_
 
 from .app import app
+from .metrics import TimedQueuePool
 
-db = SQLAlchemy(app)
+try:
+    from uwsgidecorators import postfork
+except ImportError:
+    postfork = None
+
+
+def engine_options(config):
+    '''Engine arguments for the DB_* settings'''
+    timeout = config['DB_STATEMENT_TIMEOUT']
+
+    if config['DB_PGBOUNCER']:
+        # pgbouncer pools the connections, and in transaction pooling mode
+        # drops startup options, so the timeout is set per transaction
+        return {'poolclass': NullPool}
+
+    options = {
+        'poolclass': TimedQueuePool,
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': config['DB_POOL_PRE_PING'],
+    }
+    if timeout > 0:
+        options['connect_args'] = {
+            'options': '-c statement_timeout={:d}'.format(int(timeout * 1000))
+        }
+    return options
+
+
+def replica_binds(config):
+    '''Binds of the DB_REPLICA_URIS, named replica0, replica1...'''
+    uris = [uri.strip() for uri in config['DB_REPLICA_URIS'].split(',')]
+    return {
+        'replica{}'.format(index): uri
+        for index, uri in enumerate(uri for uri in uris if uri)
+    }
+
+
+class RoutingSession(SignallingSession):
+    '''Session using the replica chosen for the current request, if any,
+    see routing.py'''
+    def get_bind(self, mapper=None, clause=None):
+        replica = g.get('replica') if has_app_context() else None
+        if replica is not None:
+            return db.get_engine(self.app, replica)
+        return super(RoutingSession, self).get_bind(mapper, clause)
+
+
+def bind_name(config, sa_url):
+    '''The name of the bind connecting to a URL, which is "default" for
+    SQLALCHEMY_DATABASE_URI'''
+    binds = config['SQLALCHEMY_BINDS'] or {}
+    for bind, uri in binds.items():
+        if make_url(uri) == sa_url:
+            return bind
+    return 'default'
+
+
+class Database(SQLAlchemy):
+    '''Creates engines from the DB_* settings, passed to it as its engine
+    options'''
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        # Pools are named after their bind, which labels their metrics
+        engine_opts = dict(engine_opts, pool_logging_name=bind_name(
+            self.app.config, sa_url))
+        engine = super(Database, self).create_engine(sa_url, engine_opts)
+
+        timeout = self.app.config['DB_STATEMENT_TIMEOUT']
+        if self.app.config['DB_PGBOUNCER'] and timeout > 0:
+            statement = 'SET LOCAL statement_timeout = {:d}'.format(
+                int(timeout * 1000))
+
+            @event.listens_for(engine, 'begin')
+            def set_statement_timeout(connection):
+                connection.execute(statement)
+
+        return engine
+
+
+app.config['SQLALCHEMY_BINDS'] = replica_binds(app.config) or None
+
+db = Database(app, engine_options=engine_options(app.config))
+
+
+# Pools replaced in forked processes, along with the connections they
+# held when the process was forked
+_inherited = []
+
+_pid = getpid()
+
+
+def after_fork():
+    '''Give a forked process, such as a uwsgi worker, pools of its own
+
+    Connections inherited from the parent are left open and unused, as
+    closing them would end the parent's sessions on the same sockets.
+    '''
+    global _pid
+    if getpid() == _pid:
+        return
+    _pid = getpid()
+
+    for bind in list(app.extensions['sqlalchemy'].connectors):
+        engine = db.get_engine(app, bind)
+        _inherited.append(engine.pool)
+        engine.pool = engine.pool.recreate()
+
+
+# Older uwsgi releases fork workers without running Python's fork handlers
+register_at_fork(after_in_child=after_fork)
+if postfork is not None:
+    postfork(after_fork)
 
 
 user_table = db.Table(
@@ -31,6 +155,8 @@ rule_table = db.Table(
     db.Column('precedence', db.Integer, default=0, nullable=False),
     db.Column('policy', db.String, db.ForeignKey(policy_table.c.name),
               nullable=False),
+    db.PrimaryKeyConstraint('policy', 'effect', 'action', 'resource',
+                            'precedence', name='pk_rule'),
 )
 
 
@@ -40,6 +166,8 @@ user_group_table = db.Table(
               nullable=False),
     db.Column('group', db.String, db.ForeignKey(group_table.c.name),
               nullable=False),
+    db.PrimaryKeyConstraint('user', 'group', name='pk_user_group'),
+    db.Index('ix_user_group_group', 'group', 'user'),
 )
 
 
@@ -49,6 +177,8 @@ user_policy_table = db.Table(
               nullable=False),
     db.Column('policy', db.String, db.ForeignKey(policy_table.c.name),
               nullable=False),
+    db.PrimaryKeyConstraint('user', 'policy', name='pk_user_policy'),
+    db.Index('ix_user_policy_policy', 'policy', 'user'),
 )
 
 
@@ -58,7 +188,138 @@ group_policy_table = db.Table(
               nullable=False),
     db.Column('policy', db.String, db.ForeignKey(policy_table.c.name),
               nullable=False),
+    db.PrimaryKeyConstraint('group', 'policy', name='pk_group_policy'),
+    db.Index('ix_group_policy_policy', 'policy', 'group'),
 )
 
 
-__all__ = ['db']
+group_group_table = db.Table(
+    'group_group',
+    db.Column('group', db.String, db.ForeignKey(group_table.c.name),
+              nullable=False),
+    db.Column('member', db.String, db.ForeignKey(group_table.c.name),
+              nullable=False),
+    db.PrimaryKeyConstraint('group', 'member', name='pk_group_group'),
+    db.Index('ix_group_group_member', 'member', 'group'),
+)
+
+
+# Maintained by GroupsDAO as group_group changes, see migration 0004
+group_closure_table = db.Table(
+    'group_closure',
+    db.Column('ancestor', db.String,
+              db.ForeignKey(group_table.c.name, ondelete='CASCADE'),
+              nullable=False),
+    db.Column('descendant', db.String,
+              db.ForeignKey(group_table.c.name, ondelete='CASCADE'),
+              nullable=False),
+    db.Column('paths', db.BigInteger, nullable=False),
+    db.PrimaryKeyConstraint('ancestor', 'descendant',
+                            name='pk_group_closure'),
+    db.Index('ix_group_closure_descendant', 'descendant', 'ancestor'),
+)
+
+
+principal_generation_table = db.Table(
+    'principal_generation',
+    db.Column('principal', db.String, primary_key=True),
+    db.Column('generation', db.BigInteger, default=0, nullable=False),
+)
+
+
+# The rules of every principal's policies, direct or through its groups,
+# kept up to date by generations.bump for the principals each write
+# affects, see effective. Rows of direct policies have an empty source,
+# the others name the group the policy is attached to.
+effective_rule_table = db.Table(
+    'effective_rule',
+    db.Column('kind', db.String, nullable=False),
+    db.Column('name', db.String, nullable=False),
+    db.Column('source', db.String, nullable=False),
+    db.Column('policy', db.String, nullable=False),
+    db.Column('effect', db.String, nullable=False),
+    db.Column('action', db.String, nullable=False),
+    db.Column('resource', db.String, nullable=False),
+    db.Column('precedence', db.Integer, nullable=False),
+    db.PrimaryKeyConstraint('kind', 'name', 'source', 'policy', 'effect',
+                            'action', 'resource', 'precedence',
+                            name='pk_effective_rule'),
+)
+
+
+# Written by triggers on the tables above, see migration 0003.
+# Changes only get their revision as their transaction commits.
+change_table = db.Table(
+    'change',
+    db.Column('position', db.BigInteger, primary_key=True),
+    db.Column('revision', db.BigInteger, unique=True),
+    db.Column('entity', db.String, nullable=False),
+    db.Column('operation', db.String, nullable=False),
+    db.Column('data', JSONB, nullable=False),
+)
+
+
+def aggregate(column, *criteria):
+    # Correlated sub-select collecting a related column into a sorted
+    # array, so one row per entity carries all of its memberships.
+    return select([array_agg(aggregate_order_by(column, column))]) \
+        .where(db.and_(*criteria)) \
+        .as_scalar()
+
+
+def keyset(query, columns, limit=None, after=None):
+    # Order by the key columns and select the page following `after`
+    if after is not None:
+        query = query.where(tuple_(*columns) > tuple_(*after))
+    if limit is not None:
+        query = query.limit(limit)
+    return query.order_by(*columns)
+
+
+def synchronize(session, owner, key, member, members):
+    '''Make the `member` values related to `key` exactly `members`
+
+    Only rows that differ are deleted or inserted, each as one statement,
+    and the (added, removed) sets of member values are returned.
+    '''
+    table = owner.table
+    members = bindparam('members', sorted(set(members)),
+                        type_=ARRAY(member.type))
+
+    removed = session.execute(
+        table.delete()
+        .where(db.and_(owner == key, member != all_(members)))
+        .returning(member)
+    )
+    removed = set(row[0] for row in removed)
+
+    added = session.execute(
+        insert(table)
+        .from_select([owner.name, member.name],
+                     select([literal(key), func.unnest(members)]))
+        .on_conflict_do_nothing()
+        .returning(member)
+    )
+    added = set(row[0] for row in added)
+
+    return added, removed
+
+
+def link(session, table, **values):
+    # Insert a single membership row, returning whether it was new
+    return session.execute(
+        insert(table).values(**values).on_conflict_do_nothing()
+    ).rowcount > 0
+
+
+def unlink(session, table, **values):
+    # Delete a single membership row, returning whether it existed
+    return session.execute(
+        table.delete().where(db.and_(*[
+            table.c[name] == value for name, value in values.items()
+        ]))
+    ).rowcount > 0
+
+
+__all__ = ['db', 'aggregate', 'keyset', 'link', 'replica_binds',
+           'synchronize', 'unlink']
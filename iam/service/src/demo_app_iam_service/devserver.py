@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 from demo_app_iam_service.app import app
-from demo_app_iam_service.db import db
+from demo_app_iam_service.migrations import upgrade
 
 
 DEFAULT_OPTS = {
@@ -9,7 +9,7 @@ DEFAULT_OPTS = {
 
 
 def main(**opts):
-    db.create_all()
+    upgrade()
     app.run(**opts)
 
 
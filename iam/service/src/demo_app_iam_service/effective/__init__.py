@@ -0,0 +1,134 @@
+from sqlalchemy import String
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.sql import and_, any_, bindparam, except_, exists, literal, \
+    not_, or_, select, union
+
+from ..db import effective_rule_table, group_closure_table, \
+    group_policy_table, rule_table, user_group_table, user_policy_table
+
+
+COLUMNS = [column.name for column in effective_rule_table.columns]
+
+RULE = [
+    rule_table.c.policy,
+    rule_table.c.effect,
+    rule_table.c.action,
+    rule_table.c.resource,
+    rule_table.c.precedence,
+]
+
+
+def names(key, values):
+    return bindparam(key, sorted(set(values)), type_=ARRAY(String))
+
+
+def derive(users=None, groups=None):
+    '''Select the effective rules of the given users and groups from the
+    memberships, in the columns of effective_rule
+
+    Either may be left out to select the rules of everyone of that kind.
+    '''
+    def principal(kind, name, source):
+        return [literal(kind, String).label('kind'), name.label('name'),
+                source.label('source')] + RULE
+
+    # Rules of the user's own policies, then of the groups the user is in
+    # and the groups they are nested in, and of each group and the groups
+    # it is nested in
+    direct = select(principal(
+        'user', user_policy_table.c.user, literal('', String)
+    )).where(user_policy_table.c.policy == rule_table.c.policy)
+
+    inherited = select(principal(
+        'user', user_group_table.c.user, group_policy_table.c.group
+    )).where(and_(
+        user_group_table.c.group == group_closure_table.c.descendant,
+        group_closure_table.c.ancestor == group_policy_table.c.group,
+        group_policy_table.c.policy == rule_table.c.policy,
+    ))
+
+    nested = select(principal(
+        'group', group_closure_table.c.descendant, group_policy_table.c.group
+    )).where(and_(
+        group_closure_table.c.ancestor == group_policy_table.c.group,
+        group_policy_table.c.policy == rule_table.c.policy,
+    ))
+
+    if users is not None:
+        direct = direct.where(
+            user_policy_table.c.user == any_(names('users', users)))
+        inherited = inherited.where(
+            user_group_table.c.user == any_(names('users', users)))
+    if groups is not None:
+        nested = nested.where(
+            group_closure_table.c.descendant == any_(names('groups', groups)))
+
+    return union(direct, inherited, nested)
+
+
+def refresh(session, users=(), groups=()):
+    '''Bring the effective rules of the given principals up to date with
+    their memberships, changing only the rows that differ'''
+    if not users and not groups:
+        return
+
+    table = effective_rule_table
+    fresh = derive(users, groups).alias('fresh')
+
+    session.execute(
+        table.delete()
+        .where(or_(
+            and_(table.c.kind == 'user',
+                 table.c.name == any_(names('users', users))),
+            and_(table.c.kind == 'group',
+                 table.c.name == any_(names('groups', groups))),
+        ))
+        .where(not_(exists().where(and_(*[
+            fresh.c[name] == table.c[name] for name in COLUMNS
+        ]))))
+    )
+
+    session.execute(
+        insert(table)
+        .from_select(COLUMNS, derive(users, groups))
+        .on_conflict_do_nothing()
+    )
+
+
+def rebuild(session):
+    '''Recompute the effective rules of every principal, returning how
+    many there are
+
+    Concurrent writes wait until the rebuild commits, but reads are
+    served the previous rows meanwhile.
+    '''
+    table = effective_rule_table
+    session.execute('LOCK TABLE {} IN EXCLUSIVE MODE'.format(table.name))
+    session.execute(table.delete())
+    return session.execute(
+        insert(table).from_select(COLUMNS, derive())
+    ).rowcount
+
+
+def differences(session):
+    '''Yield a (difference, row) pair for each effective rule that is
+    'missing' from effective_rule or 'extra' in it, compared to the
+    memberships'''
+    stored = select([effective_rule_table])
+
+    # One statement, so both sides are read from the same snapshot
+    missing = except_(derive(), stored).alias('missing')
+    extra = except_(stored, derive()).alias('extra')
+    query = select(
+        [literal('missing', String).label('difference')] +
+        [missing.c[name] for name in COLUMNS]
+    ).union_all(select(
+        [literal('extra', String).label('difference')] +
+        [extra.c[name] for name in COLUMNS]
+    ))
+
+    for row in session.execute(query):
+        yield row['difference'], {name: row[name] for name in COLUMNS}
+
+
+__all__ = ['derive', 'differences', 'rebuild', 'refresh']
@@ -0,0 +1,40 @@
+from argparse import ArgumentParser
+from json import dumps
+
+from ..app import app
+from ..db import db
+from . import differences, rebuild
+
+
+def check(session):
+    found = 0
+    for difference, row in differences(session):
+        print(difference, dumps(row, sort_keys=True), flush=True)
+        found += 1
+    session.commit()
+    print('Found', found, 'differences', flush=True)
+    return 1 if found else 0
+
+
+def main(argv=None):
+    parser = ArgumentParser(
+        prog='python -m demo_app_iam_service.effective',
+        description='Check or rebuild the materialized effective rules')
+    parser.add_argument('command', choices=['check', 'rebuild'],
+                        help='List the rules that differ from those the '
+                             'memberships give, or recompute them all')
+    options = parser.parse_args(argv)
+
+    with app.app_context():
+        session = db.session
+        if options.command == 'check':
+            return check(session)
+
+        count = rebuild(session)
+        session.commit()
+        print('Rebuilt', count, 'effective rules', flush=True)
+        return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,7 @@
+from .api import api
+
+
+export_api = api
+
+
+__all__ = ['export_api']
@@ -0,0 +1,64 @@
+from flask import Response, stream_with_context
+from flask_restplus import Resource, inputs, reqparse
+
+from ..changes.api import REVISION_HEADER
+from ..db import db
+from ..namespace import Namespace
+from .dao import ExportDAO
+from .frames import buffered
+
+
+MIMETYPE = 'application/octet-stream'
+
+
+api = Namespace('export', description='Snapshot Export')
+
+
+changes_parser = reqparse.RequestParser()
+changes_parser.add_argument('after', type=inputs.natural, location='args',
+                            required=True,
+                            help='Export changes after this revision')
+
+
+def export(session, frames):
+    def generate():
+        yield from buffered(frames)
+        session.commit()
+
+    return stream_with_context(generate())
+
+
+@api.route('/snapshot')
+class Snapshot(Resource):
+    '''Export the whole graph as length-prefixed frames'''
+    @api.doc('export_snapshot')
+    @api.header(REVISION_HEADER, 'Revision of the snapshot')
+    @api.produces([MIMETYPE])
+    def get(self):
+        session = db.session
+        exports = ExportDAO(session)
+        revision = exports.begin()
+        return Response(export(session, exports.snapshot(revision)),
+                        mimetype=MIMETYPE,
+                        headers={REVISION_HEADER: str(revision)})
+
+
+@api.route('/changes')
+class Changes(Resource):
+    '''Export the changes since a revision as length-prefixed frames'''
+    @api.doc('export_changes')
+    @api.expect(changes_parser)
+    @api.header(REVISION_HEADER, 'Revision the changes lead up to')
+    @api.produces([MIMETYPE])
+    def get(self):
+        args = changes_parser.parse_args()
+        session = db.session
+        exports = ExportDAO(session)
+        revision = exports.begin()
+        return Response(
+            export(session, exports.changes(args['after'], revision)),
+            mimetype=MIMETYPE,
+            headers={REVISION_HEADER: str(revision)})
+
+
+__all__ = ['api', 'Snapshot', 'Changes']
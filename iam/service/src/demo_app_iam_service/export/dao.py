@@ -0,0 +1,75 @@
+from sqlalchemy.sql import select
+
+from ..changes.dao import ChangesDAO
+from ..db import user_table, group_table, policy_table, rule_table, \
+    user_group_table, user_policy_table, group_policy_table, \
+    group_group_table
+
+
+FORMAT_VERSION = 1
+
+
+# Referenced tables come first, so a replica can load rows in this order.
+# The group closure is left out, as it is derived from group_group.
+TABLES = [
+    user_table,
+    group_table,
+    policy_table,
+    rule_table,
+    user_group_table,
+    user_policy_table,
+    group_policy_table,
+    group_group_table,
+]
+
+
+class ExportDAO(object):
+    def __init__(self, session):
+        self.session = session
+
+    def begin(self):
+        '''Start a transaction in which every read sees the same snapshot
+        of the graph, and return the revision of that snapshot'''
+        self.session.connection(
+            execution_options={'isolation_level': 'REPEATABLE READ'})
+
+        # Revisions are committed in order, so the snapshot holds exactly
+        # the changes up to and including the latest one visible in it.
+        return ChangesDAO(self.session).revision()
+
+    def snapshot(self, revision):
+        '''Yield the snapshot's frames: a header, then for each table a
+        header naming its columns followed by one row per frame'''
+        yield {'format': 'iam-snapshot', 'version': FORMAT_VERSION,
+               'revision': revision}
+
+        for table in TABLES:
+            key = table.primary_key.columns.values()
+            yield {'entity': table.name,
+                   'columns': [column.name for column in table.columns]}
+
+            rows = self.session.execute(
+                select([table])
+                .order_by(*key)
+                .execution_options(stream_results=True)
+            )
+            for row in rows:
+                yield list(row)
+
+        yield {'end': True}
+
+    def changes(self, after, revision):
+        '''Yield the frames of the changes after one revision up to the
+        snapshot's: a header, then [revision, entity, operation, data]'''
+        yield {'format': 'iam-changes', 'version': FORMAT_VERSION,
+               'after': after, 'revision': revision}
+
+        changes = ChangesDAO(self.session).iterate(after=after, stream=True)
+        for change in changes:
+            yield [change.revision, change.entity, change.operation,
+                   change.data]
+
+        yield {'end': True}
+
+
+__all__ = ['ExportDAO', 'FORMAT_VERSION', 'TABLES']
@@ -0,0 +1,46 @@
+from flask import json
+from struct import Struct
+
+
+# Each frame is a compact JSON value prefixed by its length in bytes
+LENGTH = Struct('>I')
+
+BUFFER_SIZE = 64 * 1024
+
+
+def frame(value):
+    data = json.dumps(value, separators=(',', ':'), sort_keys=False).encode()
+    return LENGTH.pack(len(data)) + data
+
+
+def buffered(values, size=BUFFER_SIZE):
+    '''Encode values as frames, yielding them in chunks of about `size`
+    bytes rather than one small write per value'''
+    buffer = bytearray()
+    for value in values:
+        buffer += frame(value)
+        if len(buffer) >= size:
+            yield bytes(buffer)
+            buffer.clear()
+    if buffer:
+        yield bytes(buffer)
+
+
+def read(stream):
+    '''Decode the frames read from a binary file-like object'''
+    while True:
+        header = stream.read(LENGTH.size)
+        if not header:
+            return
+        if len(header) < LENGTH.size:
+            raise ValueError('Truncated frame header')
+
+        length, = LENGTH.unpack(header)
+        data = stream.read(length)
+        if len(data) < length:
+            raise ValueError('Truncated frame')
+
+        yield json.loads(data)
+
+
+__all__ = ['LENGTH', 'buffered', 'frame', 'read']
@@ -0,0 +1,145 @@
+from sqlalchemy import String
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+from sqlalchemy.sql import bindparam, func, select, text
+
+from . import effective
+from .db import principal_generation_table, user_group_table, \
+    user_policy_table, group_closure_table, group_policy_table
+
+
+# Nesting changes can change the rules of any principal, so they hold this
+# exclusively, and every other write changing effective rules holds it
+# shared. The closure those writes read so stays as it is until they end.
+NESTING_LOCK = func.hashtext('group_group')
+
+LOCK_KEYS = text(
+    'SELECT count(pg_advisory_xact_lock(hashtext(key))) '
+    'FROM unnest(:keys) AS key'
+).bindparams(bindparam('keys', type_=ARRAY(String)))
+
+
+def key(kind, name):
+    return kind + ':' + name
+
+
+def lock_nesting(session):
+    session.execute(select([func.pg_advisory_xact_lock(NESTING_LOCK)]))
+
+
+def lock_keys(session, keys):
+    # In order, so writes locking some of the same keys don't deadlock
+    if keys:
+        session.execute(LOCK_KEYS, {'keys': sorted(keys)})
+
+
+def lock(session, policies=(), groups=(), rules=False):
+    '''Wait for writes changing effective rules through the given policies
+    or groups to commit, and make later ones wait for this one
+
+    Each write refreshes the principals it finds affected, and can't see
+    what concurrent writes haven't committed: one attaching a policy to a
+    group and one adding a user to the group would each miss the user
+    getting the policy. Writes through the same policies and groups
+    therefore run in turn, each taking the locks before it writes.
+
+    Groups are locked with every group they are nested in, as members
+    joining or leaving them get the rules of all of those. With `rules`,
+    the rules of the policies change, so the groups the policies are
+    attached to are locked too. Policies are locked before groups.
+    '''
+    session.execute(select([func.pg_advisory_xact_lock_shared(NESTING_LOCK)]))
+
+    policies = set(policies)
+    lock_keys(session, set(key('policy', policy) for policy in policies))
+
+    groups = set(groups)
+    if rules and policies:
+        # Read after the policies are locked, which attaching them takes
+        groups.update(row['group'] for row in session.execute(
+            select([group_policy_table.c.group])
+            .where(group_policy_table.c.policy.in_(sorted(policies)))
+        ))
+    if groups:
+        # Groups that don't exist are in no other write's way
+        ancestors = session.execute(
+            select([group_closure_table.c.ancestor])
+            .where(group_closure_table.c.descendant.in_(sorted(groups)))
+        )
+        lock_keys(session, set(key('group', row['ancestor'])
+                               for row in ancestors))
+
+
+def get(session, kind, name):
+    generation = session.execute(
+        select([principal_generation_table.c.generation])
+        .where(principal_generation_table.c.principal == key(kind, name))
+    ).scalar()
+
+    return generation or 0
+
+
+def bump(session, users=(), groups=()):
+    '''Mark the effective rules of the given principals as changed, and
+    bring their materialized rules up to date
+
+    Bumping locks the principals' generations until the transaction ends,
+    so concurrent writes to the same principal refresh its rules in turn,
+    each after the other's changes are visible.
+    '''
+    users = set(users)
+    groups = set(groups)
+    principals = sorted(
+        set(key('user', user) for user in users) |
+        set(key('group', group) for group in groups)
+    )
+
+    if not principals:
+        return
+
+    statement = insert(principal_generation_table).values([
+        {'principal': principal, 'generation': 1}
+        for principal in principals
+    ])
+
+    session.execute(statement.on_conflict_do_update(
+        index_elements=[principal_generation_table.c.principal],
+        set_={'generation': principal_generation_table.c.generation + 1}
+    ))
+
+    effective.refresh(session, users=users, groups=groups)
+
+
+def principals(session, groups=(), policies=()):
+    '''Find the principals whose effective rules depend on the given
+    groups or policies, returning a (users, groups) pair of sets'''
+    groups = set(groups)
+    users = set()
+
+    if policies:
+        groups.update(row['group'] for row in session.execute(
+            select([group_policy_table.c.group])
+            .where(group_policy_table.c.policy.in_(policies))
+        ))
+
+        users.update(row['user'] for row in session.execute(
+            select([user_policy_table.c.user])
+            .where(user_policy_table.c.policy.in_(policies))
+        ))
+
+    if groups:
+        # Groups nested in them, however deeply, inherit their policies
+        groups.update(row['descendant'] for row in session.execute(
+            select([group_closure_table.c.descendant])
+            .where(group_closure_table.c.ancestor.in_(groups))
+        ))
+
+        users.update(row['user'] for row in session.execute(
+            select([user_group_table.c.user])
+            .where(user_group_table.c.group.in_(groups))
+        ))
+
+    return users, groups
+
+
+__all__ = ['NESTING_LOCK', 'bump', 'get', 'key', 'lock', 'lock_nesting',
+           'principals']
@@ -1,8 +1,13 @@
-from flask_restplus import Namespace, Resource, fields
+from contextlib import contextmanager
+from flask_restplus import Resource, fields
 from flask import abort
 
 from ..db import db
-from .dao import GroupsDAO
+from ..namespace import Namespace, references
+from ..projection import fields_parser, projection
+from ..pagination import NEXT_CURSOR_HEADER, list_parser, decode_cursor, \
+    page, stream
+from .dao import CycleError, GroupsDAO
 
 
 api = Namespace('groups', description='Group Management')
@@ -12,31 +17,57 @@ group = api.model('Group', {
     'name': fields.String(required=True),
     'users': fields.List(fields.String(required=True)),
     'policies': fields.List(fields.String(required=True)),
+    'groups': fields.List(fields.String(required=True),
+                          description='Groups nested in the group, whose '
+                                      'members get its policies too'),
 })
 
 
+@contextmanager
+def acyclic(session):
+    '''Abort with 409 when a write would nest a group in itself'''
+    try:
+        yield
+    except CycleError as error:
+        session.rollback()
+        abort(409, str(error))
+
+
 @api.route('/')
 class Groups(Resource):
     '''List groups'''
     @api.doc('list_groups')
+    @api.expect(list_parser)
+    @api.header(NEXT_CURSOR_HEADER, 'Cursor of the next page, if any')
     @api.marshal_list_with(group)
     def get(self):
+        args = list_parser.parse_args()
+        after = decode_cursor(args['cursor'], 1)
         session = db.session
         groups = GroupsDAO(session)
-        results = groups.list()
+        fields = projection()
+        if args['stream']:
+            results = groups.iterate(limit=args['limit'], after=after,
+                                     stream=True, fields=fields)
+            return stream(session, results, group)
+        results = groups.list(limit=args['limit'], after=after,
+                              fields=fields)
         session.commit()
-        return results
+        return results, 200, page(results, args['limit'],
+                                  lambda result: [result.name])
 
     '''Create group'''
     @api.doc('create_group')
     @api.expect(group)
     @api.marshal_with(group, code=201)
+    @api.response(409, 'Nesting would make a cycle')
     def post(self):
         session = db.session
         groups = GroupsDAO(session)
         data = api.payload
         name = data.pop('name')
-        group = groups.update(name, **data)
+        with acyclic(session):
+            group = groups.update(name, **data)
         session.commit()
         return group, 201
 
@@ -45,11 +76,12 @@ class Groups(Resource):
 class Group(Resource):
     '''Get group'''
     @api.doc('get_group')
+    @api.expect(fields_parser)
     @api.marshal_with(group)
     def get(self, name):
         session = db.session
         groups = GroupsDAO(session)
-        group = groups.get(name) or abort(404)
+        group = groups.get(name, fields=projection()) or abort(404)
         session.commit()
         return group
 
@@ -57,13 +89,15 @@ class Group(Resource):
     @api.doc('update_group')
     @api.expect(group)
     @api.marshal_with(group)
+    @api.response(409, 'Nesting would make a cycle')
     def patch(self, name):
         session = db.session
         groups = GroupsDAO(session)
-        group = groups.get(name) or abort(404)
+        current = groups.get(name) or abort(404)
         data = api.payload
-        'name' in data and data.pop('name')
-        group = groups.update(name, **data)
+        data.pop('name', None)
+        with acyclic(session):
+            group = groups.update(name, current=current, **data)
         session.commit()
         return group
 
@@ -73,10 +107,83 @@ class Group(Resource):
     def delete(self, name):
         session = db.session
         groups = GroupsDAO(session)
-        group = groups.get(name)
-        group is not None and groups.delete(group.name)
+        group = groups.delete(name) or abort(404)
         session.commit()
         return group
 
 
-__all__ = ['api', 'Groups', 'Group', 'group']
+@api.route('/<string:name>/users/<string:user>')
+class GroupUser(Resource):
+    '''Add user to group'''
+    @api.doc('add_group_user')
+    @api.response(204, 'Success')
+    def post(self, name, user):
+        session = db.session
+        groups = GroupsDAO(session)
+        with references(session):
+            groups.add_user(name, user)
+        session.commit()
+        return None, 204
+
+    '''Remove user from group'''
+    @api.doc('remove_group_user')
+    @api.response(204, 'Success')
+    def delete(self, name, user):
+        session = db.session
+        groups = GroupsDAO(session)
+        groups.remove_user(name, user)
+        session.commit()
+        return None, 204
+
+
+@api.route('/<string:name>/policies/<string:policy>')
+class GroupPolicy(Resource):
+    '''Attach policy to group'''
+    @api.doc('attach_group_policy')
+    @api.response(204, 'Success')
+    def post(self, name, policy):
+        session = db.session
+        groups = GroupsDAO(session)
+        with references(session):
+            groups.add_policy(name, policy)
+        session.commit()
+        return None, 204
+
+    '''Detach policy from group'''
+    @api.doc('detach_group_policy')
+    @api.response(204, 'Success')
+    def delete(self, name, policy):
+        session = db.session
+        groups = GroupsDAO(session)
+        groups.remove_policy(name, policy)
+        session.commit()
+        return None, 204
+
+
+@api.route('/<string:name>/groups/<string:member>')
+class GroupGroup(Resource):
+    '''Nest group in group'''
+    @api.doc('add_group_group')
+    @api.response(204, 'Success')
+    @api.response(409, 'Nesting would make a cycle')
+    def post(self, name, member):
+        session = db.session
+        groups = GroupsDAO(session)
+        with references(session), acyclic(session):
+            groups.add_group(name, member)
+        session.commit()
+        return None, 204
+
+    '''Remove nested group from group'''
+    @api.doc('remove_group_group')
+    @api.response(204, 'Success')
+    def delete(self, name, member):
+        session = db.session
+        groups = GroupsDAO(session)
+        groups.remove_group(name, member)
+        session.commit()
+        return None, 204
+
+
+__all__ = ['api', 'Groups', 'Group', 'GroupUser', 'GroupPolicy', 'GroupGroup',
+           'group']
@@ -1,129 +1,332 @@
-from sqlalchemy.sql import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import and_, or_, select
 
-from ..db import group_table, group_policy_table, user_group_table
+from .. import generations
+from ..db import aggregate, keyset, link, synchronize, unlink, \
+    group_table, group_closure_table, group_group_table, group_policy_table, \
+    user_group_table
+
+
+KEY = [group_table.c.name]
+
+
+class CycleError(ValueError):
+    pass
 
 
 class Group(object):
-    def __init__(self, name, users=None, policies=None):
+    __slots__ = ('name', 'users', 'policies', 'groups')
+
+    def __init__(self, name, users=None, policies=None, groups=None):
         self.name = name
         self.users = users
         self.policies = policies
+        self.groups = groups
+
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            name=row['name'],
+            **{field: row[field] or []
+               for field in ('users', 'policies', 'groups')
+               if field in row.keys()}
+        )
+
+
+def paths_through(group, member):
+    # Paths from every ancestor of `group` to every descendant of `member`
+    # that go through the edge between them, counted per pair
+    ancestors = group_closure_table.alias('ancestors')
+    descendants = group_closure_table.alias('descendants')
+    return select([
+        ancestors.c.ancestor,
+        descendants.c.descendant,
+        (ancestors.c.paths * descendants.c.paths).label('paths'),
+    ]).where(and_(
+        ancestors.c.descendant == group,
+        descendants.c.ancestor == member,
+    ))
 
 
 class GroupsDAO(object):
     def __init__(self, session):
         self.session = session
 
-    def get(self, name):
+    def query(self, fields=None):
+        # Each group with its memberships aggregated into a single row,
+        # leaving out memberships that weren't asked for
+        columns = [group_table.c.name]
+
+        if fields is None or 'users' in fields:
+            columns.append(
+                aggregate(user_group_table.c.user,
+                          user_group_table.c.group == group_table.c.name)
+                .label('users'))
+
+        if fields is None or 'policies' in fields:
+            columns.append(
+                aggregate(group_policy_table.c.policy,
+                          group_policy_table.c.group == group_table.c.name)
+                .label('policies'))
+
+        if fields is None or 'groups' in fields:
+            columns.append(
+                aggregate(group_group_table.c.member,
+                          group_group_table.c.group == group_table.c.name)
+                .label('groups'))
+
+        return select(columns)
+
+    def get(self, name, fields=None):
         group = self.session.execute(
-            select([group_table.c.name])
-            .where(group_table.c.name == name)
+            self.query(fields).where(group_table.c.name == name)
         ).first()
 
         if not group:
             return None
 
-        users = map(
-            lambda user_group: user_group['user'],
-            self.session.execute(
-                select([user_group_table.c.user])
-                .where(user_group_table.c.group == name)
-            )
-        )
+        return Group.from_row(group)
+
+    def list(self, limit=None, after=None, fields=None):
+        return list(self.iterate(limit=limit, after=after, fields=fields))
+
+    def iterate(self, limit=None, after=None, stream=False, fields=None):
+        query = keyset(self.query(fields), KEY, limit=limit, after=after) \
+            .execution_options(stream_results=stream)
+
+        for row in self.session.execute(query):
+            yield Group.from_row(row)
+
+    def update(self, name, users=None, policies=None, groups=None,
+               current=None):
+        if groups is not None:
+            self.lock_nesting()
+        elif users is not None or policies is not None:
+            # Policies detached as well as those attached
+            attached = set(policies or ())
+            if policies is not None:
+                attached.update(row['policy'] for row in self.session.execute(
+                    select([group_policy_table.c.policy])
+                    .where(group_policy_table.c.group == name)
+                ))
+            generations.lock(self.session, policies=attached, groups=[name])
+
+        # The result is assembled from what was written and the group's
+        # prior state, which callers may pass in if they already have it.
+        if current is None:
+            created = self.session.execute(
+                insert(group_table)
+                .values(name=name)
+                .on_conflict_do_nothing()
+            ).rowcount
 
-        policies = map(
-            lambda group_policy: group_policy['policy'],
-            self.session.execute(
-                select([group_policy_table.c.policy])
-                .where(group_policy_table.c.group == name)
+            current = Group(name, users=[], policies=[], groups=[]) \
+                if created else self.get(name)
+
+        # Only members that joined or left are affected by membership
+        # changes, but a change of policies affects every member, nested
+        # groups and their members included.
+        affected = set()
+        affected_groups = set()
+
+        if users is not None:
+            added, removed = synchronize(self.session,
+                                         user_group_table.c.group, name,
+                                         user_group_table.c.user, users)
+            affected.update(added, removed)
+            users = sorted(set(users))
+
+        if policies is not None:
+            added, removed = synchronize(self.session,
+                                         group_policy_table.c.group, name,
+                                         group_policy_table.c.policy,
+                                         policies)
+            if added or removed:
+                members, nested = generations.principals(self.session,
+                                                         groups=[name])
+                affected.update(members)
+                affected_groups.update(nested)
+            policies = sorted(set(policies))
+
+        if groups is not None:
+            groups = sorted(set(groups))
+            # Read under the lock, as `current` may predate a nesting change
+            nested = self.session.execute(
+                select([group_group_table.c.member])
+                .where(group_group_table.c.group == name)
             )
-        )
+            changed = set(groups).symmetric_difference(
+                row['member'] for row in nested)
+            for member in sorted(changed):
+                if member in groups:
+                    self.nest(name, member)
+                else:
+                    self.unnest(name, member)
+            members, nested = generations.principals(self.session,
+                                                     groups=changed)
+            affected.update(members)
+            affected_groups.update(nested)
+
+        generations.bump(self.session, users=affected,
+                         groups=affected_groups | {name})
 
         return Group(
-            name=group['name'],
-            users=list(users),
-            policies=list(policies)
+            name=name,
+            users=current.users if users is None else users,
+            policies=current.policies if policies is None else policies,
+            groups=current.groups if groups is None else groups
         )
 
-    def list(self):
-        results = self.session.execute(
-            select([
-                group_table.c.name,
-                user_group_table.c.user,
-                group_policy_table.c.policy,
-            ]).select_from(
-                group_table
-                .outerjoin(user_group_table,
-                           group_table.c.name == user_group_table.c.group)
-                .outerjoin(group_policy_table,
-                           group_table.c.name == group_policy_table.c.group)
-            ).order_by(
-                group_table.c.name,
-                user_group_table.c.user,
-                group_policy_table.c.policy,
-            )
-        )
+    def add_user(self, name, user):
+        generations.lock(self.session, groups=[name])
+        if link(self.session, user_group_table, user=user, group=name):
+            generations.bump(self.session, users=[user])
 
-        group = None
-        groups = []
+    def remove_user(self, name, user):
+        generations.lock(self.session, groups=[name])
+        if unlink(self.session, user_group_table, user=user, group=name):
+            generations.bump(self.session, users=[user])
 
-        for result in results:
-            if group is None or result['name'] != group.name:
-                if group is not None:
-                    groups.append(group)
-                group = Group(name=result['name'])
-                group.users = []
-                group.policies = []
+    def add_policy(self, name, policy):
+        generations.lock(self.session, policies=[policy], groups=[name])
+        if link(self.session, group_policy_table, group=name, policy=policy):
+            self.bump_members(name)
 
-            if result['user'] is not None:
-                group.users.append(result['user'])
+    def remove_policy(self, name, policy):
+        generations.lock(self.session, policies=[policy], groups=[name])
+        if unlink(self.session, group_policy_table,
+                  group=name, policy=policy):
+            self.bump_members(name)
 
-            if result['policy'] is not None:
-                group.policies.append(result['policy'])
+    def add_group(self, name, member):
+        if self.nest(name, member):
+            self.bump_members(member)
 
-        if group is not None:
-            groups.append(group)
+    def remove_group(self, name, member):
+        if self.unnest(name, member):
+            self.bump_members(member)
 
-        return groups
+    def nest(self, name, member):
+        '''Make `member` a member of group `name`, so it and its members
+        get the group's policies, returning whether it wasn't already
 
-    def update(self, name, users=None, policies=None):
-        group = self.session.execute(
-            select([group_table.c.name])
-            .where(group_table.c.name == name)
+        Raises CycleError if `name` is `member` or already a member of it.
+        '''
+        session = self.session
+        self.lock_nesting()
+
+        # Every group is its own descendant, which covers nesting in itself
+        cycle = session.execute(
+            select([group_closure_table.c.paths])
+            .where(and_(group_closure_table.c.ancestor == member,
+                        group_closure_table.c.descendant == name))
         ).first()
+        if cycle:
+            raise CycleError('{} is a member of {}'.format(name, member))
 
-        if not group:
-            self.session.execute(
-                group_table.insert().values(name=name)
-            )
+        if not link(session, group_group_table, group=name, member=member):
+            return False
 
-        if users is not None:
-            self.session.execute(user_group_table.delete()
-                                 .where(user_group_table.c.group == name))
-            for user in users:
-                self.session.execute(
-                    user_group_table.insert()
-                    .values(user=user, group=name)
-                )
+        statement = insert(group_closure_table).from_select(
+            ['ancestor', 'descendant', 'paths'], paths_through(name, member))
+        session.execute(statement.on_conflict_do_update(
+            constraint='pk_group_closure',
+            set_={'paths': group_closure_table.c.paths +
+                  statement.excluded.paths}
+        ))
+        return True
 
-        if policies is not None:
-            self.session.execute(group_policy_table.delete()
-                                 .where(group_policy_table.c.group == name))
-            for policy in policies:
-                self.session.execute(
-                    group_policy_table.insert()
-                    .values(group=name, policy=policy)
-                )
+    def unnest(self, name, member):
+        '''Remove `member` from group `name`, returning whether it was a
+        member'''
+        session = self.session
+        self.lock_nesting()
+
+        if not unlink(session, group_group_table, group=name, member=member):
+            return False
+
+        # Pairs only connected through the edge go, the others lose the
+        # paths it made. Neither statement changes the rows of `name`'s
+        # ancestors or `member`'s descendants, as the graph is acyclic.
+        removed = paths_through(name, member).alias('removed')
+        matches = and_(
+            group_closure_table.c.ancestor == removed.c.ancestor,
+            group_closure_table.c.descendant == removed.c.descendant,
+        )
+        session.execute(
+            group_closure_table.delete()
+            .where(and_(matches,
+                        group_closure_table.c.paths == removed.c.paths))
+        )
+        session.execute(
+            group_closure_table.update()
+            .where(matches)
+            .values(paths=group_closure_table.c.paths - removed.c.paths)
+        )
+        return True
 
-        return self.get(name)
+    def lock_nesting(self):
+        '''Serialize nesting changes, so each one sees the closure every
+        earlier one left and two of them can't close a cycle between them
+
+        It is taken before a nesting change writes anything, so it is never
+        waited for while holding locks those writes take, and also keeps
+        out every other write changing effective rules, see
+        generations.lock.
+        '''
+        generations.lock_nesting(self.session)
+
+    def bump_members(self, name):
+        users, groups = generations.principals(self.session, groups=[name])
+        generations.bump(self.session, users=users, groups=groups)
 
     def delete(self, name):
-        self.session.execute(group_policy_table.delete()
-                             .where(group_policy_table.c.group == name))
-        self.session.execute(user_group_table.delete()
-                             .where(user_group_table.c.group == name))
-        self.session.execute(group_table.delete()
-                             .where(group_table.c.name == name))
+        # Taken before the group's nestings are read, so none change until
+        # they are removed
+        self.lock_nesting()
+
+        # Members of nested groups lose the group's policies, and are only
+        # found through the closure before the group leaves it.
+        affected, affected_groups = \
+            generations.principals(self.session, groups=[name])
+
+        groups = self.session.execute(
+            select([group_group_table.c.group, group_group_table.c.member])
+            .where(or_(group_group_table.c.group == name,
+                       group_group_table.c.member == name))
+        ).fetchall()
+        for group, member in groups:
+            self.unnest(group, member)
+        groups = sorted(member for group, member in groups if group == name)
+
+        # Deleted rows are returned, so the deleted group and its former
+        # members are known without reading them first.
+        policies = self.session.execute(
+            group_policy_table.delete()
+            .where(group_policy_table.c.group == name)
+            .returning(group_policy_table.c.policy)
+        )
+        policies = sorted(row['policy'] for row in policies)
+
+        users = self.session.execute(
+            user_group_table.delete()
+            .where(user_group_table.c.group == name)
+            .returning(user_group_table.c.user)
+        )
+        users = sorted(row['user'] for row in users)
+
+        deleted = self.session.execute(
+            group_table.delete()
+            .where(group_table.c.name == name)
+        ).rowcount
+
+        if not deleted:
+            return None
+
+        generations.bump(self.session, users=affected,
+                         groups=affected_groups)
+
+        return Group(name=name, users=users, policies=policies, groups=groups)
 
 
-__all__ = ['GroupsDAO']
+__all__ = ['CycleError', 'GroupsDAO']
@@ -0,0 +1,78 @@
+from flask import current_app, g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from time import perf_counter
+
+
+STATEMENTS_HEADER = 'X-SQL-Statements'
+
+TIME_HEADER = 'X-SQL-Time'
+
+EXPLAINABLE = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    context.started = perf_counter()
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    elapsed = perf_counter() - context.started
+
+    # Statements outside of requests and app contexts aren't counted
+    if not has_app_context():
+        return
+
+    g.sql_statements = g.get('sql_statements', 0) + 1
+    g.sql_time = g.get('sql_time', 0.0) + elapsed
+
+    threshold = current_app.config['SQL_SLOW_QUERY_THRESHOLD']
+    if threshold > 0 and elapsed >= threshold:
+        plan = None if executemany else explain(conn, statement, parameters)
+        current_app.logger.warning(
+            'Slow query (%.1fms): %s\nParameters: %r\nPlan:\n%s',
+            elapsed * 1000, statement, parameters, plan or 'Unavailable')
+
+
+def explain(conn, statement, parameters):
+    '''The plan of a statement, on the connection that just ran it'''
+    if not statement.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+
+    # A failed EXPLAIN must not abort the transaction it runs in, and the
+    # raw cursor keeps it out of the statement counts.
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute('SAVEPOINT explain')
+        try:
+            cursor.execute('EXPLAIN ' + statement, parameters)
+            return '\n'.join(row[0] for row in cursor.fetchall())
+        except Exception as error:
+            cursor.execute('ROLLBACK TO SAVEPOINT explain')
+            return 'Unavailable: {}'.format(error)
+        finally:
+            cursor.execute('RELEASE SAVEPOINT explain')
+    finally:
+        cursor.close()
+
+
+def add_headers(response):
+    config = current_app.config
+    if current_app.debug or config['SQL_STATS_HEADERS']:
+        # Statements streamed in the body after this point aren't included
+        response.headers[STATEMENTS_HEADER] = str(g.get('sql_statements', 0))
+        response.headers[TIME_HEADER] = \
+            '{:.3f}'.format(g.get('sql_time', 0.0) * 1000)
+    return response
+
+
+def instrument(app):
+    '''Count statements and database time per request, and log slow
+    statements with their plans'''
+    event.listen(Engine, 'before_cursor_execute', before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', after_cursor_execute)
+    app.after_request(add_headers)
+
+
+__all__ = ['STATEMENTS_HEADER', 'TIME_HEADER', 'explain', 'instrument']
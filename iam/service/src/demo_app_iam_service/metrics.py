@@ -0,0 +1,222 @@
+from atexit import register as at_exit
+from flask import Response, g, request
+from os import environ, getpid, register_at_fork
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, \
+    Counter, Gauge, Histogram, REGISTRY, generate_latest, multiprocess
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
+from time import perf_counter
+
+
+# When set, each uwsgi worker writes its samples to files in this
+# directory and /metrics aggregates the files of every worker. start.sh
+# sets it up; it must be set before the workers start.
+MULTIPROCESS_DIR = 'PROMETHEUS_MULTIPROC_DIR'
+
+METRICS_PATH = '/metrics'
+
+
+REQUESTS = Counter(
+    'iam_http_requests_total',
+    'Requests handled, by namespace, method and status',
+    ['namespace', 'method', 'status'])
+
+REQUEST_ERRORS = Counter(
+    'iam_http_request_errors_total',
+    'Requests answered with a server error, by namespace and method',
+    ['namespace', 'method'])
+
+REQUEST_DURATION = Histogram(
+    'iam_http_request_duration_seconds',
+    'Time until the response is returned, excluding streamed bodies',
+    ['namespace', 'method'])
+
+POOL_CHECKOUT_WAIT = Histogram(
+    'iam_db_pool_checkout_wait_seconds',
+    'Time to check out a database connection, including connecting',
+    ['bind'],
+    buckets=(.0001, .0005, .001, .005, .01, .05, .1, .5, 1, 5, 10, 30))
+
+POOL_CHECKOUT_TIMEOUTS = Counter(
+    'iam_db_pool_checkout_timeouts_total',
+    'Checkouts that gave up waiting for a connection',
+    ['bind'])
+
+POOL_IN_USE = Gauge(
+    'iam_db_pool_connections_in_use',
+    'Connections checked out of the pools, by bind',
+    ['bind'],
+    multiprocess_mode='livesum')
+
+POOL_CAPACITY = Gauge(
+    'iam_db_pool_connections_capacity',
+    'Connections the pools may open, including overflow, by bind',
+    ['bind'],
+    multiprocess_mode='livesum')
+
+RULES_CACHE_REQUESTS = Counter(
+    'iam_rules_cache_requests_total',
+    'Rules cache lookups, by result',
+    ['result'])
+
+RULES_CACHE_EVICTIONS = Counter(
+    'iam_rules_cache_evictions_total',
+    'Rule sets evicted from the rules cache to bound its size')
+
+RULES_CACHE_EXPIRATIONS = Counter(
+    'iam_rules_cache_expirations_total',
+    'Rule sets dropped from the rules cache as stale')
+
+RULES_CACHE_ENTRIES = Gauge(
+    'iam_rules_cache_entries',
+    'Rule sets held in the rules caches',
+    multiprocess_mode='livesum')
+
+RULES_SNAPSHOT_LOADS = Counter(
+    'iam_rules_snapshot_loads_total',
+    'Rules snapshots mapped')
+
+RULES_SNAPSHOT_STALE = Counter(
+    'iam_rules_snapshot_stale_total',
+    'Rule sets read from the database as the rules snapshot fell behind')
+
+RULES_SNAPSHOT_REVISION = Gauge(
+    'iam_rules_snapshot_revision',
+    'Oldest change log revision of the rules snapshots in use',
+    multiprocess_mode='livemin')
+
+
+class TimedQueuePool(QueuePool):
+    '''Queue pool recording how long each checkout waits
+
+    Samples are labelled with the pool's logging name, which db.py sets to
+    the name of its bind, and which pools recreated when an engine is
+    disposed keep.
+    '''
+    def __init__(self, creator, pool_size=5, max_overflow=10,
+                 logging_name=None, **kw):
+        super(TimedQueuePool, self).__init__(
+            creator, pool_size=pool_size, max_overflow=max_overflow,
+            logging_name=logging_name, **kw)
+        bind = logging_name or 'default'
+        self.checkout_wait = POOL_CHECKOUT_WAIT.labels(bind)
+        self.checkout_timeouts = POOL_CHECKOUT_TIMEOUTS.labels(bind)
+        self.in_use = POOL_IN_USE.labels(bind)
+        # Unbounded pools never saturate, and report no capacity
+        if pool_size > 0 and max_overflow >= 0:
+            POOL_CAPACITY.labels(bind).set(pool_size + max_overflow)
+
+    def timed(self, checkout):
+        start = perf_counter()
+        try:
+            return checkout()
+        except TimeoutError:
+            self.checkout_timeouts.inc()
+            raise
+        finally:
+            self.checkout_wait.observe(perf_counter() - start)
+
+    def connect(self):
+        return self.timed(super(TimedQueuePool, self).connect)
+
+    # What engines check out with
+    def unique_connection(self):
+        return self.timed(super(TimedQueuePool, self).unique_connection)
+
+    # Every connection handed out is returned exactly once, whether it's
+    # checked in, fails to connect or is detached
+    def _do_get(self):
+        record = super(TimedQueuePool, self)._do_get()
+        self.in_use.inc()
+        return record
+
+    def _do_return_conn(self, record):
+        self.in_use.dec()
+        super(TimedQueuePool, self)._do_return_conn(record)
+
+
+def namespace(rule):
+    # The first segment of the matched route, e.g. users for /users/v1/
+    if rule is None:
+        return 'none'
+    return rule.rule.strip('/').split('/', 1)[0] or 'root'
+
+
+class RequestMetrics(object):
+    '''The samples of one route and method, looked up once'''
+    __slots__ = ['labels', 'duration', 'errors', 'statuses']
+
+    def __init__(self, rule, method):
+        self.labels = (namespace(rule), method)
+        self.duration = REQUEST_DURATION.labels(*self.labels)
+        self.errors = REQUEST_ERRORS.labels(*self.labels)
+        self.statuses = {}
+
+    def record(self, elapsed, status):
+        self.duration.observe(elapsed)
+
+        requests = self.statuses.get(status)
+        if requests is None:
+            requests = self.statuses[status] = \
+                REQUESTS.labels(*self.labels, str(status))
+        requests.inc()
+
+        if status >= 500:
+            self.errors.inc()
+
+
+_routes = {}
+
+
+def start_timer():
+    g.request_started = perf_counter()
+
+
+def record_request(response):
+    started = g.get('request_started')
+    if started is None:
+        return response
+    elapsed = perf_counter() - started
+
+    current = request._get_current_object()
+    key = (current.endpoint, current.method)
+    route = _routes.get(key)
+    if route is None:
+        route = _routes[key] = RequestMetrics(current.url_rule,
+                                              current.method)
+
+    route.record(elapsed, response.status_code)
+    return response
+
+
+def registry():
+    if MULTIPROCESS_DIR not in environ:
+        return REGISTRY
+    collected = CollectorRegistry()
+    multiprocess.MultiProcessCollector(collected)
+    return collected
+
+
+def metrics():
+    return Response(generate_latest(registry()),
+                    content_type=CONTENT_TYPE_LATEST)
+
+
+def forget_worker():
+    # Drops the live gauges of a worker as it exits, from the files it
+    # wrote under its pid
+    pid = getpid()
+    at_exit(lambda: multiprocess.mark_process_dead(pid))
+
+
+def add_metrics(app):
+    '''Record request metrics and serve them at /metrics'''
+    app.before_request(start_timer)
+    app.after_request(record_request)
+    app.add_url_rule(METRICS_PATH, 'metrics', metrics)
+
+    if MULTIPROCESS_DIR in environ:
+        register_at_fork(after_in_child=forget_worker)
+
+
+__all__ = ['TimedQueuePool', 'add_metrics']
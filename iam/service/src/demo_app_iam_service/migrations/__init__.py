@@ -0,0 +1,35 @@
+from alembic import command
+from alembic.config import Config
+from os.path import dirname
+from sqlalchemy import inspect
+
+from ..db import db
+
+
+INITIAL_REVISION = '0001'
+
+
+def config(connection=None):
+    config = Config()
+    config.set_main_option('script_location', dirname(__file__))
+    config.attributes['connection'] = connection
+    return config
+
+
+def upgrade(revision='head', connection=None):
+    migrations = config(connection)
+
+    # Databases created by db.create_all() before migrations existed hold
+    # the initial schema but no version, so adopt them at that revision.
+    tables = inspect(connection or db.engine).get_table_names()
+    if 'alembic_version' not in tables and 'user' in tables:
+        command.stamp(migrations, INITIAL_REVISION)
+
+    command.upgrade(migrations, revision)
+
+
+def downgrade(revision, connection=None):
+    command.downgrade(config(connection), revision)
+
+
+__all__ = ['INITIAL_REVISION', 'config', 'upgrade', 'downgrade']
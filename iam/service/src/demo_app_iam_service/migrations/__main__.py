@@ -0,0 +1,15 @@
+from alembic.config import CommandLine
+
+from . import config
+
+
+def main(argv=None):
+    cli = CommandLine(prog='python -m demo_app_iam_service.migrations')
+    options = cli.parser.parse_args(argv)
+    if not hasattr(options, 'cmd'):
+        cli.parser.error('too few arguments')
+    cli.run_cmd(config(), options)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,38 @@
+from alembic import context
+
+from demo_app_iam_service.app import app
+from demo_app_iam_service.db import db
+
+
+def run_migrations_offline():
+    context.configure(
+        url=app.config['SQLALCHEMY_DATABASE_URI'],
+        target_metadata=db.metadata,
+        literal_binds=True,
+    )
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+def run_migrations_online():
+    # Callers may pass their own connection (and transaction) through
+    connection = context.config.attributes.get('connection')
+    if connection is not None:
+        run_migrations(connection)
+    else:
+        with db.engine.connect() as connection:
+            run_migrations(connection)
+
+
+def run_migrations(connection):
+    context.configure(connection=connection, target_metadata=db.metadata)
+
+    with context.begin_transaction():
+        context.run_migrations()
+
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,70 @@
+"""Initial schema
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'user',
+        sa.Column('email', sa.String, primary_key=True),
+    )
+    op.create_table(
+        'group',
+        sa.Column('name', sa.String, primary_key=True),
+    )
+    op.create_table(
+        'policy',
+        sa.Column('name', sa.String, primary_key=True),
+    )
+    op.create_table(
+        'rule',
+        sa.Column('effect', sa.String, nullable=False),
+        sa.Column('action', sa.String, nullable=False),
+        sa.Column('resource', sa.String, nullable=False),
+        sa.Column('precedence', sa.Integer, nullable=False),
+        sa.Column('policy', sa.String, sa.ForeignKey('policy.name'),
+                  nullable=False),
+    )
+    op.create_table(
+        'user_group',
+        sa.Column('user', sa.String, sa.ForeignKey('user.email'),
+                  nullable=False),
+        sa.Column('group', sa.String, sa.ForeignKey('group.name'),
+                  nullable=False),
+    )
+    op.create_table(
+        'user_policy',
+        sa.Column('user', sa.String, sa.ForeignKey('user.email'),
+                  nullable=False),
+        sa.Column('policy', sa.String, sa.ForeignKey('policy.name'),
+                  nullable=False),
+    )
+    op.create_table(
+        'group_policy',
+        sa.Column('group', sa.String, sa.ForeignKey('group.name'),
+                  nullable=False),
+        sa.Column('policy', sa.String, sa.ForeignKey('policy.name'),
+                  nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('group_policy')
+    op.drop_table('user_policy')
+    op.drop_table('user_group')
+    op.drop_table('rule')
+    op.drop_table('policy')
+    op.drop_table('group')
+    op.drop_table('user')
@@ -0,0 +1,59 @@
+"""Keys and indexes for rules and memberships
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+KEYS = {
+    'user_group': ('user', 'group'),
+    'user_policy': ('user', 'policy'),
+    'group_policy': ('group', 'policy'),
+    'rule': ('policy', 'effect', 'action', 'resource', 'precedence'),
+}
+
+
+# Reverse lookups: members of a group, and principals attached to a policy
+INDEXES = {
+    'ix_user_group_group': ('user_group', ('group', 'user')),
+    'ix_user_policy_policy': ('user_policy', ('policy', 'user')),
+    'ix_group_policy_policy': ('group_policy', ('policy', 'group')),
+}
+
+
+def dedupe(table, columns):
+    op.execute(
+        'DELETE FROM "{table}" a USING "{table}" b '
+        'WHERE a.ctid < b.ctid AND {match}'.format(
+            table=table,
+            match=' AND '.join(
+                'a."{0}" = b."{0}"'.format(column) for column in columns
+            )
+        )
+    )
+
+
+def upgrade():
+    for table, columns in KEYS.items():
+        dedupe(table, columns)
+        op.create_primary_key('pk_' + table, table, list(columns))
+
+    for name, (table, columns) in INDEXES.items():
+        op.create_index(name, table, list(columns))
+
+
+def downgrade():
+    for name, (table, _) in INDEXES.items():
+        op.drop_index(name, table_name=table)
+
+    for table in KEYS:
+        op.drop_constraint('pk_' + table, table, type_='primary')
@@ -0,0 +1,124 @@
+"""Change log of committed mutations
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+from sqlalchemy.dialects import postgresql
+import sqlalchemy as sa
+
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+TABLES = [
+    'user',
+    'group',
+    'policy',
+    'rule',
+    'user_group',
+    'user_policy',
+    'group_policy',
+]
+
+
+# Every row in the logged tables is its own key, so rows are only ever
+# inserted or deleted and the row itself identifies what changed.
+#
+# Changes are logged without a revision, in the order they are made, and
+# the transaction is marked as having some so its commit numbers them.
+RECORD_CHANGE = '''
+CREATE FUNCTION record_change() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO change (entity, operation, data)
+    VALUES (
+        TG_TABLE_NAME,
+        lower(TG_OP),
+        to_jsonb(CASE WHEN TG_OP = 'DELETE' THEN OLD ELSE NEW END)
+    );
+    PERFORM set_config('iam.unnumbered_changes', 'on', true);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''
+
+
+# Runs as the transaction commits. The advisory lock is only taken then,
+# so writers don't wait for each other for as long as they run, and is
+# held until the commit completes, so revisions become visible in order
+# and a reader that has seen revision N never later finds a smaller one.
+# Other transactions' unnumbered changes aren't visible, so only this
+# one's are numbered. The notification carries no payload, so it is sent
+# once per transaction.
+NUMBER_CHANGES = '''
+CREATE FUNCTION number_changes() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtext('change'));
+    UPDATE change SET revision = numbered.revision
+    FROM (
+        SELECT position,
+               (SELECT coalesce(max(revision), 0) FROM change) +
+               row_number() OVER (ORDER BY position) AS revision
+        FROM change
+        WHERE revision IS NULL
+    ) numbered
+    WHERE change.position = numbered.position;
+    PERFORM set_config('iam.unnumbered_changes', '', true);
+    PERFORM pg_notify('change', '');
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''
+
+
+# Only queued for the first change of a transaction, as the condition is
+# checked when the row is inserted rather than at commit
+NUMBER_CHANGES_TRIGGER = '''
+CREATE CONSTRAINT TRIGGER number_changes AFTER INSERT ON change
+DEFERRABLE INITIALLY DEFERRED FOR EACH ROW
+WHEN (current_setting('iam.unnumbered_changes', true)
+      IS DISTINCT FROM 'on')
+EXECUTE PROCEDURE number_changes()
+'''
+
+
+def upgrade():
+    op.create_table(
+        'change',
+        sa.Column('position', sa.BigInteger, nullable=False),
+        sa.Column('revision', sa.BigInteger),
+        sa.Column('entity', sa.String, nullable=False),
+        sa.Column('operation', sa.String, nullable=False),
+        sa.Column('data', postgresql.JSONB, nullable=False),
+        sa.PrimaryKeyConstraint('position', name='pk_change'),
+    )
+    op.create_index('ix_change_revision', 'change', ['revision'],
+                    unique=True)
+    op.execute('CREATE INDEX ix_change_unnumbered ON change (position) '
+               'WHERE revision IS NULL')
+
+    op.execute(RECORD_CHANGE)
+    op.execute(NUMBER_CHANGES)
+    op.execute(NUMBER_CHANGES_TRIGGER)
+
+    for table in TABLES:
+        op.execute(
+            'CREATE TRIGGER record_change AFTER INSERT OR DELETE '
+            'ON "{}" FOR EACH ROW EXECUTE PROCEDURE record_change()'
+            .format(table)
+        )
+
+
+def downgrade():
+    for table in TABLES:
+        op.execute('DROP TRIGGER record_change ON "{}"'.format(table))
+
+    op.execute('DROP TRIGGER number_changes ON change')
+    op.execute('DROP FUNCTION number_changes()')
+    op.execute('DROP FUNCTION record_change()')
+    op.drop_table('change')
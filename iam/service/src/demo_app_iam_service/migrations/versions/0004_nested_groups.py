@@ -0,0 +1,76 @@
+"""Nested groups and their transitive closure
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+# Every group is its own ancestor, so queries join the closure without
+# special-casing a group's own policies. The reflexive row is added with
+# the group however it is created, and removed by cascade with it.
+ADD_GROUP_CLOSURE = '''
+CREATE FUNCTION add_group_closure() RETURNS trigger AS $$
+BEGIN
+    INSERT INTO group_closure (ancestor, descendant, paths)
+    VALUES (NEW.name, NEW.name, 1);
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+'''
+
+
+def upgrade():
+    op.create_table(
+        'group_group',
+        sa.Column('group', sa.String, sa.ForeignKey('group.name'),
+                  nullable=False),
+        sa.Column('member', sa.String, sa.ForeignKey('group.name'),
+                  nullable=False),
+        sa.PrimaryKeyConstraint('group', 'member', name='pk_group_group'),
+    )
+    op.create_index('ix_group_group_member', 'group_group',
+                    ['member', 'group'])
+
+    op.create_table(
+        'group_closure',
+        sa.Column('ancestor', sa.String,
+                  sa.ForeignKey('group.name', ondelete='CASCADE'),
+                  nullable=False),
+        sa.Column('descendant', sa.String,
+                  sa.ForeignKey('group.name', ondelete='CASCADE'),
+                  nullable=False),
+        sa.Column('paths', sa.BigInteger, nullable=False),
+        sa.PrimaryKeyConstraint('ancestor', 'descendant',
+                                name='pk_group_closure'),
+    )
+    op.create_index('ix_group_closure_descendant', 'group_closure',
+                    ['descendant', 'ancestor'])
+
+    op.execute('INSERT INTO group_closure (ancestor, descendant, paths) '
+               'SELECT name, name, 1 FROM "group"')
+
+    op.execute(ADD_GROUP_CLOSURE)
+    op.execute('CREATE TRIGGER add_group_closure AFTER INSERT ON "group" '
+               'FOR EACH ROW EXECUTE PROCEDURE add_group_closure()')
+
+    # Logged like the other tables, see 0003. The closure is derived from
+    # group_group, so followers of the log derive it too.
+    op.execute('CREATE TRIGGER record_change AFTER INSERT OR DELETE '
+               'ON group_group FOR EACH ROW EXECUTE PROCEDURE record_change()')
+
+
+def downgrade():
+    op.execute('DROP TRIGGER add_group_closure ON "group"')
+    op.execute('DROP FUNCTION add_group_closure()')
+    op.drop_table('group_closure')
+    op.drop_table('group_group')
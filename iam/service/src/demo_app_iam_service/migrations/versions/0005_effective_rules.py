@@ -0,0 +1,62 @@
+"""Materialized effective rules
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+# Same rows as demo_app_iam_service.effective.derive() selects, which
+# keeps them up to date from here on
+POPULATE = '''
+INSERT INTO effective_rule
+    (kind, name, source, policy, effect, action, resource, precedence)
+SELECT 'user', up.user, '', r.policy, r.effect, r.action, r.resource,
+       r.precedence
+FROM user_policy up
+JOIN rule r ON r.policy = up.policy
+UNION
+SELECT 'user', ug.user, gp.group, r.policy, r.effect, r.action, r.resource,
+       r.precedence
+FROM user_group ug
+JOIN group_closure gc ON gc.descendant = ug.group
+JOIN group_policy gp ON gp.group = gc.ancestor
+JOIN rule r ON r.policy = gp.policy
+UNION
+SELECT 'group', gc.descendant, gp.group, r.policy, r.effect, r.action,
+       r.resource, r.precedence
+FROM group_closure gc
+JOIN group_policy gp ON gp.group = gc.ancestor
+JOIN rule r ON r.policy = gp.policy
+'''
+
+
+def upgrade():
+    op.create_table(
+        'effective_rule',
+        sa.Column('kind', sa.String, nullable=False),
+        sa.Column('name', sa.String, nullable=False),
+        sa.Column('source', sa.String, nullable=False),
+        sa.Column('policy', sa.String, nullable=False),
+        sa.Column('effect', sa.String, nullable=False),
+        sa.Column('action', sa.String, nullable=False),
+        sa.Column('resource', sa.String, nullable=False),
+        sa.Column('precedence', sa.Integer, nullable=False),
+        sa.PrimaryKeyConstraint('kind', 'name', 'source', 'policy', 'effect',
+                                'action', 'resource', 'precedence',
+                                name='pk_effective_rule'),
+    )
+    op.execute(POPULATE)
+
+
+def downgrade():
+    op.drop_table('effective_rule')
@@ -0,0 +1,27 @@
+"""Generations of principals' effective rules
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'principal_generation',
+        sa.Column('principal', sa.String, primary_key=True),
+        sa.Column('generation', sa.BigInteger, nullable=False),
+    )
+
+
+def downgrade():
+    op.drop_table('principal_generation')
@@ -0,0 +1,77 @@
+from contextlib import contextmanager
+from flask import Response, abort
+from flask_restplus import Namespace as BaseNamespace
+from flask_restplus.marshalling import marshal_with as base_marshal_with
+from flask_restplus.utils import merge, unpack
+from functools import wraps
+from http import HTTPStatus
+from sqlalchemy.exc import IntegrityError
+
+from .projection import mask
+from .serialization import MSGPACK, negotiate, output_msgpack, serialize
+
+
+class marshal_with(base_marshal_with):
+    '''Like flask_restplus.marshal_with, but faster and more flexible
+
+    Handlers may return a ready-made Response (e.g. a stream) from a method
+    that is otherwise documented and marshalled as a model. Other results
+    are serialized with a precompiled serializer for the model, unless a
+    field mask asks for a projection, and sent as MessagePack to clients
+    that prefer it.
+    '''
+    def __call__(self, f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            resp = f(*args, **kwargs)
+            if isinstance(resp, Response):
+                return resp
+
+            # Project with ?fields= as well as flask_restplus' own header
+            requested = mask() or self.mask
+            if requested:
+                marshaller = base_marshal_with(
+                    self.fields, envelope=self.envelope,
+                    skip_none=self.skip_none, mask=requested,
+                    ordered=self.ordered)
+                resp = base_marshal_with.__call__(marshaller, lambda: resp)()
+                data, code, headers = unpack(resp)
+            else:
+                data, code, headers = unpack(resp)
+                data = serialize(data, self.fields, skip_none=self.skip_none)
+                if self.envelope:
+                    data = {self.envelope: data}
+
+            if negotiate() == MSGPACK:
+                return output_msgpack(data, code, headers)
+            return data, code, headers
+        return wrapper
+
+
+class Namespace(BaseNamespace):
+    def marshal_with(self, fields, as_list=False, code=HTTPStatus.OK,
+                     description=None, **kwargs):
+        def wrapper(func):
+            doc = {
+                'responses': {
+                    code: (description, [fields]) if as_list
+                    else (description, fields)
+                },
+                '__mask__': kwargs.get('mask', True),
+            }
+            func.__apidoc__ = merge(getattr(func, '__apidoc__', {}), doc)
+            return marshal_with(fields, ordered=self.ordered, **kwargs)(func)
+        return wrapper
+
+
+@contextmanager
+def references(session):
+    '''Abort with 404 when a write references an entity that doesn't exist'''
+    try:
+        yield
+    except IntegrityError:
+        session.rollback()
+        abort(404)
+
+
+__all__ = ['Namespace', 'marshal_with', 'references']
@@ -0,0 +1,69 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from flask import Response, abort, json, stream_with_context
+from flask_restplus import inputs, marshal
+
+from .projection import fields_parser, mask
+from .serialization import compile_model, dumps
+
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+list_parser = fields_parser.copy()
+list_parser.add_argument('limit', type=inputs.positive, location='args',
+                         help='Maximum number of results to return')
+list_parser.add_argument('cursor', type=str, location='args',
+                         help='Resume listing after the given cursor')
+list_parser.add_argument('stream', type=inputs.boolean, location='args',
+                         default=False,
+                         help='Stream results as newline delimited JSON')
+
+
+def encode_cursor(key):
+    return urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor, length=1):
+    if cursor is None:
+        return None
+
+    try:
+        key = json.loads(urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        key = None
+
+    if not isinstance(key, list) or len(key) != length:
+        abort(400, 'Invalid cursor')
+
+    return key
+
+
+def page(results, limit, key):
+    '''Response headers linking a (possibly partial) page to the next'''
+    if limit is None or len(results) < limit:
+        return {}
+
+    return {NEXT_CURSOR_HEADER: encode_cursor(key(results[-1]))}
+
+
+def stream(session, records, fields, skip_none=False):
+    '''Stream records as newline delimited JSON as they are produced'''
+    requested = mask()
+    if requested:
+        def serialize_one(record):
+            return marshal(record, fields, skip_none=skip_none,
+                           mask=requested)
+    else:
+        serialize_one = compile_model(fields, skip_none=skip_none)
+
+    def generate():
+        for record in records:
+            yield dumps(serialize_one(record)) + '\n'
+        session.commit()
+
+    return Response(stream_with_context(generate()),
+                    mimetype='application/x-ndjson')
+
+
+__all__ = ['NEXT_CURSOR_HEADER', 'list_parser', 'encode_cursor',
+           'decode_cursor', 'page', 'stream']
@@ -1,7 +1,11 @@
-from flask_restplus import Namespace, Resource, fields
+from flask_restplus import Resource, fields
 from flask import abort
 
 from ..db import db
+from ..namespace import Namespace, references
+from ..projection import fields_parser, projection
+from ..pagination import NEXT_CURSOR_HEADER, list_parser, decode_cursor, \
+    page, stream
 from .dao import PoliciesDAO
 
 
@@ -28,13 +32,24 @@ policy = api.model('Policy', {
 class Policies(Resource):
     '''List all policies'''
     @api.doc('list_policies')
+    @api.expect(list_parser)
+    @api.header(NEXT_CURSOR_HEADER, 'Cursor of the next page, if any')
     @api.marshal_list_with(policy, skip_none=True)
     def get(self):
+        args = list_parser.parse_args()
+        after = decode_cursor(args['cursor'], 1)
         session = db.session
         policies = PoliciesDAO(session)
-        results = policies.list()
+        fields = projection() or {'name'}
+        if args['stream']:
+            results = policies.iterate(limit=args['limit'], after=after,
+                                       stream=True, fields=fields)
+            return stream(session, results, policy, skip_none=True)
+        results = policies.list(limit=args['limit'], after=after,
+                                fields=fields)
         session.commit()
-        return results
+        return results, 200, page(results, args['limit'],
+                                  lambda result: [result.name])
 
     '''Create a new policy'''
     @api.doc('create_policy')
@@ -54,11 +69,12 @@ class Policies(Resource):
 class Policy(Resource):
     '''Get the specified policy'''
     @api.doc('get_policy')
+    @api.expect(fields_parser)
     @api.marshal_with(policy)
     def get(self, name):
         session = db.session
         policies = PoliciesDAO(session)
-        policy = policies.get(name) or abort(404)
+        policy = policies.get(name, fields=projection()) or abort(404)
         session.commit()
         return policy
 
@@ -69,10 +85,10 @@ class Policy(Resource):
     def patch(self, name):
         session = db.session
         policies = PoliciesDAO(session)
-        policy = policies.get(name) or abort(404)
+        current = policies.get(name) or abort(404)
         data = api.payload
-        data.pop('name')
-        policy = policies.update(name, **data)
+        data.pop('name', None)
+        policy = policies.update(name, current=current, **data)
         session.commit()
         return policy
 
@@ -82,10 +98,91 @@ class Policy(Resource):
     def delete(self, name):
         session = db.session
         policies = PoliciesDAO(session)
-        policy = policies.get(name) or abort(404)
-        policies.delete(policy)
+        policy = policies.delete(name) or abort(404)
         session.commit()
         return policy
 
 
-__all__ = ['api', 'Policies', 'Policy', 'policy', 'policy_rule']
+@api.route('/<string:name>/users/<string:user>')
+class PolicyUser(Resource):
+    '''Attach policy to user'''
+    @api.doc('attach_policy_user')
+    @api.response(204, 'Success')
+    def post(self, name, user):
+        session = db.session
+        policies = PoliciesDAO(session)
+        with references(session):
+            policies.add_user(name, user)
+        session.commit()
+        return None, 204
+
+    '''Detach policy from user'''
+    @api.doc('detach_policy_user')
+    @api.response(204, 'Success')
+    def delete(self, name, user):
+        session = db.session
+        policies = PoliciesDAO(session)
+        policies.remove_user(name, user)
+        session.commit()
+        return None, 204
+
+
+@api.route('/<string:name>/groups/<string:group>')
+class PolicyGroup(Resource):
+    '''Attach policy to group'''
+    @api.doc('attach_policy_group')
+    @api.response(204, 'Success')
+    def post(self, name, group):
+        session = db.session
+        policies = PoliciesDAO(session)
+        with references(session):
+            policies.add_group(name, group)
+        session.commit()
+        return None, 204
+
+    '''Detach policy from group'''
+    @api.doc('detach_policy_group')
+    @api.response(204, 'Success')
+    def delete(self, name, group):
+        session = db.session
+        policies = PoliciesDAO(session)
+        policies.remove_group(name, group)
+        session.commit()
+        return None, 204
+
+
+def rule_fields(data):
+    '''The fields of a validated rule, ignoring any others'''
+    return dict(effect=data['effect'], action=data['action'],
+                resource=data['resource'],
+                precedence=data.get('precedence', 0))
+
+
+@api.route('/<string:name>/rules')
+class PolicyRules(Resource):
+    '''Add rule to policy'''
+    @api.doc('add_policy_rule')
+    @api.expect(policy_rule, validate=True)
+    @api.response(204, 'Success')
+    def post(self, name):
+        session = db.session
+        policies = PoliciesDAO(session)
+        with references(session):
+            policies.add_rule(name, **rule_fields(api.payload))
+        session.commit()
+        return None, 204
+
+    '''Remove rule from policy'''
+    @api.doc('remove_policy_rule')
+    @api.expect(policy_rule, validate=True)
+    @api.response(204, 'Success')
+    def delete(self, name):
+        session = db.session
+        policies = PoliciesDAO(session)
+        policies.remove_rule(name, **rule_fields(api.payload))
+        session.commit()
+        return None, 204
+
+
+__all__ = ['api', 'Policies', 'Policy', 'PolicyUser', 'PolicyGroup',
+           'PolicyRules', 'policy', 'policy_rule']
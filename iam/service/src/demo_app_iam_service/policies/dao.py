@@ -1,126 +1,286 @@
-from ..db import policy_table, rule_table, \
-    user_policy_table, group_policy_table
+from sqlalchemy.dialects.postgresql import aggregate_order_by, insert
+from sqlalchemy.sql import func, select, tuple_
+
+from .. import generations
+from ..db import aggregate, keyset, link, synchronize, unlink, \
+    policy_table, rule_table, user_policy_table, group_policy_table
+
+
+KEY = [policy_table.c.name]
+
+
+RULE = [
+    rule_table.c.effect,
+    rule_table.c.action,
+    rule_table.c.resource,
+    rule_table.c.precedence,
+]
+
+
+def unique(rules):
+    # Rules are keyed by their full contents, so repeats collapse
+    return sorted(set(
+        (rule['effect'], rule['action'], rule['resource'],
+         rule.get('precedence', 0))
+        for rule in rules
+    ))
 
 
 class Policy(object):
+    __slots__ = ('name', 'users', 'groups', 'rules')
+
     def __init__(self, name, users=None, groups=None, rules=None):
         self.name = name
         self.users = users
         self.groups = groups
         self.rules = rules
 
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            name=row['name'],
+            **{field: row[field] or []
+               for field in ('users', 'groups', 'rules')
+               if field in row.keys()}
+        )
+
 
 class PoliciesDAO(object):
     def __init__(self, session):
         self.session = session
 
-    def get(self, name):
-        session = self.session
+    def query(self, fields=None):
+        # The policy with its attachments and rules aggregated into one row,
+        # leaving out whatever wasn't asked for
+        columns = [policy_table.c.name]
 
-        policy = session.execute(
-            policy_table.select()
-            .where(policy_table.c.name == name)
+        if fields is None or 'users' in fields:
+            columns.append(
+                aggregate(user_policy_table.c.user,
+                          user_policy_table.c.policy == policy_table.c.name)
+                .label('users'))
+
+        if fields is None or 'groups' in fields:
+            columns.append(
+                aggregate(group_policy_table.c.group,
+                          group_policy_table.c.policy == policy_table.c.name)
+                .label('groups'))
+
+        if fields is None or 'rules' in fields:
+            columns.append(
+                select([
+                    func.json_agg(aggregate_order_by(
+                        func.json_build_object(
+                            'effect', rule_table.c.effect,
+                            'action', rule_table.c.action,
+                            'resource', rule_table.c.resource,
+                            'precedence', rule_table.c.precedence,
+                        ),
+                        *RULE
+                    ))
+                ]).where(rule_table.c.policy == policy_table.c.name)
+                .as_scalar()
+                .label('rules'))
+
+        return select(columns)
+
+    def get(self, name, fields=None):
+        policy = self.session.execute(
+            self.query(fields).where(policy_table.c.name == name)
         ).first()
 
         if not policy:
             return None
 
-        users = map(
-            lambda row: row['user'],
-            session.execute(
-                user_policy_table.select()
-                .where(user_policy_table.c.policy == name)
-            )
-        )
+        return Policy.from_row(policy)
 
-        groups = map(
-            lambda row: row['group'],
-            session.execute(
-                group_policy_table.select()
-                .where(group_policy_table.c.policy == name)
-            )
-        )
+    def list(self, limit=None, after=None, fields=('name',)):
+        return list(self.iterate(limit=limit, after=after, fields=fields))
 
-        rules = map(
-            lambda row: {
-                'effect': row['effect'],
-                'action': row['action'],
-                'resource': row['resource'],
-                'precedence': row['precedence']
-            },
-            session.execute(
-                rule_table.select()
-                .where(rule_table.c.policy == name)
-            )
-        )
+    def iterate(self, limit=None, after=None, stream=False, fields=('name',)):
+        # Listings are of names only, unless more fields are asked for
+        query = keyset(self.query(fields), KEY, limit=limit, after=after) \
+            .execution_options(stream_results=stream)
 
-        return Policy(
-            name=policy['name'],
-            users=list(users),
-            groups=list(groups),
-            rules=list(rules)
-        )
+        for row in self.session.execute(query):
+            yield Policy.from_row(row)
 
-    def list(self):
-        return list(map(
-            lambda policy: Policy(
-                name=policy['name'],
-                users=None,
-                groups=None,
-                rules=None
-            ),
-            self.session.execute(policy_table.select())
-        ))
-
-    def update(self, name, rules=None, users=None, groups=None):
+    def update(self, name, rules=None, users=None, groups=None,
+               current=None):
         session = self.session
 
-        policy = session.execute(
-            policy_table
-            .select()
-            .where(policy_table.c.name == name)
-        ).first()
+        if rules is not None or users is not None or groups is not None:
+            # Groups detached as well as those attached
+            attached = set(groups or ())
+            if groups is not None:
+                attached.update(row['group'] for row in session.execute(
+                    select([group_policy_table.c.group])
+                    .where(group_policy_table.c.policy == name)
+                ))
+            generations.lock(session, policies=[name], groups=attached,
+                             rules=rules is not None)
 
-        if not policy:
-            session.execute(
-                policy_table
-                .insert()
+        # The result is assembled from what was written and the policy's
+        # prior state, which callers may pass in if they already have it.
+        if current is None:
+            created = session.execute(
+                insert(policy_table)
                 .values(name=name)
-            )
+                .on_conflict_do_nothing()
+            ).rowcount
+
+            current = Policy(name, users=[], groups=[], rules=[]) \
+                if created else self.get(name)
+
+        rules_changed = False
+        users_changed = set()
+        groups_changed = set()
 
         if rules is not None:
-            session.execute(rule_table.delete()
-                            .where(rule_table.c.policy == name))
-            for rule in rules:
-                rule['policy'] = name
-                session.execute(rule_table.insert().values(**rule))
+            rules_changed = self.synchronize_rules(name, rules)
+            rules = [
+                {'effect': effect, 'action': action, 'resource': resource,
+                 'precedence': precedence}
+                for effect, action, resource, precedence in unique(rules)
+            ]
 
         if users is not None:
-            session.execute(user_policy_table.delete()
-                            .where(user_policy_table.c.policy == name))
-            for user in users:
-                session.execute(user_policy_table.insert()
-                                .values({'user': user, 'policy': name}))
+            added, removed = synchronize(session,
+                                         user_policy_table.c.policy, name,
+                                         user_policy_table.c.user, users)
+            users_changed.update(added, removed)
+            users = sorted(set(users))
 
         if groups is not None:
-            session.execute(group_policy_table.delete()
-                            .where(group_policy_table.c.policy == name))
-            for group in groups:
-                session.execute(group_policy_table.insert()
-                                .values({'group': group, 'policy': name}))
+            added, removed = synchronize(session,
+                                         group_policy_table.c.policy, name,
+                                         group_policy_table.c.group, groups)
+            groups_changed.update(added, removed)
+            groups = sorted(set(groups))
+
+        # Attachment changes only affect the principals attached or
+        # detached, but changed rules affect everyone the policy applies to
+        affected_users, affected_groups = generations.principals(
+            session, groups=groups_changed,
+            policies=[name] if rules_changed else [])
+        generations.bump(session,
+                         users=affected_users | users_changed,
+                         groups=affected_groups)
 
-        return self.get(name)
+        return Policy(
+            name=name,
+            users=current.users if users is None else users,
+            groups=current.groups if groups is None else groups,
+            rules=current.rules if rules is None else rules
+        )
+
+    def synchronize_rules(self, name, rules):
+        session = self.session
+        wanted = unique(rules)
+
+        delete = rule_table.delete().where(rule_table.c.policy == name)
+        if wanted:
+            delete = delete.where(tuple_(*RULE).notin_(wanted))
+        removed = session.execute(delete).rowcount
+
+        added = 0
+        if wanted:
+            added = session.execute(
+                insert(rule_table)
+                .values([
+                    {'policy': name, 'effect': effect, 'action': action,
+                     'resource': resource, 'precedence': precedence}
+                    for effect, action, resource, precedence in wanted
+                ])
+                .on_conflict_do_nothing()
+            ).rowcount
+
+        return bool(added or removed)
+
+    def add_user(self, name, user):
+        generations.lock(self.session, policies=[name])
+        if link(self.session, user_policy_table, user=user, policy=name):
+            generations.bump(self.session, users=[user])
+
+    def remove_user(self, name, user):
+        generations.lock(self.session, policies=[name])
+        if unlink(self.session, user_policy_table, user=user, policy=name):
+            generations.bump(self.session, users=[user])
+
+    def add_group(self, name, group):
+        generations.lock(self.session, policies=[name], groups=[group])
+        if link(self.session, group_policy_table, group=group, policy=name):
+            self.bump_group(group)
+
+    def remove_group(self, name, group):
+        generations.lock(self.session, policies=[name], groups=[group])
+        if unlink(self.session, group_policy_table,
+                  group=group, policy=name):
+            self.bump_group(group)
+
+    def add_rule(self, name, effect, action, resource, precedence=0):
+        generations.lock(self.session, policies=[name], rules=True)
+        if link(self.session, rule_table, policy=name, effect=effect,
+                action=action, resource=resource, precedence=precedence):
+            self.bump_attached(name)
+
+    def remove_rule(self, name, effect, action, resource, precedence=0):
+        generations.lock(self.session, policies=[name], rules=True)
+        if unlink(self.session, rule_table, policy=name, effect=effect,
+                  action=action, resource=resource, precedence=precedence):
+            self.bump_attached(name)
+
+    def bump_attached(self, name):
+        users, groups = generations.principals(self.session, policies=[name])
+        generations.bump(self.session, users=users, groups=groups)
+
+    def bump_group(self, group):
+        users, groups = generations.principals(self.session, groups=[group])
+        generations.bump(self.session, users=users, groups=groups)
 
     def delete(self, name):
         session = self.session
-        session.execute(rule_table.delete()
-                        .where(rule_table.c.policy == name))
-        session.execute(user_policy_table.delete()
-                        .where(user_policy_table.c.policy == name))
-        session.execute(group_policy_table.delete()
-                        .where(group_policy_table.c.policy == name))
-        session.execute(policy_table.delete()
-                        .where(policy_table.c.name == name))
+        generations.lock(session, policies=[name], rules=True)
+
+        # Deleted rows are returned, so the deleted policy and the
+        # principals it applied to are known without reading them first.
+        rules = session.execute(
+            rule_table.delete()
+            .where(rule_table.c.policy == name)
+            .returning(*RULE)
+        )
+        rules = [
+            {'effect': effect, 'action': action, 'resource': resource,
+             'precedence': precedence}
+            for effect, action, resource, precedence in sorted(rules)
+        ]
+
+        users = session.execute(
+            user_policy_table.delete()
+            .where(user_policy_table.c.policy == name)
+            .returning(user_policy_table.c.user)
+        )
+        users = sorted(row['user'] for row in users)
+
+        groups = session.execute(
+            group_policy_table.delete()
+            .where(group_policy_table.c.policy == name)
+            .returning(group_policy_table.c.group)
+        )
+        groups = sorted(row['group'] for row in groups)
+
+        deleted = session.execute(
+            policy_table.delete()
+            .where(policy_table.c.name == name)
+        ).rowcount
+
+        if not deleted:
+            return None
+
+        members, nested = generations.principals(session, groups=groups)
+        generations.bump(session, users=members.union(users), groups=nested)
+
+        return Policy(name=name, users=users, groups=groups, rules=rules)
 
 
 __all__ = ['PoliciesDAO']
@@ -0,0 +1,204 @@
+from collections import deque
+from cProfile import Profile
+from flask import abort, current_app, jsonify, make_response, request
+from hmac import compare_digest
+from io import StringIO
+from itertools import count
+from marshal import dumps, loads
+from os import getpid
+from pstats import Stats
+from random import random
+from threading import Lock
+from time import perf_counter, time
+
+
+TOKEN_HEADER = 'X-Profile-Token'
+
+TOKEN_ENVIRON = 'HTTP_X_PROFILE_TOKEN'
+
+PROFILES_PATH = '/debug/profiles'
+
+SORT_KEYS = ['cumulative', 'tottime', 'calls', 'ncalls']
+
+
+def matches(given, token):
+    '''Whether a token given by a client is the configured one, compared
+    as bytes since compare_digest only takes ASCII strings'''
+    return compare_digest(given.encode('utf-8', 'surrogateescape'),
+                          token.encode('utf-8', 'surrogateescape'))
+
+
+class Profiles(object):
+    '''Ring buffer of the most recent request profiles of this process
+
+    Each uwsgi worker keeps its own, so the list shows the worker's pid.
+    '''
+    def __init__(self, size):
+        self.entries = deque(maxlen=size)
+        self.lock = Lock()
+        self.ids = count(1)
+
+    def add(self, entry, profile):
+        profile.create_stats()
+        data = dumps(profile.stats)
+
+        with self.lock:
+            entry['id'] = '{}-{}'.format(getpid(), next(self.ids))
+            entry['size'] = len(data)
+            self.entries.append((entry, data))
+
+    def list(self):
+        with self.lock:
+            return [dict(entry) for entry, _ in reversed(self.entries)]
+
+    def get(self, id):
+        with self.lock:
+            for entry, data in self.entries:
+                if entry['id'] == id:
+                    return entry, data
+        return None
+
+
+class ProfiledResponse(object):
+    '''Iterates a response with the profiler enabled, so streamed bodies
+    are included, and saves the profile once the response is closed'''
+    def __init__(self, profiles, profile, entry, iterable):
+        self.profiles = profiles
+        self.profile = profile
+        self.entry = entry
+        self.iterator = iter(iterable)
+        self.iterable = iterable
+        self.started = perf_counter()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        self.profile.enable()
+        try:
+            return next(self.iterator)
+        finally:
+            self.profile.disable()
+
+    def close(self):
+        try:
+            if hasattr(self.iterable, 'close'):
+                self.profile.enable()
+                try:
+                    self.iterable.close()
+                finally:
+                    self.profile.disable()
+        finally:
+            self.entry['duration'] += perf_counter() - self.started
+            self.profiles.add(self.entry, self.profile)
+
+
+class ProfilingMiddleware(object):
+    '''Profiles requests carrying the profiling token, and a sample of all
+    requests when a sample rate is configured'''
+    def __init__(self, app, wsgi_app):
+        self.app = app
+        self.wsgi_app = wsgi_app
+        self.profiles = Profiles(app.config['PROFILING_BUFFER_SIZE'])
+
+    def triggered(self, environ):
+        config = self.app.config
+        token = config['PROFILING_TOKEN']
+        if token and matches(environ.get(TOKEN_ENVIRON, ''), token):
+            return True
+        rate = config['PROFILING_SAMPLE_RATE']
+        return rate > 0 and random() < rate
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO', '').startswith(PROFILES_PATH) or \
+                not self.triggered(environ):
+            return self.wsgi_app(environ, start_response)
+
+        entry = {
+            'method': environ.get('REQUEST_METHOD'),
+            'path': environ.get('PATH_INFO'),
+            'query': environ.get('QUERY_STRING'),
+            'timestamp': time(),
+            'status': None,
+        }
+
+        def profiled_start_response(status, headers, exc_info=None):
+            entry['status'] = int(status.split(' ', 1)[0])
+            return start_response(status, headers, exc_info)
+
+        profile = Profile()
+        started = perf_counter()
+        profile.enable()
+        try:
+            iterable = self.wsgi_app(environ, profiled_start_response)
+        finally:
+            profile.disable()
+        entry['duration'] = perf_counter() - started
+
+        return ProfiledResponse(self.profiles, profile, entry, iterable)
+
+
+def profiles():
+    '''The ring buffer of the app, after checking the request's token'''
+    token = current_app.config['PROFILING_TOKEN']
+    if not token:
+        abort(404)
+    if not matches(request.headers.get(TOKEN_HEADER, ''), token):
+        abort(403)
+    return current_app.extensions['profiles']
+
+
+class ProfileData(object):
+    # What pstats.Stats accepts to load already collected stats
+    def __init__(self, data):
+        self.stats = loads(data)
+
+    def create_stats(self):
+        pass
+
+
+def list_profiles():
+    return jsonify(profiles=profiles().list())
+
+
+def get_profile(id):
+    found = profiles().get(id)
+    if found is None:
+        abort(404)
+    entry, data = found
+
+    if request.args.get('format') != 'text':
+        # The format of cProfile's dump_stats, read by pstats and snakeviz
+        response = make_response(data)
+        response.mimetype = 'application/octet-stream'
+        response.headers['Content-Disposition'] = \
+            'attachment; filename={}.prof'.format(id)
+        return response
+
+    sort = request.args.get('sort', 'cumulative')
+    if sort not in SORT_KEYS:
+        abort(400)
+
+    stats = StringIO()
+    Stats(stream=stats).add(ProfileData(data)).sort_stats(sort) \
+        .print_stats(request.args.get('limit', 50, type=int))
+    response = make_response('{} {} ({:.1f}ms)\n{}'.format(
+        entry['method'], entry['path'], entry['duration'] * 1000,
+        stats.getvalue()))
+    response.mimetype = 'text/plain'
+    return response
+
+
+def profile_requests(app):
+    '''Profile requests on demand, keeping the latest profiles to list and
+    download at /debug/profiles'''
+    middleware = ProfilingMiddleware(app, app.wsgi_app)
+    app.wsgi_app = middleware
+    app.extensions['profiles'] = middleware.profiles
+
+    app.add_url_rule(PROFILES_PATH, 'profiles', list_profiles)
+    app.add_url_rule(PROFILES_PATH + '/<id>', 'profile', get_profile)
+
+
+__all__ = ['TOKEN_HEADER', 'ProfilingMiddleware', 'Profiles',
+           'profile_requests']
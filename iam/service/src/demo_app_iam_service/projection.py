@@ -0,0 +1,33 @@
+from flask import abort, current_app, request
+from flask_restplus import reqparse
+from flask_restplus.mask import Mask, ParseError
+
+
+FIELDS_ARG = 'fields'
+
+
+fields_parser = reqparse.RequestParser()
+fields_parser.add_argument(FIELDS_ARG, type=str, location='args',
+                           help='Comma separated fields to return, '
+                                'e.g. email,groups')
+
+
+def mask():
+    '''The fields mask requested with ?fields= or the X-Fields header'''
+    return request.args.get(FIELDS_ARG) or \
+        request.headers.get(current_app.config['RESTPLUS_MASK_HEADER'])
+
+
+def projection():
+    '''Top-level field names requested by the caller, or None for all'''
+    value = mask()
+    if not value:
+        return None
+
+    try:
+        return set(Mask(value).keys())
+    except ParseError as error:
+        abort(400, str(error))
+
+
+__all__ = ['FIELDS_ARG', 'fields_parser', 'mask', 'projection']
@@ -0,0 +1,132 @@
+from flask import abort, current_app, g, request
+from random import sample
+from re import compile
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql import text
+from time import monotonic, sleep
+
+from .db import db
+
+
+# Returned by writes, and sent back by clients to read their own writes
+TOKEN_HEADER = 'X-Consistency-Token'
+
+LSN = compile(r'^[0-9A-Fa-f]{1,8}/[0-9A-Fa-f]{1,8}$')
+
+SAFE_METHODS = {'GET', 'HEAD', 'OPTIONS'}
+
+PRIMARY = 'primary'
+
+REPLICA = 'replica'
+
+POLL_INTERVAL = 0.01
+
+CURRENT_LSN = text('SELECT pg_current_wal_lsn()::text')
+
+# A server that isn't in recovery is the primary itself
+CAUGHT_UP = text('SELECT coalesce(pg_last_wal_replay_lsn() >= '
+                 'CAST(:lsn AS pg_lsn), NOT pg_is_in_recovery())')
+
+
+def use_primary(method):
+    '''Serve a read on the primary, e.g. because replicas can't LISTEN'''
+    method.database = PRIMARY
+    return method
+
+
+def use_replica(method):
+    '''Serve a read that isn't a GET on a replica'''
+    method.database = REPLICA
+    return method
+
+
+def replicas():
+    return [bind for bind in current_app.config['SQLALCHEMY_BINDS'] or ()
+            if bind.startswith(REPLICA)]
+
+
+def preference():
+    # Set by use_primary or use_replica on the resource method
+    view = current_app.view_functions.get(request.endpoint)
+    resource = getattr(view, 'view_class', None)
+    method = getattr(resource, request.method.lower(), None)
+    return getattr(method, 'database', None)
+
+
+def caught_up(replica, lsn):
+    try:
+        with db.get_engine(current_app, replica).connect() as connection:
+            return connection.scalar(CAUGHT_UP, lsn=lsn)
+    except DBAPIError:
+        current_app.logger.warning('Replica %s is unavailable', replica,
+                                   exc_info=True)
+        return False
+
+
+def choose(candidates, lsn):
+    '''A replica that has replayed `lsn`, waiting up to DB_REPLICA_MAX_WAIT
+    for one to catch up, or None to read from the primary'''
+    candidates = sample(candidates, len(candidates))
+    if lsn is None:
+        return candidates[0]
+
+    deadline = monotonic() + current_app.config['DB_REPLICA_MAX_WAIT']
+    while True:
+        for replica in candidates:
+            if caught_up(replica, lsn):
+                return replica
+        if monotonic() >= deadline:
+            return None
+        sleep(POLL_INTERVAL)
+
+
+def route_request():
+    candidates = replicas()
+    if not candidates:
+        return
+
+    preferred = preference()
+    if preferred == PRIMARY:
+        return
+    if preferred is None and request.method not in SAFE_METHODS:
+        g.writes = True
+        return
+
+    lsn = request.headers.get(TOKEN_HEADER)
+    if lsn is not None and not LSN.match(lsn):
+        abort(400, 'Invalid {} header'.format(TOKEN_HEADER))
+
+    g.replica = choose(candidates, lsn)
+
+
+def consistency_token(session):
+    '''The token for reading the writes committed so far, or None if
+    there are no replicas to read from'''
+    if not replicas():
+        return None
+    return session.execute(CURRENT_LSN).scalar()
+
+
+def add_token(response):
+    if g.get('writes') and response.status_code < 400:
+        token = consistency_token(db.session)
+        if token is not None:
+            response.headers[TOKEN_HEADER] = token
+    return response
+
+
+def route_requests(app):
+    '''Serve reads from the DB_REPLICA_URIS and everything else from the
+    primary
+
+    Writes return a consistency token, the primary's WAL position after
+    them. Reads sending it back are served by a replica which has replayed
+    that far, waiting for one up to DB_REPLICA_MAX_WAIT, and otherwise by
+    the primary.
+    '''
+    app.before_request(route_request)
+    app.after_request(add_token)
+
+
+__all__ = ['TOKEN_HEADER', 'consistency_token', 'route_requests',
+           'use_primary', 'use_replica']
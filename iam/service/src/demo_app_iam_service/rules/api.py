@@ -1,7 +1,11 @@
-from flask_restplus import Namespace, Resource, fields
+from flask_restplus import Resource, fields
 
 from ..db import db
+from ..namespace import Namespace
+from ..pagination import NEXT_CURSOR_HEADER, list_parser, decode_cursor, \
+    page, stream
 from ..policies.api import policy_rule
+from .cache import rules_cache
 from .dao import RulesDAO
 
 
@@ -15,17 +19,39 @@ rule = api.inherit('Rule', policy_rule, {
 })
 
 
+cache_stats = api.model('RulesCacheStats', {
+    'size': fields.Integer,
+    'maxsize': fields.Integer,
+    'ttl': fields.Float,
+    'hits': fields.Integer,
+    'misses': fields.Integer,
+    'evictions': fields.Integer,
+    'expirations': fields.Integer,
+})
+
+
 @api.route('/')
 class Rules(Resource):
     '''List policy rules'''
     @api.doc('list_policy_rules')
+    @api.expect(list_parser)
+    @api.header(NEXT_CURSOR_HEADER, 'Cursor of the next page, if any')
     @api.marshal_list_with(rule, skip_none=True)
     def get(self):
+        args = list_parser.parse_args()
+        after = decode_cursor(args['cursor'], 5)
         session = db.session
         rules = RulesDAO(session)
-        results = rules.list()
+        if args['stream']:
+            results = rules.iterate(limit=args['limit'], after=after,
+                                    stream=True)
+            return stream(session, results, rule, skip_none=True)
+        results = rules.list(limit=args['limit'], after=after)
         session.commit()
-        return results
+        return results, 200, page(
+            results, args['limit'],
+            lambda result: [result.policy, result.effect, result.action,
+                            result.resource, result.precedence])
 
     '''Create policy rule'''
     @api.doc('create_policy_rule')
@@ -46,8 +72,7 @@ class UserRules(Resource):
     @api.marshal_list_with(rule, skip_none=True)
     def get(self, user):
         session = db.session
-        rules = RulesDAO(session)
-        results = rules.list(user=user)
+        results = rules_cache().get(session, 'user', user).rules
         session.commit()
         return results
 
@@ -58,10 +83,19 @@ class GroupRules(Resource):
     @api.marshal_list_with(rule, skip_none=True)
     def get(self, group):
         session = db.session
-        rules = RulesDAO(session)
-        results = rules.list(group=group)
+        results = rules_cache().get(session, 'group', group).rules
         session.commit()
         return results
 
 
-__all__ = ['api', 'rule', 'Rules', 'UserRules', 'GroupRules']
+@api.route('/cache')
+class CacheStats(Resource):
+    '''Get this worker's effective rules cache statistics'''
+    @api.doc('get_rules_cache_stats')
+    @api.marshal_with(cache_stats)
+    def get(self):
+        return rules_cache().stats()
+
+
+__all__ = ['api', 'rule', 'cache_stats', 'Rules', 'UserRules', 'GroupRules',
+           'CacheStats']
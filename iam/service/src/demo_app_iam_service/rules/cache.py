@@ -0,0 +1,94 @@
+from collections import OrderedDict
+from flask import current_app
+from threading import Lock
+from time import monotonic
+
+from .. import generations
+from ..metrics import RULES_CACHE_ENTRIES, RULES_CACHE_EVICTIONS, \
+    RULES_CACHE_EXPIRATIONS, RULES_CACHE_REQUESTS
+from .dao import RulesDAO
+from .engine import RuleSet
+
+
+class RulesCache(object):
+    '''Bounded LRU cache of compiled effective rule sets per principal
+
+    Entries are tagged with the principal's generation when they were
+    loaded, and are only served while that generation is still current
+    in the database and the entry is younger than the TTL.
+    '''
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, session, kind, name):
+        principal = (kind, name)
+        generation = generations.get(session, kind, name)
+        now = monotonic()
+
+        with self.lock:
+            entry = self.entries.get(principal)
+            if entry is not None:
+                entry_generation, expires, rule_set = entry
+                if entry_generation == generation and expires > now:
+                    self.entries.move_to_end(principal)
+                    self.hits += 1
+                    RULES_CACHE_REQUESTS.labels('hit').inc()
+                    return rule_set
+                del self.entries[principal]
+                self.expirations += 1
+                RULES_CACHE_EXPIRATIONS.inc()
+            self.misses += 1
+            RULES_CACHE_REQUESTS.labels('miss').inc()
+
+        rules = RulesDAO(session)
+        rule_set = RuleSet(rules.list(**{kind: name}))
+
+        with self.lock:
+            if self.maxsize > 0:
+                self.entries[principal] = \
+                    (generation, now + self.ttl, rule_set)
+                self.entries.move_to_end(principal)
+                while len(self.entries) > self.maxsize:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+                    RULES_CACHE_EVICTIONS.inc()
+            RULES_CACHE_ENTRIES.set(len(self.entries))
+
+        return rule_set
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            RULES_CACHE_ENTRIES.set(0)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'size': len(self.entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+            }
+
+
+def rules_cache(app=None):
+    app = app or current_app
+    cache = app.extensions.get('rules_cache')
+    if cache is None:
+        cache = app.extensions['rules_cache'] = RulesCache(
+            app.config['RULES_CACHE_SIZE'],
+            app.config['RULES_CACHE_TTL'])
+    return cache
+
+
+__all__ = ['RulesCache', 'rules_cache']
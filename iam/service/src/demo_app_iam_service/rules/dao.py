@@ -1,10 +1,31 @@
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.sql import select, and_
 
-from ..db import user_policy_table, group_policy_table, user_group_table, \
-    rule_table
+from .. import generations
+from ..db import keyset, effective_rule_table, rule_table
+
+
+EFFECTIVE_RULE = [
+    effective_rule_table.c.policy,
+    effective_rule_table.c.effect,
+    effective_rule_table.c.action,
+    effective_rule_table.c.resource,
+    effective_rule_table.c.precedence,
+]
+
+KEY = [
+    rule_table.c.policy,
+    rule_table.c.effect,
+    rule_table.c.action,
+    rule_table.c.resource,
+    rule_table.c.precedence,
+]
 
 
 class Rule(object):
+    __slots__ = ('policy', 'user', 'group', 'effect', 'action', 'resource',
+                 'precedence')
+
     def __init__(self, policy, user=None, group=None,
                  effect=None, action=None, resource=None,
                  precedence=None):
@@ -21,62 +42,47 @@ class RulesDAO(object):
     def __init__(self, session):
         self.session = session
 
-    def list(self, user=None, group=None):
+    def list(self, user=None, group=None, limit=None, after=None):
+        return list(self.iterate(user=user, group=group,
+                                 limit=limit, after=after))
+
+    def iterate(self, user=None, group=None, limit=None, after=None,
+                stream=False):
         if user is not None:
-            # Select the union of the user policy rules
-            # and group policy rules for the given user.
+            # Select the user's rules, each with the group it comes
+            # through unless it's from one of the user's own policies
             query = select([
-                user_group_table.c.user,
-                group_policy_table.c.group,
-                rule_table.c.policy,
-                rule_table.c.effect,
-                rule_table.c.action,
-                rule_table.c.resource,
-                rule_table.c.precedence,
-            ]).where(and_(
-                user_group_table.c.user == user,
-                user_group_table.c.group == group_policy_table.c.group,
-                group_policy_table.c.policy == rule_table.c.policy
-            )).union(
+                effective_rule_table.c.name.label('user'),
+                effective_rule_table.c.source.label('group'),
+            ] + EFFECTIVE_RULE).where(and_(
+                effective_rule_table.c.kind == 'user',
+                effective_rule_table.c.name == user,
+            ))
+        elif group is not None:
+            # Select the rules of the group and the groups it is nested in
+            query = select([
+                effective_rule_table.c.name.label('group'),
+            ] + EFFECTIVE_RULE).where(and_(
+                effective_rule_table.c.kind == 'group',
+                effective_rule_table.c.name == group,
+            ))
+        else:
+            # Select a page of all rules
+            query = keyset(
                 select([
-                    user_policy_table.c.user,
-                    None,
                     rule_table.c.policy,
                     rule_table.c.effect,
                     rule_table.c.action,
                     rule_table.c.resource,
                     rule_table.c.precedence,
-                ]).where(and_(
-                    user_policy_table.c.user == user,
-                    user_policy_table.c.policy == rule_table.c.policy
-                ))
+                ]),
+                KEY, limit=limit, after=after
             )
-        elif group is not None:
-            # Select the group's policy rules
-            query = select([
-                group_policy_table.c.group,
-                rule_table.c.policy,
-                rule_table.c.effect,
-                rule_table.c.action,
-                rule_table.c.resource,
-                rule_table.c.precedence,
-            ]).where(and_(
-                group_policy_table.c.group == group,
-                group_policy_table.c.policy == rule_table.c.policy
-            ))
-        else:
-            # Select all rules
-            query = select([
-                rule_table.c.policy,
-                rule_table.c.effect,
-                rule_table.c.action,
-                rule_table.c.resource,
-                rule_table.c.precedence,
-            ])
 
         # Execute query and transform result rows into Rule objects
-        policy_rules = map(
-            lambda row: Rule(
+        for row in self.session.execute(
+                query.execution_options(stream_results=stream)):
+            yield Rule(
                 user=('user' in row and row['user']) or None,
                 group=('group' in row and row['group']) or None,
                 policy=row['policy'],
@@ -84,12 +90,7 @@ class RulesDAO(object):
                 action=row['action'],
                 resource=row['resource'],
                 precedence=row['precedence']
-            ),
-            self.session.execute(query)
-        )
-
-        # Reify the Rule list map
-        return list(policy_rules)
+            )
 
     def create(self, **kwargs):
         policy = kwargs['policy']
@@ -98,26 +99,26 @@ class RulesDAO(object):
         action = kwargs['action']
         effect = kwargs['effect']
 
-        rule = self.session.execute(
-            rule_table.select().where(and_(
-                rule_table.c.effect == effect,
-                rule_table.c.action == action,
-                rule_table.c.resource == resource,
-                rule_table.c.precedence == precedence,
-                rule_table.c.policy == policy
-            ))
-        ).first()
-
-        if rule is None:
-            self.session.execute(
-                rule_table.insert().values(
-                    effect=effect,
-                    action=action,
-                    resource=resource,
-                    precedence=precedence,
-                    policy=policy
-                )
+        generations.lock(self.session, policies=[policy], rules=True)
+
+        # Rules are keyed by their full contents, so an existing rule is
+        # left untouched
+        created = self.session.execute(
+            insert(rule_table)
+            .values(
+                effect=effect,
+                action=action,
+                resource=resource,
+                precedence=precedence,
+                policy=policy
             )
+            .on_conflict_do_nothing()
+        ).rowcount
+
+        if created:
+            users, groups = \
+                generations.principals(self.session, policies=[policy])
+            generations.bump(self.session, users=users, groups=groups)
 
 
 __all__ = ['RulesDAO']
@@ -0,0 +1,148 @@
+import re
+from bisect import insort
+from collections import Counter
+from heapq import merge
+
+
+ALLOW = 'allow'
+
+DENY = 'deny'
+
+# Smaller rule sets are scanned, as that's quicker than the index lookups
+INDEX_THRESHOLD = 32
+
+
+def literal_prefix(pattern):
+    return pattern.split('*', 1)[0]
+
+
+def compile_pattern(pattern):
+    # Rule actions and resources are glob-like patterns where '*' matches
+    # any (possibly empty) sequence of characters.
+    return re.compile('.*'.join(map(re.escape, pattern.split('*'))) + r'\Z')
+
+
+class PrefixIndex(object):
+    '''Values keyed by the literal prefix of a pattern, up to its first '*'
+
+    Every pattern that can match a string has a key that is a prefix of
+    it, so finding them takes a lookup per distinct key length no longer
+    than the string, however many patterns there are.
+    '''
+    def __init__(self):
+        self.buckets = {}
+        self.lengths = []
+        self.keys = Counter()
+
+    def bucket(self, pattern, factory=list):
+        prefix = literal_prefix(pattern)
+        bucket = self.buckets.get(prefix)
+        if bucket is None:
+            bucket = self.buckets[prefix] = factory()
+            if not self.keys[len(prefix)]:
+                insort(self.lengths, len(prefix))
+            self.keys[len(prefix)] += 1
+        return bucket
+
+    def get(self, pattern):
+        return self.buckets.get(literal_prefix(pattern))
+
+    def discard(self, pattern):
+        '''Remove the bucket of a pattern's prefix'''
+        prefix = literal_prefix(pattern)
+        if self.buckets.pop(prefix, None) is not None:
+            self.keys[len(prefix)] -= 1
+            if not self.keys[len(prefix)]:
+                del self.keys[len(prefix)]
+                self.lengths.remove(len(prefix))
+
+    def find(self, string):
+        '''The buckets of all patterns that may match the string'''
+        buckets = self.buckets
+        found = []
+        for length in self.lengths:
+            if length > len(string):
+                break
+            bucket = buckets.get(string[:length])
+            if bucket is not None:
+                found.append(bucket)
+        return found
+
+
+class Decision(object):
+    def __init__(self, allowed, rule=None):
+        self.allowed = allowed
+        self.rule = rule
+
+    @property
+    def effect(self):
+        return ALLOW if self.allowed else DENY
+
+
+class RuleSet(object):
+    def __init__(self, rules, compile=compile_pattern):
+        self.rules = rules
+
+        # Order rules by descending precedence, and within a precedence
+        # level put denies (anything that isn't an allow) first, so that
+        # the first matching rule is the decision and deny-overrides never
+        # has to be resolved again.
+        ordered = sorted(
+            rules,
+            key=lambda rule: (-(rule.precedence or 0),
+                              (rule.effect or '').lower() == ALLOW)
+        )
+
+        self.compiled = [
+            ((rule.effect or '').lower() == ALLOW,
+             compile(rule.action).match,
+             compile(rule.resource).match,
+             rule)
+            for rule in ordered
+        ]
+
+        # Rules indexed by action prefix, then by resource prefix, each
+        # bucket holding rules in decision order along with their rank
+        self.index = None
+        if len(self.compiled) >= INDEX_THRESHOLD:
+            self.index = PrefixIndex()
+            for rank, compiled in enumerate(self.compiled):
+                rule = compiled[3]
+                resources = self.index.bucket(rule.action, PrefixIndex)
+                resources.bucket(rule.resource).append((rank,) + compiled)
+
+    def __reduce__(self):
+        # Compiled matchers aren't shipped between processes, only rules
+        return RuleSet, (self.rules,)
+
+    def scan(self, action, resource):
+        '''Decide by trying every rule in order'''
+        for allowed, match_action, match_resource, rule in self.compiled:
+            if match_action(action) and match_resource(resource):
+                return Decision(allowed, rule)
+
+        # Deny by default
+        return Decision(False)
+
+    def decide(self, action, resource):
+        if self.index is None:
+            return self.scan(action, resource)
+
+        buckets = [
+            bucket
+            for resources in self.index.find(action)
+            for bucket in resources.find(resource)
+        ]
+
+        # Only rules whose literal prefixes match are tried, still in
+        # decision order across the buckets
+        candidates = buckets[0] if len(buckets) == 1 else merge(*buckets)
+        for _, allowed, match_action, match_resource, rule in candidates:
+            if match_action(action) and match_resource(resource):
+                return Decision(allowed, rule)
+
+        return Decision(False)
+
+
+__all__ = ['ALLOW', 'DENY', 'Decision', 'PrefixIndex', 'RuleSet',
+           'compile_pattern']
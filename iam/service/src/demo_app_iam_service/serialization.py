@@ -0,0 +1,174 @@
+from collections.abc import Mapping
+from flask import current_app, json, make_response, request
+from flask_restplus import fields as restplus_fields
+from flask_restplus.inputs import boolean
+from flask_restplus.representations import output_json as restplus_json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+JSON = 'application/json'
+
+MSGPACK = 'application/msgpack'
+
+
+def dumps(data):
+    '''Encode data as compact JSON text'''
+    if orjson is not None:
+        try:
+            return orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS).decode()
+        except TypeError:
+            pass  # Types only Flask's encoder knows
+    return json.dumps(data, separators=(',', ':'), sort_keys=False)
+
+
+def output_json(data, code, headers=None):
+    '''Fast replacement for flask_restplus' JSON representation'''
+    # Pretty printing and custom encoder settings keep the original path
+    if current_app.debug or current_app.config.get('RESTPLUS_JSON'):
+        return restplus_json(data, code, headers)
+
+    response = make_response(dumps(data) + '\n', code)
+    response.headers.extend(headers or {})
+    response.mimetype = JSON
+    return response
+
+
+def negotiate():
+    '''The content type to answer the current request in'''
+    if msgpack is None:
+        return JSON
+    return request.accept_mimetypes.best_match([JSON, MSGPACK], JSON)
+
+
+def output_msgpack(data, code, headers=None):
+    response = make_response(msgpack.packb(data, use_bin_type=True), code)
+    response.headers.extend(headers or {})
+    response.mimetype = MSGPACK
+    return response
+
+
+def get_value(obj, key):
+    # Same lookup as flask_restplus: items of mappings, else attributes
+    if isinstance(obj, Mapping):
+        return obj.get(key)
+    return getattr(obj, key, None)
+
+
+def compile_value(field):
+    '''A function from a value to the field's output of it, equivalent to
+    flask_restplus' formatting for the common field types, or None'''
+    if field.attribute or callable(field.default):
+        return None
+
+    kind = type(field)
+
+    if kind in CONVERSIONS:
+        convert = CONVERSIONS[kind]
+        default = convert(field.default) if field.default else field.default
+
+        def output_scalar(value):
+            return default if value is None else convert(value)
+        return output_scalar
+
+    if kind is restplus_fields.Nested:
+        nested = compile_model(field.nested, skip_none=field.skip_none)
+        allow_null = field.allow_null
+        default = field.default
+
+        def output_nested(value):
+            if value is None:
+                if allow_null:
+                    return None
+                if default is not None:
+                    return default
+            return nested(value)
+        return output_nested
+
+    if kind is restplus_fields.List:
+        item = compile_value(field.container)
+        if item is None:
+            return None
+        default = field.default
+
+        def output_list(value):
+            if value is None:
+                return default
+            return [item(element) for element in value]
+        return output_list
+
+    return None
+
+
+def compile_field(name, field):
+    '''A function from an object to the field's output for it'''
+    field = field() if isinstance(field, type) else field
+    output = compile_value(field)
+
+    if output is None:
+        # Anything unusual is left to flask_restplus
+        return lambda obj: field.output(name, obj)
+
+    return lambda obj: output(get_value(obj, name))
+
+
+_models = {}
+
+
+def compile_model(model, skip_none=False):
+    '''A function serializing objects the way marshal(obj, model) does,
+    with the per-field dispatch worked out once instead of per object'''
+    cache_key = (id(model), skip_none)
+    compiled = _models.get(cache_key)
+    if compiled is not None:
+        return compiled[1]
+
+    outputs = [
+        (name, compile_field(name, field))
+        for name, field in getattr(model, 'resolved', model).items()
+    ]
+
+    if skip_none:
+        def serialize(obj):
+            data = {}
+            for name, output in outputs:
+                value = output(obj)
+                if value is not None and value != {}:
+                    data[name] = value
+            return data
+    else:
+        def serialize(obj):
+            return {name: output(obj) for name, output in outputs}
+
+    # The model is kept alongside, so its id isn't reused
+    _models[cache_key] = (model, serialize)
+    return serialize
+
+
+def serialize(data, model, skip_none=False):
+    '''Serialize an object, or a list of them, with the model'''
+    serialize_one = compile_model(model, skip_none=skip_none)
+    if isinstance(data, (list, tuple)):
+        return [serialize_one(item) for item in data]
+    return serialize_one(data)
+
+
+CONVERSIONS = {
+    restplus_fields.Raw: lambda value: value,
+    restplus_fields.String: str,
+    restplus_fields.Integer: int,
+    restplus_fields.Float: float,
+    restplus_fields.Boolean: boolean,
+}
+
+
+__all__ = ['JSON', 'MSGPACK', 'compile_model', 'dumps', 'negotiate',
+           'output_json', 'output_msgpack', 'serialize']
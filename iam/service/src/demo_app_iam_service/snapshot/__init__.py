@@ -0,0 +1,351 @@
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict
+from flask import current_app
+from mmap import ACCESS_READ, mmap
+from os import fsync, replace, stat
+from os.path import abspath, basename, dirname
+from struct import Struct
+from tempfile import NamedTemporaryFile
+from threading import Lock
+from time import monotonic
+
+from sqlalchemy.sql import select
+
+from ..changes.dao import ChangesDAO
+from ..db import group_closure_table, group_policy_table, rule_table, \
+    user_group_table, user_policy_table
+from ..export.dao import ExportDAO
+from ..metrics import RULES_SNAPSHOT_LOADS, RULES_SNAPSHOT_REVISION, \
+    RULES_SNAPSHOT_STALE
+from ..rules.dao import Rule
+from ..rules.engine import ALLOW, RuleSet, compile_pattern
+
+
+# The file holds a header, then fixed-size records, then the UTF-8 bytes
+# of every distinct string. Records refer to strings by their index in
+# the sorted string table, so each string is stored once however many
+# rules and principals use it.
+#
+#   header      magic, version, revision and the count of each section
+#   offsets     strings + 1 offsets into the string bytes
+#   rules       policy, effect, action, resource and precedence
+#   principals  kind, name and a slice of the rule references, sorted
+#               by kind then name so principals are found by bisection
+#   references  rule indices of each principal in decision order
+#   strings     string bytes
+MAGIC = b'IAMR'
+
+VERSION = 1
+
+HEADER = Struct('<4sIQIIII')
+
+OFFSET = Struct('<I')
+
+RULE = Struct('<IIIIi')
+
+PRINCIPAL = Struct('<IIII')
+
+REFERENCE = Struct('<I')
+
+KINDS = ['user', 'group']
+
+
+def decision_order(rule):
+    # Same order RuleSet evaluates rules in
+    return -(rule[4] or 0), (rule[1] or '').lower() == ALLOW
+
+
+def build(session):
+    '''Read the effective rules of every principal and encode them,
+    returning the revision they were read at and the encoded bytes'''
+    revision = ExportDAO(session).begin()
+
+    rules = [tuple(row) for row in session.execute(select([
+        rule_table.c.policy,
+        rule_table.c.effect,
+        rule_table.c.action,
+        rule_table.c.resource,
+        rule_table.c.precedence,
+    ]))]
+
+    policy_rules = defaultdict(set)
+    for index, rule in enumerate(rules):
+        policy_rules[rule[0]].add(index)
+
+    attached_rules = defaultdict(set)
+    for group, policy in session.execute(
+            select([group_policy_table.c.group, group_policy_table.c.policy])):
+        attached_rules[group] |= policy_rules[policy]
+
+    # Groups get the rules of every group they are nested in, themselves
+    # included
+    group_rules = defaultdict(set)
+    for ancestor, descendant in session.execute(
+            select([group_closure_table.c.ancestor,
+                    group_closure_table.c.descendant])):
+        group_rules[descendant] |= attached_rules[ancestor]
+
+    user_rules = defaultdict(set)
+    for user, policy in session.execute(
+            select([user_policy_table.c.user, user_policy_table.c.policy])):
+        user_rules[user] |= policy_rules[policy]
+    for user, group in session.execute(
+            select([user_group_table.c.user, user_group_table.c.group])):
+        user_rules[user] |= group_rules[group]
+
+    principals = sorted(
+        (kind, name.encode(), sorted(indices,
+                                     key=lambda i: decision_order(rules[i])))
+        for kind, effective in enumerate([user_rules, group_rules])
+        for name, indices in effective.items() if indices
+    )
+
+    strings = sorted(
+        set(value for rule in rules for value in rule[:4]) |
+        set(name.decode() for _, name, _ in principals)
+    )
+    string_index = {string: index for index, string in enumerate(strings)}
+
+    data = bytearray(HEADER.pack(
+        MAGIC, VERSION, revision, len(strings), len(rules), len(principals),
+        sum(len(indices) for _, _, indices in principals)))
+
+    encoded = [string.encode() for string in strings]
+    offset = 0
+    data += OFFSET.pack(offset)
+    for string in encoded:
+        offset += len(string)
+        data += OFFSET.pack(offset)
+
+    for policy, effect, action, resource, precedence in rules:
+        data += RULE.pack(string_index[policy], string_index[effect],
+                          string_index[action], string_index[resource],
+                          precedence or 0)
+
+    first = 0
+    for kind, name, indices in principals:
+        data += PRINCIPAL.pack(kind, string_index[name.decode()],
+                               first, len(indices))
+        first += len(indices)
+
+    for _, _, indices in principals:
+        for index in indices:
+            data += REFERENCE.pack(index)
+
+    for string in encoded:
+        data += string
+
+    return revision, bytes(data)
+
+
+def publish(session, path):
+    '''Build a snapshot and atomically replace the one at `path` with it,
+    returning the revision of the published snapshot'''
+    revision, data = build(session)
+    session.commit()
+
+    # Written beside the target, so the rename can't cross file systems
+    directory = dirname(abspath(path))
+    prefix = '.{}.'.format(basename(path))
+    with NamedTemporaryFile(dir=directory, prefix=prefix,
+                            delete=False) as file:
+        file.write(data)
+        file.flush()
+        fsync(file.fileno())
+
+    replace(file.name, path)
+    return revision
+
+
+class MappedRules(object):
+    '''A published snapshot mapped read-only into memory
+
+    Every process mapping the same file shares its pages. Records are
+    decoded straight from the mapping when a principal is looked up, and
+    only the `maxsize` most recently used rule sets built from them are
+    kept per process, so the snapshot itself isn't copied into each.
+    '''
+    def __init__(self, path, maxsize=0):
+        with open(path, 'rb') as file:
+            self.buffer = mmap(file.fileno(), 0, access=ACCESS_READ)
+
+        magic, version, self.revision, self.strings, self.rules, \
+            self.principals, self.references = \
+            HEADER.unpack_from(self.buffer, 0)
+
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('Not a version {} rules snapshot: {}'
+                             .format(VERSION, path))
+
+        self.offsets_at = HEADER.size
+        self.rules_at = self.offsets_at + OFFSET.size * (self.strings + 1)
+        self.principals_at = self.rules_at + RULE.size * self.rules
+        self.references_at = \
+            self.principals_at + PRINCIPAL.size * self.principals
+        self.strings_at = \
+            self.references_at + REFERENCE.size * self.references
+
+        # Matchers are per process, but there is only one per pattern
+        self.patterns = {}
+
+        self.maxsize = maxsize
+        self.rule_sets = OrderedDict()
+        self.lock = Lock()
+
+    def string_bytes(self, index):
+        position = self.offsets_at + OFFSET.size * index
+        start, = OFFSET.unpack_from(self.buffer, position)
+        end, = OFFSET.unpack_from(self.buffer, position + OFFSET.size)
+        return self.buffer[self.strings_at + start:self.strings_at + end]
+
+    def string(self, index):
+        return self.string_bytes(index).decode()
+
+    def principal_key(self, index):
+        kind, name, _, _ = PRINCIPAL.unpack_from(
+            self.buffer, self.principals_at + PRINCIPAL.size * index)
+        return kind, self.string_bytes(name)
+
+    def __getitem__(self, index):
+        # Principal keys in order, as a sequence to bisect
+        return self.principal_key(index)
+
+    def __len__(self):
+        return self.principals
+
+    def find(self, kind, name):
+        key = (KINDS.index(kind), name.encode())
+        index = bisect_left(self, key)
+        if index < self.principals and self.principal_key(index) == key:
+            return index
+        return None
+
+    def compile(self, pattern):
+        matcher = self.patterns.get(pattern)
+        if matcher is None:
+            matcher = self.patterns[pattern] = compile_pattern(pattern)
+        return matcher
+
+    def rule(self, index):
+        policy, effect, action, resource, precedence = RULE.unpack_from(
+            self.buffer, self.rules_at + RULE.size * index)
+        return Rule(policy=self.string(policy),
+                    effect=self.string(effect),
+                    action=self.string(action),
+                    resource=self.string(resource),
+                    precedence=precedence)
+
+    def rule_set(self, kind, name):
+        principal = (kind, name)
+        with self.lock:
+            rule_set = self.rule_sets.get(principal)
+            if rule_set is not None:
+                self.rule_sets.move_to_end(principal)
+                return rule_set
+
+        rule_set = self.load(kind, name)
+
+        with self.lock:
+            if self.maxsize > 0:
+                self.rule_sets[principal] = rule_set
+                while len(self.rule_sets) > self.maxsize:
+                    self.rule_sets.popitem(last=False)
+
+        return rule_set
+
+    def load(self, kind, name):
+        index = self.find(kind, name)
+        if index is None:
+            return RuleSet([])
+
+        _, _, first, count = PRINCIPAL.unpack_from(
+            self.buffer, self.principals_at + PRINCIPAL.size * index)
+        rules = [
+            self.rule(REFERENCE.unpack_from(
+                self.buffer,
+                self.references_at + REFERENCE.size * reference)[0])
+            for reference in range(first, first + count)
+        ]
+        return RuleSet(rules, compile=self.compile)
+
+
+class RulesSnapshot(object):
+    '''Follows the snapshot published at a path, remapping it when a newer
+    one replaces it, at most once per check interval
+
+    At the same checks the latest revision of the change log is read, and
+    once the snapshot has been behind it for longer than `max_lag` seconds,
+    as when nothing is publishing any more, no snapshot is returned until a
+    newer one is.
+    '''
+    def __init__(self, path, interval, cache_size=0, max_lag=0):
+        self.path = path
+        self.interval = interval
+        self.cache_size = cache_size
+        self.max_lag = max_lag
+        self.lock = Lock()
+        self.checked = None
+        self.identity = None
+        self.mapped = None
+        self.head = 0
+        self.behind_since = None
+
+    def current(self, session=None):
+        now = monotonic()
+        if self.checked is None or now - self.checked >= self.interval:
+            with self.lock:
+                self.checked = now
+                self.check(session, now)
+
+        mapped = self.mapped
+        behind_since = self.behind_since
+        if mapped is not None and behind_since is not None \
+                and now - behind_since > self.max_lag:
+            RULES_SNAPSHOT_STALE.inc()
+            return None
+        return mapped
+
+    def check(self, session, now):
+        try:
+            status = stat(self.path)
+        except FileNotFoundError:
+            status = None
+
+        if status is not None:
+            identity = (status.st_dev, status.st_ino, status.st_mtime_ns)
+            if identity != self.identity:
+                # Readers holding the previous mapping keep using it until
+                # they are done, after which it is unmapped once released.
+                self.mapped = MappedRules(self.path, self.cache_size)
+                self.identity = identity
+                RULES_SNAPSHOT_LOADS.inc()
+                RULES_SNAPSHOT_REVISION.set(self.mapped.revision)
+
+        if self.mapped is None or session is None or self.max_lag <= 0:
+            return
+
+        self.head = max(self.head, ChangesDAO(session).revision())
+        if self.mapped.revision >= self.head:
+            self.behind_since = None
+        elif self.behind_since is None:
+            self.behind_since = now
+
+
+def rules_snapshot(app=None):
+    '''The app's shared rules snapshot, or None if none is configured'''
+    app = app or current_app
+    path = app.config['RULES_SNAPSHOT_PATH']
+    if not path:
+        return None
+
+    snapshot = app.extensions.get('rules_snapshot')
+    if snapshot is None:
+        snapshot = app.extensions['rules_snapshot'] = RulesSnapshot(
+            path, app.config['RULES_SNAPSHOT_CHECK_INTERVAL'],
+            app.config['RULES_SNAPSHOT_CACHE_SIZE'],
+            app.config['RULES_SNAPSHOT_MAX_LAG'])
+    return snapshot
+
+
+__all__ = ['MappedRules', 'RulesSnapshot', 'build', 'publish',
+           'rules_snapshot']
@@ -0,0 +1,36 @@
+from argparse import ArgumentParser
+
+from ..app import app
+from ..changes.dao import ChangesDAO
+from ..db import db
+from . import publish
+
+
+def main(argv=None):
+    parser = ArgumentParser(
+        prog='python -m demo_app_iam_service.snapshot',
+        description='Publish a shared snapshot of effective rules')
+    parser.add_argument('path', nargs='?',
+                        default=app.config['RULES_SNAPSHOT_PATH'],
+                        help='File to publish to, defaults to '
+                             'RULES_SNAPSHOT_PATH')
+    parser.add_argument('--watch', action='store_true',
+                        help='Publish again whenever the rules change')
+    options = parser.parse_args(argv)
+    if not options.path:
+        parser.error('no snapshot path given')
+
+    with app.app_context():
+        session = db.session
+        revision = publish(session, options.path)
+        print('Published revision', revision, flush=True)
+
+        while options.watch:
+            changes = ChangesDAO(session)
+            if changes.wait(revision, app.config['CHANGES_HEARTBEAT']):
+                revision = publish(session, options.path)
+                print('Published revision', revision, flush=True)
+
+
+if __name__ == '__main__':
+    main()
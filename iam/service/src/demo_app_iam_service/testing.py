@@ -0,0 +1,42 @@
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+@contextmanager
+def count_statements():
+    '''Collect the SQL statements executed within the block
+
+        with count_statements() as statements:
+            client.get('/users/v1/')
+        assert len(statements) == 1
+    '''
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(Engine, 'after_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(Engine, 'after_cursor_execute', record)
+
+
+@contextmanager
+def assert_max_statements(limit):
+    '''Fail if the block executes more than `limit` SQL statements
+
+        with assert_max_statements(3):
+            client.get('/policies/v1/example')
+    '''
+    with count_statements() as statements:
+        yield statements
+
+    if len(statements) > limit:
+        raise AssertionError(
+            '{} statements executed, expected at most {}:\n{}'.format(
+                len(statements), limit, '\n'.join(statements)))
+
+
+__all__ = ['assert_max_statements', 'count_statements']
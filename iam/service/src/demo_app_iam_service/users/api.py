@@ -1,7 +1,11 @@
-from flask_restplus import Namespace, Resource, fields
+from flask_restplus import Resource, fields
 from flask import abort
 
 from ..db import db
+from ..namespace import Namespace, references
+from ..projection import fields_parser, projection
+from ..pagination import NEXT_CURSOR_HEADER, list_parser, decode_cursor, \
+    page, stream
 from .dao import UsersDAO
 
 
@@ -19,13 +23,24 @@ user = api.model('User', {
 class Users(Resource):
     '''List all users visible to the caller'''
     @api.doc('list_users')
+    @api.expect(list_parser)
+    @api.header(NEXT_CURSOR_HEADER, 'Cursor of the next page, if any')
     @api.marshal_list_with(user, skip_none=True)
     def get(self):
+        args = list_parser.parse_args()
+        after = decode_cursor(args['cursor'], 1)
         session = db.session
         users = UsersDAO(session)
-        results = users.list()
+        fields = projection()
+        if args['stream']:
+            results = users.iterate(limit=args['limit'], after=after,
+                                    stream=True, fields=fields)
+            return stream(session, results, user, skip_none=True)
+        results = users.list(limit=args['limit'], after=after,
+                             fields=fields)
         session.commit()
-        return results
+        return results, 200, page(results, args['limit'],
+                                  lambda result: [result.email])
 
     '''Create a new user'''
     @api.doc('create_user')
@@ -45,11 +60,12 @@ class Users(Resource):
 class User(Resource):
     '''Get user'''
     @api.doc('get_user')
+    @api.expect(fields_parser)
     @api.marshal_with(user)
     def get(self, email):
         session = db.session
         users = UsersDAO(session)
-        user = users.get(email) or abort(404)
+        user = users.get(email, fields=projection()) or abort(404)
         session.commit()
         return user
 
@@ -60,10 +76,10 @@ class User(Resource):
     def patch(self, email):
         session = db.session
         users = UsersDAO(session)
-        user = users.get(email) or abort(404)
+        current = users.get(email) or abort(404)
         data = api.payload
-        data.pop('email')
-        user = users.update(email, **data)
+        data.pop('email', None)
+        user = users.update(email, current=current, **data)
         session.commit()
         return user
 
@@ -73,10 +89,57 @@ class User(Resource):
     def delete(self, email):
         session = db.session
         users = UsersDAO(session)
-        user = users.get(email) or abort(404)
-        users.delete(user)
+        user = users.delete(email) or abort(404)
         session.commit()
         return user
 
 
-__all__ = ['api', 'Users', 'User', 'user']
+@api.route('/<string:email>/groups/<string:group>')
+class UserGroup(Resource):
+    '''Add user to group'''
+    @api.doc('add_user_group')
+    @api.response(204, 'Success')
+    def post(self, email, group):
+        session = db.session
+        users = UsersDAO(session)
+        with references(session):
+            users.add_group(email, group)
+        session.commit()
+        return None, 204
+
+    '''Remove user from group'''
+    @api.doc('remove_user_group')
+    @api.response(204, 'Success')
+    def delete(self, email, group):
+        session = db.session
+        users = UsersDAO(session)
+        users.remove_group(email, group)
+        session.commit()
+        return None, 204
+
+
+@api.route('/<string:email>/policies/<string:policy>')
+class UserPolicy(Resource):
+    '''Attach policy to user'''
+    @api.doc('attach_user_policy')
+    @api.response(204, 'Success')
+    def post(self, email, policy):
+        session = db.session
+        users = UsersDAO(session)
+        with references(session):
+            users.add_policy(email, policy)
+        session.commit()
+        return None, 204
+
+    '''Detach policy from user'''
+    @api.doc('detach_user_policy')
+    @api.response(204, 'Success')
+    def delete(self, email, policy):
+        session = db.session
+        users = UsersDAO(session)
+        users.remove_policy(email, policy)
+        session.commit()
+        return None, 204
+
+
+__all__ = ['api', 'Users', 'User', 'UserGroup', 'UserPolicy', 'user']
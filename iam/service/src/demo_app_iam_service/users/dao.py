@@ -1,130 +1,174 @@
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.sql import select
 
-from ..db import user_table, user_group_table, user_policy_table
+from .. import generations
+from ..db import aggregate, keyset, link, synchronize, unlink, user_table, \
+    user_group_table, user_policy_table
+
+
+KEY = [user_table.c.email]
 
 
 class User(object):
+    __slots__ = ('email', 'groups', 'policies')
+
     def __init__(self, email, groups=None, policies=None):
         self.email = email
         self.groups = groups
         self.policies = policies
 
+    @classmethod
+    def from_row(cls, row):
+        return cls(
+            email=row['email'],
+            **{field: row[field] or []
+               for field in ('groups', 'policies') if field in row.keys()}
+        )
+
 
 class UsersDAO(object):
     def __init__(self, session):
         self.session = session
 
-    def get(self, email):
+    def query(self, fields=None):
+        # Each user with its memberships aggregated into a single row,
+        # leaving out memberships that weren't asked for
+        columns = [user_table.c.email]
+
+        if fields is None or 'groups' in fields:
+            columns.append(
+                aggregate(user_group_table.c.group,
+                          user_group_table.c.user == user_table.c.email)
+                .label('groups'))
+
+        if fields is None or 'policies' in fields:
+            columns.append(
+                aggregate(user_policy_table.c.policy,
+                          user_policy_table.c.user == user_table.c.email)
+                .label('policies'))
+
+        return select(columns)
+
+    def get(self, email, fields=None):
         user = self.session.execute(
-            select([user_table.c.email])
-            .where(user_table.c.email == email)
+            self.query(fields).where(user_table.c.email == email)
         ).first()
 
         if not user:
             return None
 
-        groups = map(
-            lambda user_group: user_group['group'],
-            self.session.execute(
-                select([user_group_table.c.group])
-                .where(user_group_table.c.user == email)
-            )
-        )
+        return User.from_row(user)
 
-        policies = map(
-            lambda user_policy: user_policy['policy'],
-            self.session.execute(
-                select([user_policy_table.c.policy])
-                .where(user_policy_table.c.user == email)
-            )
-        )
+    def list(self, limit=None, after=None, fields=None):
+        return list(self.iterate(limit=limit, after=after, fields=fields))
 
-        return User(
-            email=user['email'],
-            groups=list(groups),
-            policies=list(policies)
-        )
+    def iterate(self, limit=None, after=None, stream=False, fields=None):
+        query = keyset(self.query(fields), KEY, limit=limit, after=after) \
+            .execution_options(stream_results=stream)
 
-    def list(self):
-        session = self.session
-
-        rows = session.execute(
-            select([
-                user_table.c.email,
-                user_group_table.c.group,
-                user_policy_table.c.policy,
-            ]).select_from(
-                user_table
-                .outerjoin(user_group_table,
-                           user_table.c.email == user_group_table.c.user)
-                .outerjoin(user_policy_table,
-                           user_table.c.email == user_policy_table.c.user)
-            ).order_by(
-                user_table.c.email,
-                user_group_table.c.group,
-                user_policy_table.c.policy,
-            )
-        )
+        for row in self.session.execute(query):
+            yield User.from_row(row)
+
+    def update(self, email, groups=None, policies=None, current=None):
+        if groups is not None or policies is not None:
+            if current is None:
+                current = self.get(email)
+            self.lock(current or User(email, groups=[], policies=[]),
+                      groups, policies)
 
-        user = None
-        users = []
+        # The result is assembled from what was written and the user's
+        # prior state, which callers may pass in if they already have it.
+        if current is None:
+            created = self.session.execute(
+                insert(user_table)
+                .values(email=email)
+                .on_conflict_do_nothing()
+            ).rowcount
 
-        for row in rows:
-            email = row['email']
-            group = row['group']
-            policy = row['policy']
+            current = User(email, groups=[], policies=[]) if created \
+                else self.get(email)
 
-            if user is None or email != user.email:
-                user = User(email=email)
-                user.groups = []
-                user.policies = []
-                users.append(user)
+        if groups is not None:
+            synchronize(self.session,
+                        user_group_table.c.user, email,
+                        user_group_table.c.group, groups)
+            groups = sorted(set(groups))
 
-            if group is not None and group not in user.groups:
-                user.groups.append(row['group'])
+        if policies is not None:
+            synchronize(self.session,
+                        user_policy_table.c.user, email,
+                        user_policy_table.c.policy, policies)
+            policies = sorted(set(policies))
 
-            if policy is not None and policy not in user.policies:
-                user.policies.append(row['policy'])
+        generations.bump(self.session, users=[email])
 
-        return users
+        return User(
+            email=email,
+            groups=current.groups if groups is None else groups,
+            policies=current.policies if policies is None else policies
+        )
 
-    def update(self, email, groups=None, policies=None):
-        exists = self.session.execute(
-            user_table.select().where(user_table.c.email == email)
-        ).first()
+    def lock(self, current, groups=None, policies=None):
+        # Memberships left as well as those joined, see generations.lock
+        generations.lock(
+            self.session,
+            policies=set() if policies is None
+            else set(policies).union(current.policies),
+            groups=set() if groups is None
+            else set(groups).union(current.groups))
+
+    def add_group(self, email, group):
+        generations.lock(self.session, groups=[group])
+        if link(self.session, user_group_table, user=email, group=group):
+            generations.bump(self.session, users=[email])
+
+    def remove_group(self, email, group):
+        generations.lock(self.session, groups=[group])
+        if unlink(self.session, user_group_table, user=email, group=group):
+            generations.bump(self.session, users=[email])
+
+    def add_policy(self, email, policy):
+        generations.lock(self.session, policies=[policy])
+        if link(self.session, user_policy_table, user=email, policy=policy):
+            generations.bump(self.session, users=[email])
+
+    def remove_policy(self, email, policy):
+        generations.lock(self.session, policies=[policy])
+        if unlink(self.session, user_policy_table,
+                  user=email, policy=policy):
+            generations.bump(self.session, users=[email])
 
-        if not exists:
-            self.session.execute(
-                user_table.insert().values(email=email)
-            )
+    def delete(self, email):
+        current = self.get(email)
+        if current is None:
+            return None
+        self.lock(current, current.groups, current.policies)
 
-        if groups is not None:
-            self.session.execute(user_group_table.delete()
-                                 .where(user_group_table.c.user == email))
-            for group in groups:
-                self.session.execute(
-                    user_group_table.insert()
-                    .values(user=email, group=group)
-                )
+        policies = self.session.execute(
+            user_policy_table.delete()
+            .where(user_policy_table.c.user == email)
+            .returning(user_policy_table.c.policy)
+        )
+        policies = sorted(row['policy'] for row in policies)
 
-        if policies is not None:
-            self.session.execute(user_policy_table.delete()
-                                 .where(user_policy_table.c.user == email))
-            for policy in policies:
-                self.session.execute(
-                    user_policy_table.insert()
-                    .values(user=email, policy=policy)
-                )
+        groups = self.session.execute(
+            user_group_table.delete()
+            .where(user_group_table.c.user == email)
+            .returning(user_group_table.c.group)
+        )
+        groups = sorted(row['group'] for row in groups)
+
+        deleted = self.session.execute(
+            user_table.delete()
+            .where(user_table.c.email == email)
+        ).rowcount
+
+        if not deleted:
+            return None
 
-        return self.get(email)
+        generations.bump(self.session, users=[email])
 
-    def delete(self, email):
-        self.session.execute(user_policy_table.delete()
-                             .where(user_policy_table.c.user == email))
-        self.session.execute(user_group_table.delete()
-                             .where(user_group_table.c.user == email))
-        self.session.execute(user_table.delete()
-                             .where(user_table.c.email == email))
+        return User(email=email, groups=groups, policies=policies)
 
 
 __all__ = ['UsersDAO']
@@ -1,5 +1,17 @@
 #!/bin/sh
+# Workers write their metrics here to be aggregated by /metrics, starting
+# afresh each time so counts of earlier runs aren't reported
+export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/metrics}
+rm -rf "$PROMETHEUS_MULTIPROC_DIR"
+mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
+
+if [ -n "$RULES_SNAPSHOT_PATH" ]; then
+  # Keep the rules snapshot shared by the workers up to date
+  set -- --attach-daemon "python3 -m demo_app_iam_service.snapshot --watch"
+fi
+
 exec uwsgi --master \
   --processes $WORKER_PROCESSES \
   --module $UWSGI_MODULE \
-  --http $HOST:$PORT
+  --http $HOST:$PORT \
+  "$@"
@@ -0,0 +1,52 @@
+'''Fixtures for tests against a live database
+
+The tests run against SQLALCHEMY_DATABASE_URI, which they migrate to the
+latest revision and empty, so point it at a scratch database. They are
+skipped if it can't be reached.
+'''
+from pytest import fixture, skip
+from sqlalchemy import orm
+from sqlalchemy.exc import OperationalError
+
+from demo_app_iam_service import app, db
+from demo_app_iam_service.migrations import upgrade
+
+
+@fixture(scope='session')
+def database():
+    with app.app_context():
+        try:
+            upgrade()
+        except OperationalError as error:
+            skip('Database unavailable: {}'.format(error.orig))
+        yield db
+
+
+@fixture
+def empty(database):
+    tables = ', '.join('"{}"'.format(table.name)
+                       for table in database.metadata.sorted_tables)
+    database.session.execute('TRUNCATE {} CASCADE'.format(tables))
+    database.session.commit()
+    return database
+
+
+@fixture
+def client(empty):
+    return app.test_client()
+
+
+@fixture
+def sessions(empty):
+    '''Open sessions of their own, e.g. to run transactions concurrently'''
+    factory = orm.sessionmaker(bind=empty.engine)
+    opened = []
+
+    def session():
+        opened.append(factory())
+        return opened[-1]
+
+    yield session
+
+    for session in opened:
+        session.close()
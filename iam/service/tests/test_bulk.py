@@ -0,0 +1,69 @@
+'''Importing what was exported restores it, nesting included'''
+import json
+
+from demo_app_iam_service import app
+
+
+def ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True)
+            .splitlines() if line]
+
+
+def post(client, path, records):
+    body = ''.join(json.dumps(record) + '\n' for record in records)
+    return ndjson(client.post(path, data=body,
+                              content_type='application/x-ndjson'))
+
+
+def test_export_import_round_trip(client, monkeypatch):
+    # Batches of one, so groups are nested before the batch importing them
+    monkeypatch.setitem(app.config, 'BULK_BATCH_SIZE', 1)
+
+    client.post('/policies/v1/', json={'name': 'read', 'rules': [
+        {'effect': 'allow', 'action': 'read', 'resource': '*'}]})
+    for name in ['c', 'b', 'a']:
+        client.post('/groups/v1/', json={'name': name, 'policies': ['read']})
+    client.post('/groups/v1/a/groups/b')
+    client.post('/groups/v1/b/groups/c')
+    client.post('/users/v1/', json={'email': 'user@example.com',
+                                    'groups': ['c']})
+
+    exported = {
+        path: ndjson(client.get(path))
+        for path in ['/bulk/v1/policies', '/bulk/v1/groups',
+                     '/bulk/v1/users']
+    }
+
+    for path in ['/users/v1/user@example.com', '/groups/v1/a',
+                 '/groups/v1/b', '/groups/v1/c', '/policies/v1/read']:
+        assert client.delete(path).status_code == 200
+
+    # Each membership is listed on both sides, so policies are imported
+    # with their rules only, and groups without their users
+    imported = dict(exported)
+    imported['/bulk/v1/policies'] = [
+        {'name': record['name'], 'rules': record['rules']}
+        for record in exported['/bulk/v1/policies']
+    ]
+    imported['/bulk/v1/groups'] = [
+        dict(record, users=None) for record in exported['/bulk/v1/groups']
+    ]
+    for path, records in imported.items():
+        assert post(client, path, records)[-1]['failed'] == 0
+
+    for path, records in exported.items():
+        assert ndjson(client.get(path)) == records
+
+
+def test_import_rejects_nesting_cycles(client):
+    progress = post(client, '/bulk/v1/groups', [
+        {'name': 'a', 'groups': ['b']},
+        {'name': 'b', 'groups': ['a']},
+        {'name': 'c', 'groups': ['missing']},
+    ])
+
+    errors = [line for line in progress if 'error' in line]
+    assert [error['line'] for error in errors] == [2, 3]
+    assert progress[-1]['failed'] == 2
+    assert client.get('/groups/v1/a').get_json()['groups'] == ['b']
+    assert client.get('/groups/v1/b').get_json()['groups'] == []
@@ -0,0 +1,96 @@
+'''The materialized effective rules match the memberships, however the
+writes changing them interleave'''
+from threading import Thread
+
+from pytest import mark
+
+from demo_app_iam_service import effective
+from demo_app_iam_service.groups.dao import GroupsDAO
+from demo_app_iam_service.policies.dao import PoliciesDAO
+from demo_app_iam_service.users.dao import UsersDAO
+
+
+RULE = {'effect': 'deny', 'action': 'delete', 'resource': '*'}
+
+
+def populate(session):
+    PoliciesDAO(session).update('p', rules=[RULE])
+    groups = GroupsDAO(session)
+    groups.update('parent')
+    groups.update('g')
+    UsersDAO(session).update('u')
+    session.commit()
+
+
+def concurrently(sessions, first, second):
+    '''Run `second` while the transaction of `first` is open, letting it
+    either finish or wait before `first` commits'''
+    one, two = sessions(), sessions()
+    errors = []
+
+    def run():
+        try:
+            second(two)
+            two.commit()
+        except Exception as error:
+            errors.append(error)
+
+    first(one)
+    thread = Thread(target=run)
+    thread.start()
+    thread.join(0.5)
+    one.commit()
+    thread.join()
+    assert not errors
+
+
+@mark.parametrize('first, second', [
+    # Attaching a policy to a group, and adding a user to it
+    (lambda s: GroupsDAO(s).add_policy('g', 'p'),
+     lambda s: UsersDAO(s).add_group('u', 'g')),
+    (lambda s: UsersDAO(s).add_group('u', 'g'),
+     lambda s: PoliciesDAO(s).add_group('p', 'g')),
+    # Changing a policy's rules, and attaching it
+    (lambda s: PoliciesDAO(s).add_rule('p', 'allow', 'read', '*'),
+     lambda s: GroupsDAO(s).update('g', policies=['p'])),
+    (lambda s: PoliciesDAO(s).add_user('p', 'u'),
+     lambda s: PoliciesDAO(s).update('p', rules=[])),
+    # Nesting a group, and adding a user to it
+    (lambda s: GroupsDAO(s).add_group('parent', 'g'),
+     lambda s: UsersDAO(s).update('u', groups=['g'])),
+])
+def test_concurrent_writes(sessions, first, second):
+    session = sessions()
+    populate(session)
+    GroupsDAO(session).add_policy('parent', 'p')
+    session.commit()
+
+    concurrently(sessions, first, second)
+
+    assert list(effective.differences(session)) == []
+
+
+def test_writes_in_sequence(sessions):
+    session = sessions()
+    populate(session)
+    groups, policies, users = \
+        GroupsDAO(session), PoliciesDAO(session), UsersDAO(session)
+    groups.update('child')
+
+    for write in [
+        lambda: groups.add_policy('parent', 'p'),
+        lambda: groups.add_group('parent', 'g'),
+        lambda: groups.add_group('g', 'child'),
+        lambda: users.add_group('u', 'child'),
+        lambda: policies.add_rule('p', 'allow', 'read', '*'),
+        lambda: users.add_policy('u', 'p'),
+        lambda: policies.remove_rule('p', **RULE),
+        lambda: groups.update('g', groups=[]),
+        lambda: groups.update('parent', groups=['child']),
+        lambda: users.update('u', groups=['g'], policies=[]),
+        lambda: groups.delete('parent'),
+        lambda: policies.delete('p'),
+    ]:
+        write()
+        session.commit()
+        assert list(effective.differences(session)) == []
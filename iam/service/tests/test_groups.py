@@ -0,0 +1,77 @@
+'''Nesting groups keeps the closure of the nesting graph'''
+from pytest import raises
+from sqlalchemy.sql import select
+
+from demo_app_iam_service.db import group_closure_table
+from demo_app_iam_service.groups.dao import CycleError, GroupsDAO
+
+
+def closure(session):
+    return {
+        (row['ancestor'], row['descendant']): row['paths']
+        for row in session.execute(select([group_closure_table]))
+    }
+
+
+def create(session, *names):
+    groups = GroupsDAO(session)
+    for name in names:
+        groups.update(name)
+    session.commit()
+    return groups
+
+
+def test_closure_counts_paths(sessions):
+    session = sessions()
+    groups = create(session, 'a', 'b', 'c', 'd')
+
+    # a contains b and c, which both contain d
+    for group, member in [('a', 'b'), ('a', 'c'), ('b', 'd'), ('c', 'd')]:
+        assert groups.nest(group, member)
+    session.commit()
+
+    paths = closure(session)
+    assert paths[('a', 'd')] == 2
+    assert paths[('b', 'd')] == 1
+    assert all(paths[(name, name)] == 1 for name in 'abcd')
+
+    assert groups.unnest('a', 'b')
+    session.commit()
+    paths = closure(session)
+    assert paths[('a', 'd')] == 1
+    assert ('a', 'b') not in paths
+
+
+def test_nest_rejects_cycles(sessions):
+    session = sessions()
+    groups = create(session, 'a', 'b', 'c')
+    groups.nest('a', 'b')
+    groups.nest('b', 'c')
+    session.commit()
+
+    with raises(CycleError):
+        groups.nest('c', 'a')
+    session.rollback()
+    with raises(CycleError):
+        groups.nest('a', 'a')
+    session.rollback()
+
+    assert not groups.nest('a', 'b')
+
+
+def test_update_replaces_nesting_changed_since_read(sessions):
+    session, other = sessions(), sessions()
+    groups = create(session, 'a', 'b')
+    current = groups.get('a')
+    session.commit()
+
+    # Nested after the group was read, before it is updated
+    GroupsDAO(other).nest('a', 'b')
+    other.commit()
+
+    group = groups.update('a', groups=[], current=current)
+    session.commit()
+
+    assert group.groups == []
+    assert groups.get('a').groups == []
+    assert ('a', 'b') not in closure(session)
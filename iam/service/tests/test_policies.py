@@ -0,0 +1,29 @@
+'''Policy rules through the API'''
+from pytest import mark
+
+
+RULE = {'effect': 'allow', 'action': 'read', 'resource': '*'}
+
+
+@mark.parametrize('body', [
+    {'effect': 'allow', 'action': 'read'},
+    dict(RULE, precedence=None),
+    ['allow', 'read', '*'],
+])
+def test_invalid_rules_are_rejected(client, body):
+    client.post('/policies/v1/', json={'name': 'p'})
+    for method in [client.post, client.delete]:
+        response = method('/policies/v1/p/rules', json=body)
+        assert response.status_code == 400
+
+
+def test_unknown_rule_fields_are_ignored(client):
+    client.post('/policies/v1/', json={'name': 'p'})
+    response = client.post('/policies/v1/p/rules', json=dict(RULE, note='x'))
+    assert response.status_code == 204
+    assert client.get('/policies/v1/p').json['rules'] == [
+        dict(RULE, precedence=0)]
+
+    response = client.delete('/policies/v1/p/rules', json=dict(RULE, note='x'))
+    assert response.status_code == 204
+    assert client.get('/policies/v1/p').json['rules'] == []
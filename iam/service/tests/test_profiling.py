@@ -0,0 +1,17 @@
+'''Profiling requests on demand'''
+from pytest import mark
+
+from demo_app_iam_service import app
+from demo_app_iam_service.profiling import TOKEN_HEADER
+
+
+@mark.parametrize('token, status', [
+    ('secret', 200),
+    ('wrong', 403),
+    ('s\xe9cret', 403),
+])
+def test_profiles_require_the_token(monkeypatch, token, status):
+    monkeypatch.setitem(app.config, 'PROFILING_TOKEN', 'secret')
+    response = app.test_client().get('/debug/profiles',
+                                     headers={TOKEN_HEADER: token})
+    assert response.status_code == status
@@ -0,0 +1,83 @@
+'''Rules snapshots shared between workers'''
+from time import sleep
+
+from demo_app_iam_service.groups.dao import GroupsDAO
+from demo_app_iam_service.policies.dao import PoliciesDAO
+from demo_app_iam_service.rules.dao import RulesDAO
+from demo_app_iam_service.snapshot import MappedRules, RulesSnapshot, \
+    publish
+from demo_app_iam_service.users.dao import UsersDAO
+
+
+def rules(rule_set):
+    # Distinct, as the database lists a rule once per source
+    return sorted(set((rule.policy, rule.effect, rule.action, rule.resource,
+                       rule.precedence) for rule in rule_set))
+
+
+def test_snapshot_holds_the_effective_rules(sessions, tmp_path):
+    session = sessions()
+    policies = PoliciesDAO(session)
+    policies.update('read', rules=[
+        {'effect': 'allow', 'action': 'read', 'resource': '*'},
+        {'effect': 'deny', 'action': 'read', 'resource': 'secret/*',
+         'precedence': 1},
+    ])
+    policies.update('write', rules=[
+        {'effect': 'allow', 'action': 'write', 'resource': 'docs/*'},
+    ])
+    groups = GroupsDAO(session)
+    groups.update('staff', policies=['read'])
+    groups.update('editors', policies=['write'], groups=['staff'])
+    users = UsersDAO(session)
+    users.update('ann', groups=['editors'])
+    users.update('bob', groups=['staff'], policies=['write'])
+    users.update('cat')
+    session.commit()
+
+    path = str(tmp_path / 'rules')
+    revision = publish(session, path)
+    mapped = MappedRules(path)
+    assert mapped.revision == revision
+
+    dao = RulesDAO(session)
+    for kind, name in [('user', 'ann'), ('user', 'bob'), ('user', 'cat'),
+                       ('user', 'dan'), ('group', 'staff'),
+                       ('group', 'editors')]:
+        assert rules(mapped.rule_set(kind, name).rules) == \
+            rules(dao.list(**{kind: name}))
+    assert rules(mapped.rule_set('user', 'ann').rules) != []
+
+    decision = mapped.rule_set('user', 'bob').decide('read', 'secret/key')
+    assert decision.effect == 'deny'
+
+
+def test_snapshot_falling_behind_is_not_used(sessions, tmp_path):
+    path = str(tmp_path / 'rules')
+    session = sessions()
+    publish(session, path)
+
+    snapshot = RulesSnapshot(path, interval=0, max_lag=0.05)
+    mapped = snapshot.current(session)
+    assert mapped is not None
+
+    # Still used while it is only briefly behind
+    UsersDAO(session).update('u')
+    session.commit()
+    assert snapshot.current(session) is mapped
+
+    sleep(0.1)
+    assert snapshot.current(session) is None
+
+    publish(session, path)
+    assert snapshot.current(session).revision == mapped.revision + 1
+
+
+def test_decoded_rule_sets_are_bounded(sessions, tmp_path):
+    path = str(tmp_path / 'rules')
+    publish(sessions(), path)
+
+    mapped = MappedRules(path, maxsize=2)
+    for name in ['a', 'b', 'c']:
+        mapped.rule_set('user', name)
+    assert list(mapped.rule_sets) == [('user', 'b'), ('user', 'c')]
@@ -0,0 +1,66 @@
+'''Requests issue a fixed number of SQL statements, however many
+memberships the entities have'''
+from pytest import mark
+
+from demo_app_iam_service.testing import assert_max_statements, \
+    count_statements
+
+
+def populate(client, size):
+    '''Create a policy with `size` rules, attached to a group and to
+    `size` users, each of whom is also a member of the group'''
+    policy = 'policy{}'.format(size)
+    group = 'group{}'.format(size)
+    rules = [
+        {'effect': 'allow', 'action': 'service:{}'.format(index),
+         'resource': '*'}
+        for index in range(size)
+    ]
+    assert client.post('/policies/v1/', json={
+        'name': policy, 'rules': rules,
+    }).status_code == 201
+    assert client.post('/groups/v1/', json={
+        'name': group, 'policies': [policy],
+    }).status_code == 201
+    for index in range(size):
+        assert client.post('/users/v1/', json={
+            'email': 'user{}-{}@example.com'.format(size, index),
+            'groups': [group], 'policies': [policy],
+        }).status_code == 201
+
+
+@mark.parametrize('url', [
+    '/users/v1/user50-0@example.com',
+    '/groups/v1/group50',
+    '/policies/v1/policy50',
+])
+def test_get_is_one_statement(client, url):
+    populate(client, 50)
+    with assert_max_statements(1):
+        response = client.get(url)
+    assert response.status_code == 200
+
+
+@mark.parametrize('url', [
+    '/users/v1/missing@example.com',
+    '/groups/v1/missing',
+    '/policies/v1/missing',
+])
+def test_get_missing_is_one_statement(client, url):
+    with assert_max_statements(1):
+        response = client.get(url)
+    assert response.status_code == 404
+
+
+@mark.parametrize('url', ['/users/v1/', '/groups/v1/', '/policies/v1/'])
+def test_list_statements_do_not_grow_with_memberships(client, url):
+    populate(client, 2)
+    with count_statements() as small:
+        assert client.get(url).status_code == 200
+
+    populate(client, 50)
+    with count_statements() as large:
+        assert client.get(url).status_code == 200
+
+    assert len(large) == len(small)
+    assert len(small) <= 1